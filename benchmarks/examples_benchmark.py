@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Times logging prediction examples through TypedTable one row at a time and
+with add_rows, in the row and columnar layouts.
+
+    PYTHONPATH=. python benchmarks/examples_benchmark.py
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+
+from wandb import jsonlfile
+from wandb.typedtable import TypedTable
+
+COLUMNS = [("id", int), ("label", str), ("prediction", str), ("score", float)]
+
+
+def make_rows(n):
+    return [{"id": i, "label": "class%i" % (i % 10),
+             "prediction": "class%i" % (i * 7 % 10), "score": (i % 100) / 100.0}
+            for i in range(n)]
+
+
+def run(rows, batch, columnar):
+    out_dir = tempfile.mkdtemp()
+    try:
+        table = TypedTable(jsonlfile.JsonlFile(
+            "examples.jsonl", out_dir, columnar=columnar))
+        table.set_columns(COLUMNS)
+        start = time.time()
+        if batch:
+            for i in range(0, len(rows), 10000):
+                table.add_rows(rows[i:i + 10000])
+        else:
+            for row in rows:
+                table.add(row)
+        table.close()
+        elapsed = time.time() - start
+        size = os.path.getsize(os.path.join(out_dir, "examples.jsonl"))
+        return elapsed, size
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def main(n=100000):
+    rows = make_rows(n)
+    for name, batch, columnar in [("add", False, False),
+                                  ("add_rows", True, False),
+                                  ("add_rows columnar", True, True)]:
+        elapsed, size = run(rows, batch, columnar)
+        print("%-18s %6.2fs %8.0f rows/s %6.1fMB" % (
+            name, elapsed, n / elapsed, size / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""Compares util.json_dumps_safer with serialize.dumps on typical rows.
+
+    PYTHONPATH=. python benchmarks/serialize_benchmark.py
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import numpy as np
+
+from wandb import serialize
+from wandb import util
+
+ROWS = {
+    "scalars": {"loss": 0.123456789, "acc": 0.9, "lr": 1e-4, "epoch": 3,
+                "_step": 1000, "_runtime": 12.5, "_timestamp": 1528000000.123},
+    "numpy scalars": {"loss": np.float32(0.12345), "acc": np.float64(0.9),
+                      "correct": np.int64(1234), "_step": 1000},
+    "wide": dict(("layer%i.grad_norm" % i, np.float32(i) / 7) for i in range(500)),
+    "array": {"weights": np.random.rand(64, 64), "_step": 1},
+}
+
+
+def main(number=2000):
+    for name, row in sorted(ROWS.items()):
+        n = max(10, number // max(1, len(row) // 10))
+        baseline = timeit.timeit(lambda: util.json_dumps_safer(row), number=n)
+        serialize.use_orjson = False
+        stdlib = timeit.timeit(lambda: serialize.dumps(row), number=n)
+        line = "%-14s json_dumps_safer %8.1fus  serialize %8.1fus (%.1fx)" % (
+            name, baseline / n * 1e6, stdlib / n * 1e6, baseline / stdlib)
+        if serialize.orjson is not None:
+            serialize.use_orjson = True
+            fast = timeit.timeit(lambda: serialize.dumps(row), number=n)
+            line += "  orjson %8.1fus (%.1fx)" % (fast / n * 1e6, baseline / fast)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
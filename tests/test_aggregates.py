@@ -0,0 +1,66 @@
+import json
+
+import numpy as np
+
+from wandb.aggregates import QuantileSketch, RunningStats
+
+
+def test_running_stats():
+    stats = RunningStats()
+    for v in [3, 1, float("nan"), 2]:
+        stats.add(v)
+    assert stats.to_dict() == {"count": 3, "nan_count": 1, "min": 1, "max": 3,
+                               "mean": 2.0, "last": 2}
+
+
+def test_running_stats_merge():
+    a, b = RunningStats(), RunningStats()
+    a.add(1)
+    b.add(5)
+    b.add(-1)
+    a.merge(b)
+    assert (a.count, a.min, a.max, a.last) == (3, -1, 5, -1)
+
+
+def test_quantile_sketch_accuracy():
+    values = np.random.RandomState(0).lognormal(size=10000)
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for v in values:
+        sketch.add(v)
+    ordered = sorted(values)
+    for q in [0.01, 0.5, 0.95, 0.99]:
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= 0.011 * exact
+
+
+def test_quantile_sketch_signs_and_merge():
+    a, b = QuantileSketch(), QuantileSketch()
+    for v in [-10, -1, 0]:
+        a.add(v)
+    for v in [1, 10, float("inf")]:
+        b.add(v)
+    a.merge(b)
+    assert a.count == 5
+    assert abs(a.quantile(0) + 10) < 0.1
+    assert a.quantile(0.5) == 0.0
+    assert abs(a.quantile(1) - 10) < 0.1
+
+
+def test_quantile_sketch_collapses():
+    sketch = QuantileSketch(max_buckets=10)
+    for i in range(1, 1000):
+        sketch.add(float(i))
+    assert len(sketch.positive) == 10
+    assert abs(sketch.quantile(1) - 999) < 20
+
+
+def test_running_stats_state():
+    stats = RunningStats()
+    for v in range(100):
+        stats.add(v)
+    stats.add(float("nan"))
+    stats.add(99)
+    restored = RunningStats.from_state(json.loads(json.dumps(stats.state())))
+    assert restored.to_dict() == stats.to_dict()
+    assert restored.aggregate("p95") == stats.aggregate("p95")
+    assert 93 <= stats.aggregate("p95") <= 96
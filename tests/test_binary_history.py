@@ -0,0 +1,92 @@
+import json
+import math
+import os
+import time
+import numpy as np
+from click.testing import CliRunner
+
+from wandb import binary_history
+from wandb.history import History
+
+
+def rows(n):
+    start = time.time()
+    return [{"_step": i, "_runtime": 0.01 * i, "_timestamp": start + 0.01 * i,
+             "loss": 1.0 / (i + 1), "acc": 0.5, "epoch": i // 10}
+            for i in range(n)]
+
+
+def test_block_roundtrip():
+    data = rows(100) + [{"name": u"café", "flag": True, "none": None,
+                         "nested": {"a": [1, 2]}, "nan": float("nan"),
+                         "big": 2 ** 70, "neg": -3, "np": np.float32(0.5)}]
+    block = binary_history.encode_block(data)
+    _, pos = binary_history._decode_varint(bytearray(block), 1)
+    decoded = binary_history.decode_block(block[pos:])
+    assert decoded[:100] == data[:100]
+    last = decoded[-1]
+    assert math.isnan(last.pop("nan"))
+    assert last == {"name": u"café", "flag": True, "none": None,
+                    "nested": {"a": [1, 2]}, "big": 2 ** 70, "neg": -3, "np": 0.5}
+
+
+def test_smaller_than_jsonl():
+    data = rows(1000)
+    jsonl = "".join(json.dumps(r) + "\n" for r in data)
+    assert len(binary_history.encode_block(data)) < len(jsonl) / 2
+
+
+def test_history_binary_writer():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.bin", writer=binary_history.BinaryWriter)
+        history.add({"loss": 0.5})
+        history.add({"loss": 0.25})
+        history.close()
+        # simulate a crash mid block
+        with open("wandb-history.bin", "ab") as f:
+            f.write(b"B\x7f\x01")
+        resumed = History("wandb-history.bin", writer=binary_history.BinaryWriter)
+        assert resumed._steps == 2
+        resumed.add({"loss": 0.125})
+        resumed.close()
+        binary_history.to_jsonl("wandb-history.bin", "wandb-history.jsonl")
+        h = History("wandb-history.jsonl").rows
+        assert [r["loss"] for r in h] == [0.5, 0.25, 0.125]
+        assert [r["_step"] for r in h] == [0, 1, 2]
+
+
+def test_stream_decoder():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.bin", writer=binary_history.BinaryWriter)
+        history.add({"loss": 0.5})
+        history.add({"loss": 0.25})
+        history.close()
+        with open("wandb-history.bin", "rb") as f:
+            data = f.read()
+        decoder = binary_history.StreamDecoder()
+        decoded = []
+        for i in range(len(data)):
+            decoded.extend(decoder.feed(data[i:i + 1]))
+        assert [r["loss"] for r in decoded] == [0.5, 0.25]
+        # a reader starting at the end of the file sees no header
+        resumed = History("wandb-history.bin", writer=binary_history.BinaryWriter)
+        resumed.add({"loss": 0.125})
+        resumed.close()
+        with open("wandb-history.bin", "rb") as f:
+            tail = f.read()[len(data):]
+        assert [r["loss"] for r in binary_history.StreamDecoder().feed(tail)] == [0.125]
+
+
+def test_reading_process_leaves_file_alone():
+    with CliRunner().isolated_filesystem():
+        # the wandb process builds a History while the user process writes
+        History("wandb-history.bin", writer=binary_history.BinaryWriter).close()
+        assert os.path.getsize("wandb-history.bin") == 0
+        history = History("wandb-history.bin", writer=binary_history.BinaryWriter)
+        history.add({"loss": 0.5})
+        with open("wandb-history.bin", "ab") as f:
+            f.write(b"B\x7f\x01")
+        size = os.path.getsize("wandb-history.bin")
+        History("wandb-history.bin", writer=binary_history.BinaryWriter).close()
+        assert os.path.getsize("wandb-history.bin") == size
+        history.close()
@@ -0,0 +1,82 @@
+import json
+
+from click.testing import CliRunner
+import pytest
+
+from wandb import delta_rows
+from wandb.history import History, JsonlWriter
+from wandb.history_reader import HistoryReader
+
+
+def wide_rows(n):
+    for i in range(n):
+        row = {"w%i" % k: k for k in range(20)}
+        row["loss"] = 1.0 / (i + 1)
+        if i % 3 == 0:
+            row["val"] = i
+        yield row
+
+
+def test_encode_decode_roundtrip():
+    encoder = delta_rows.DeltaEncoder(keyframe_interval=4)
+    rows = [dict(row, _step=i) for i, row in enumerate(wide_rows(10))]
+    encoded = [encoder.encode(row) for row in rows]
+    assert [delta_rows.is_delta(row) for row in encoded][:5] == [
+        False, True, True, True, False]
+    assert encoded[1] == {"_delta": True, "_step": 1, "loss": 0.5, "_removed": ["val"]}
+    assert list(delta_rows.DeltaDecoder().decode_all(encoded)) == rows
+
+
+def test_streams_are_encoded_separately():
+    encoder = delta_rows.DeltaEncoder()
+    encoder.encode({"a": 1})
+    assert not delta_rows.is_delta(encoder.encode({"b": 1, "_stream": "batch"}))
+    assert encoder.encode({"a": 1, "c": 2}) == {"_delta": True, "c": 2}
+
+
+@pytest.fixture
+def sparse_history():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl", keyframe_interval=5)
+        for row in wide_rows(30):
+            history.add(row)
+            history.stream("batch").add({"grad": row["loss"]})
+        history.close()
+        yield "wandb-history.jsonl"
+
+
+def test_history_writes_deltas(sparse_history):
+    with open(sparse_history) as f:
+        lines = [json.loads(line) for line in f]
+    assert sum(delta_rows.is_delta(row) for row in lines) == 48
+    assert "w3" not in lines[2]
+    rows = list(JsonlWriter.read_rows(sparse_history, "default"))
+    assert len(rows) == 30
+    assert all(row["w19"] == 19 for row in rows)
+    assert [row["_step"] for row in rows] == list(range(30))
+    assert rows[3]["val"] == 3 and "val" not in rows[4]
+    last = JsonlWriter.read_last_row(sparse_history, "default")
+    assert last == rows[-1]
+    assert JsonlWriter.read_last_row(sparse_history, "batch")["grad"] == rows[-1]["loss"]
+
+    history = History("wandb-history.jsonl", keyframe_interval=5)
+    assert list(history.rows) == rows
+    history.add({"loss": 0})
+    history.close()
+    # a reopened file starts with a keyframe
+    assert not delta_rows.is_delta(json.loads(open(sparse_history).readlines()[-1]))
+    last = JsonlWriter.read_last_row(sparse_history)
+    assert last["loss"] == 0 and "w7" not in last
+
+
+def test_reader_rebuilds_dense_rows(sparse_history):
+    dense = list(JsonlWriter.read_rows(sparse_history, "default"))
+    with HistoryReader(sparse_history) as reader:
+        assert len(reader) == 30
+        assert reader[13] == dense[13]
+        assert reader[-1] == dense[-1]
+        assert reader[7:12] == dense[7:12]
+        assert list(reader) == dense
+        assert reader.column("w5").tolist() == [5] * 30
+        assert reader.column("val", 10, 20).tolist() == [12, 15, 18]
+        assert reader.scan(processes=2, chunk_rows=7) == dense
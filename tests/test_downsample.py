@@ -0,0 +1,38 @@
+import pytest
+
+from wandb.downsample import Downsampler, downsample
+
+
+def test_short_series_kept():
+    assert downsample([3, 1, 2], 10) == [3, 1, 2]
+    assert downsample(range(10), 10) == list(range(10))
+
+
+def test_size_bound():
+    for n in [11, 100, 1001, 12345]:
+        values = downsample(range(n), 40)
+        assert len(values) <= 40
+        assert values[0] == 0
+        assert values[-1] == n - 1
+        assert values == sorted(values)
+
+
+def test_keeps_spikes():
+    values = [1.0] * 100000
+    values[31337] = 1000.0
+    values[77777] = -1000.0
+    sampled = downsample(iter(values), 20)
+    assert 1000.0 in sampled
+    assert -1000.0 in sampled
+    assert sampled.index(1000.0) < sampled.index(-1000.0)
+
+
+def test_points():
+    sampler = Downsampler(6)
+    sampler.extend([5, 0, 9, 3, 4, 8, 1, 2])
+    assert sampler.count == 8
+    points = sampler.points()
+    assert points[0] == (0, 5) and points[-1] == (7, 2)
+    assert (1, 0) in points and (2, 9) in points
+    with pytest.raises(ValueError):
+        Downsampler(2)
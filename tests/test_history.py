@@ -1,11 +1,15 @@
 import pytest
 import os
+import threading
+import time
 import json
 import six
 import numpy as np
 from click.testing import CliRunner
 
-from wandb.history import History
+import wandb
+from wandb.history import History, AsyncWriter
+from wandb import history as history_mod
 from wandb import media
 from wandb import data_types
 import torch
@@ -24,7 +28,8 @@ def di(row):
 
 def disk_history():
     """Reads history from disk and returns an array of dicts"""
-    return History("wandb-history.jsonl").rows
+    with open("wandb-history.jsonl") as f:
+        return [json.loads(line) for line in f]
 
 
 def test_history_default(history):
@@ -128,3 +133,318 @@ def test_torch_no_compute(history):
                 2, 2).type(torch.FloatTensor), requires_grad=True), "layer1")
     h = disk_history()
     assert len(h) == 0
+
+
+def test_async_write_flush():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl", async_writes=True,
+                          flush_interval=60, flush_rows=1000)
+        for i in range(10):
+            history.add({"loss": i})
+        assert history.rows[-1]["loss"] == 9
+        history.flush()
+        h = disk_history()
+        assert [r["loss"] for r in h] == list(range(10))
+        assert [r["_step"] for r in h] == list(range(10))
+        history.close()
+
+
+def test_async_write_flush_rows():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl", async_writes=True,
+                          flush_interval=60, flush_rows=5)
+        for i in range(5):
+            history.add({"loss": i})
+        for _ in range(50):
+            if len(disk_history()) == 5:
+                break
+            time.sleep(0.01)
+        assert len(disk_history()) == 5
+        history.close()
+
+
+def test_async_write_close():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl", async_writes=True,
+                          flush_interval=60)
+        history.add({"loss": 0.5})
+        history.stream("batch").add({"acc": 1})
+        history.close()
+        h = disk_history()
+        assert len(h) == 2
+        assert sorted(r.get("_stream", "default") for r in h) == ["batch", "default"]
+
+
+def test_column_view(history):
+    history.add({"loss": 1})
+    history.add({"acc": 0.5})
+    history.add({"loss": 2.5, "acc": 0.7})
+    assert list(history.column("loss")) == [1, 2.5]
+    assert list(history.column("acc")) == [0.5, 0.7]
+    assert len(history.column("loss")) == 2
+    assert history.column("loss")[-1] == 2.5
+    assert list(history.column("missing")) == []
+    assert list(history.column("loss").numpy()) == [1.0, 2.5]
+    assert list(history.column("_step").numpy()) == [0, 1, 2]
+
+
+def test_reading_process_leaves_torn_line(history):
+    history.add({"loss": 1.0})
+    with open("wandb-history.jsonl", "a") as f:
+        f.write('{"_step": 1, "lo')
+    # the wandb process builds a History while the user process writes
+    History("wandb-history.jsonl").close()
+    with open("wandb-history.jsonl") as f:
+        assert f.read().endswith('"lo')
+
+
+def test_column_numpy_then_log(history):
+    history.add({"loss": 1.0})
+    loss = history.column("loss").numpy()
+    for i in range(3):
+        history.add({"loss": 2.0 + i})
+    assert loss.tolist() == [1.0]
+    assert list(history.column("loss")) == [1.0, 2.0, 3.0, 4.0]
+    assert len(history.rows) == 4
+    assert len(disk_history()) == 4
+
+
+def test_rows_view(history):
+    history.add({"loss": 1, "name": "a"})
+    history.add({"acc": 0.5, "name": "b"})
+    rows = history.rows
+    assert len(rows) == 2
+    assert di({"loss": 1, "name": "a"}) <= di(rows[0])
+    assert "acc" not in rows[0]
+    assert "loss" not in rows[-1]
+    assert [r["name"] for r in rows[0:2]] == ["a", "b"]
+
+
+def test_keys(history):
+    image = np.random.randint(255, size=(28, 28))
+    history.add({"loss": 1, "images": media.Image(image)})
+    assert sorted(history.keys()) == ["loss"]
+
+
+def test_resume_from_tail(history):
+    for i in range(3):
+        history.add({"loss": i})
+    history.close()
+    with open("wandb-history.jsonl", "a") as f:
+        f.write('{"loss": 3, "_st')
+    resumed = History("wandb-history.jsonl")
+    assert resumed._steps == 3
+    assert not resumed._indexed
+    resumed.add({"loss": 4})
+    assert resumed.rows[-1]["_step"] == 3
+    assert list(resumed.column("loss")) == [0, 1, 2, 4]
+    resumed.close()
+
+
+def test_no_retain_rows():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl", retain_rows=False)
+        for i in range(5):
+            history.add({"loss": float(i), "name": "x"})
+        assert len(history._store) == 0
+        assert sorted(history.keys()) == ["loss", "name"]
+        assert list(history.column("loss")) == [0, 1, 2, 3, 4]
+        assert history.rows[-1]["_step"] == 4
+        stats = history.stats("loss")
+        assert (stats.count, stats.min, stats.max, stats.mean, stats.last) == (
+            5, 0, 4, 2, 4)
+        assert history.stats("name") is None
+        history.close()
+
+
+def test_stream_resume(history):
+    history.add({"loss": 1})
+    batch = history.stream("batch")
+    for i in range(3):
+        batch.add({"acc": i})
+    history.add({"loss": 2})
+    history.close()
+    resumed = History("wandb-history.jsonl")
+    assert resumed._steps == 2
+    assert resumed.stream("batch")._steps == 3
+    assert list(resumed.column("loss")) == [1, 2]
+    assert list(resumed.column("acc")) == []
+    assert list(resumed.column("acc", stream="batch")) == [0, 1, 2]
+    assert [r["_step"] for r in resumed.stream("batch").rows] == [0, 1, 2]
+    resumed.stream("batch").add({"acc": 3})
+    assert resumed.stream("batch").rows[-1]["_step"] == 3
+    resumed.close()
+
+
+def test_media_workers():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl", media_workers=2)
+        image = np.random.randint(255, size=(28, 28))
+        for i in range(5):
+            history.add({"images": [media.Image(image), media.Image(image)]})
+        assert history.rows[0]["images"] == {'_type': 'images',
+                                             'count': 2, 'height': 28, 'width': 28}
+        history.close()
+        for i in range(5):
+            assert os.path.exists("media/images/images_%i.jpg" % i)
+
+
+def test_aggregate_steps(history):
+    history.aggregate(["loss"], steps=3)
+    for i in range(7):
+        history.add({"loss": i})
+    assert len(history.rows) == 2
+    assert history.rows[0]["loss"] == 1.0
+    assert history.rows[0]["loss.min"] == 0
+    assert history.rows[0]["loss.max"] == 2
+    assert history.rows[0]["loss.last"] == 2
+    assert history.rows[0]["loss.count"] == 3
+    assert history.rows[1]["loss"] == 4.0
+    history.close()
+    assert len(history.rows) == 3
+    assert history.rows[2]["loss"] == 6.0
+    assert history.rows[2]["loss.count"] == 1
+
+
+def test_aggregate_passes_other_keys(history):
+    history.aggregate("loss", steps=2)
+    history.add({"loss": 1, "epoch": 0})
+    history.add({"loss": 3})
+    assert history.rows == [{"epoch": 0, "_step": 0, "_runtime": history.rows[0]["_runtime"],
+                             "_timestamp": history.rows[0]["_timestamp"]},
+                            {"loss": 2.0, "loss.min": 1, "loss.max": 3, "loss.last": 3,
+                             "loss.count": 2, "_step": 1, "_runtime": history.rows[1]["_runtime"],
+                             "_timestamp": history.rows[1]["_timestamp"]}]
+
+
+def test_aggregate_seconds(history, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    history.aggregate(["loss"], seconds=10)
+    for i in range(5):
+        history.add({"loss": i})
+        now[0] += 1
+    assert len(history.rows) == 0
+    now[0] += 10
+    history.add({"loss": 5})
+    assert len(history.rows) == 1
+    assert history.rows[0]["loss.count"] == 6
+
+
+def test_summarize(history):
+    history.summarize("loss", ["best", "p50", "nan_count"])
+    history.summarize("acc", "best", goal="maximize")
+    for i in range(101):
+        history.add({"loss": 100 - i, "acc": i / 100.0})
+    history.add({"loss": float("nan")})
+    assert history.summary_values() == {"loss.best": 0, "loss.p50": pytest.approx(50, rel=0.01),
+                                        "loss.nan_count": 1, "acc.best": 1.0}
+    with pytest.raises(ValueError):
+        history.summarize("loss", "median")
+
+
+def test_stats_saved_on_close(history):
+    for i in range(5):
+        history.add({"loss": i})
+    history.close()
+    assert history_mod.load_stats(history.fname)["loss"].max == 4
+    resumed = History("wandb-history.jsonl")
+    assert resumed.stats("loss").count == 5
+    resumed.add({"loss": 20})
+    assert resumed.stats("loss").mean == 5.0
+    with open("wandb-history.jsonl", "a") as f:
+        f.write('{"_step": 6, "loss": 1}\n')
+    assert History("wandb-history.jsonl").stats("loss") is None
+
+
+def test_add_batch():
+    with CliRunner().isolated_filesystem():
+        added = []
+        history = History("wandb-history.jsonl", add_callback=added.append)
+        history.add({"epoch": 0})
+        history.row["lr"] = 0.1
+        history.add_batch({"loss": np.arange(5, dtype=np.float32),
+                           "acc": [0.1, 0.2, 0.3, 0.4, 0.5], "epoch": np.array(1)})
+        assert [r["_step"] for r in history.rows] == list(range(7))
+        assert history.rows[1] == {"lr": 0.1, "_step": 1,
+                                   "_runtime": history.rows[1]["_runtime"],
+                                   "_timestamp": history.rows[1]["_timestamp"]}
+        assert history.rows[6]["loss"] == 4.0
+        assert history.rows[6]["epoch"] == 1
+        assert type(history.rows[6]["epoch"]) == int
+        assert type(history.rows[6]["loss"]) == float
+        assert len(added) == 3
+        assert added[-1]["acc"] == 0.5
+        assert history.stats("loss").count == 5
+        history.close()
+        assert len(disk_history()) == 7
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("1", True), ("true", True), ("Yes", True),
+    ("0", False), ("false", False), ("no", False), ("", False)])
+def test_async_history_env(value, expected):
+    assert wandb.env.get_async_history(env={"WANDB_ASYNC_HISTORY": value}) is expected
+    assert wandb.env.get_async_history(env={}) is False
+
+
+def test_add_batch_async_and_errors():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl", async_writes=True)
+        history.add_batch({"loss": np.zeros(2500)})
+        history.flush()
+        assert len(disk_history()) == 2500
+        with pytest.raises(wandb.Error):
+            history.add_batch({"loss": [1, 2], "acc": [1]})
+        with pytest.raises(wandb.Error):
+            with history.step():
+                history.add_batch({"loss": [1]})
+        history.close()
+
+
+@pytest.mark.parametrize("async_writes", [False, True])
+def test_threads_build_their_own_rows(async_writes):
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl", async_writes=async_writes)
+
+        def log(name):
+            for i in range(200):
+                history.row[name] = i
+                history.row["thread"] = name
+                history.add()
+        threads = [threading.Thread(target=log, args=("t%i" % t,))
+                   for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        history.close()
+        rows = disk_history()
+        assert [r["_step"] for r in rows] == list(range(800))
+        for row in rows:
+            assert set(row) == set([row["thread"], "thread", "_step",
+                                    "_runtime", "_timestamp"])
+        assert len(history.rows) == 800
+        assert history.lock_wait_stats()["count"] == 800
+
+
+def test_async_writer_orders_rows():
+    written = []
+    writer = AsyncWriter(written.extend, flush_interval=10)
+    writer.put(1, [{"_step": 1}])
+    writer.put(2, [])
+    writer.put(3, [{"_step": 2}])
+    writer.put(0, [{"_step": 0}])
+    writer.flush()
+    assert written == [{"_step": 0}, {"_step": 1}, {"_step": 2}]
+    writer.close()
+
+
+def test_column_keeps_int_and_float_types(history):
+    history.add({"loss": 2})
+    history.add({"loss": 0.5})
+    history.add({"loss": 3})
+    assert list(history.column("loss")) == [2, 0.5, 3]
+    assert [type(v) for v in history.column("loss")] == [int, float, int]
+    assert history.rows[0]["loss"] == 2 and isinstance(history.rows[0]["loss"], int)
+    assert list(history.column("loss").numpy()) == [2.0, 0.5, 3.0]
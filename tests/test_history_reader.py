@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+from click.testing import CliRunner
+import pytest
+
+from wandb.history import History
+from wandb.history_reader import ENTRY, HistoryReader, _to_array, index_fname, read_index
+
+
+@pytest.fixture
+def history_file():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl")
+        for i in range(50):
+            row = {"acc": i / 10.0}
+            if i % 2 == 0:
+                row["loss"] = i
+            history.add(row)
+            if i % 10 == 0:
+                history.stream("batch").add({"grad": i})
+        history.close()
+        yield "wandb-history.jsonl"
+
+
+def test_index_written_incrementally(history_file):
+    entries = read_index(history_file)
+    assert len(entries) == 2 * 55
+    assert list(entries[0::2]).count(-1) == 5
+    with open(history_file, "rb") as f:
+        data = f.read()
+    assert all(data[offset - 1:offset] == b"\n" for offset in entries[3::2])
+
+
+def test_random_access(history_file):
+    with HistoryReader(history_file) as reader:
+        assert len(reader) == 50
+        assert reader[3]["acc"] == 0.3
+        assert reader[-1]["_step"] == 49
+        assert [r["_step"] for r in reader.steps(10, 13)] == [10, 11, 12]
+        assert reader.row(7)["acc"] == 0.7
+        with pytest.raises(KeyError):
+            reader.row(100)
+
+
+def test_column(history_file):
+    with HistoryReader(history_file) as reader:
+        loss = reader.column("loss")
+        assert isinstance(loss, np.ndarray)
+        assert loss.tolist() == list(range(0, 50, 2))
+        assert reader.column("loss", 10, 20).tolist() == list(range(10, 20, 2))
+        assert len(reader.column("grad")) == 0
+
+
+def test_scan_parallel(history_file):
+    with HistoryReader(history_file) as reader:
+        rows = reader.scan(processes=2, chunk_rows=7)
+        assert rows == list(reader)
+        assert len(rows) == 50
+
+
+def test_rebuilds_stale_index(history_file):
+    os.remove(index_fname(history_file))
+    with open(history_file, "a") as f:
+        f.write('{"_step": 50, "acc": 5.0}\n{"_step": 51, "ac')
+    with HistoryReader(history_file) as reader:
+        assert len(reader) == 51
+        assert reader[-1]["acc"] == 5.0
+    # readers index in memory, the writer doesn't rebuild a missing index
+    assert not os.path.exists(index_fname(history_file))
+    history = History(history_file)
+    history.add({"acc": 6.0})
+    history.close()
+    assert not os.path.exists(index_fname(history_file))
+    with HistoryReader(history_file) as reader:
+        assert [r["_step"] for r in reader.steps(49)] == [49, 50, 51]
+
+
+def test_extends_short_index(history_file):
+    with open(index_fname(history_file), "rb") as f:
+        data = f.read()
+    # the last rows and half an entry weren't indexed
+    with open(index_fname(history_file), "wb") as f:
+        f.write(data[:-3 * 16 - 5])
+    with HistoryReader(history_file) as reader:
+        assert len(reader) == 50
+        assert reader[-1]["_step"] == 49
+    assert os.path.getsize(index_fname(history_file)) == len(data) - 3 * 16 - 5
+    # a History that doesn't write (like the one in the wandb process) leaves it
+    History(history_file).close()
+    assert os.path.getsize(index_fname(history_file)) == len(data) - 3 * 16 - 5
+    history = History(history_file)
+    history.add({"acc": 5.0})
+    history.close()
+    entries = read_index(history_file)
+    assert entries[:-2] == _to_array(data)
+    assert entries[-2] == 50
+
+
+def test_inconsistent_index_is_dropped(history_file):
+    with open(index_fname(history_file), "ab") as f:
+        f.write(ENTRY.pack(60, 7))
+    with HistoryReader(history_file) as reader:
+        assert len(reader) == 50
+    History(history_file).close()
+    assert os.path.exists(index_fname(history_file))
+    history = History(history_file)
+    history.add({"acc": 5.0})
+    history.close()
+    assert not os.path.exists(index_fname(history_file))
+
+
+def test_column_non_ascii_key():
+    with CliRunner().isolated_filesystem():
+        with open("wandb-history.jsonl", "wb") as f:
+            f.write(u'{"_step": 0, "café": 1.5}\n'.encode("utf-8"))
+            f.write(b'{"_step": 1, "caf\\u00e9": 2.5}\n')
+        with HistoryReader("wandb-history.jsonl") as reader:
+            assert reader.column(u"café").tolist() == [1.5, 2.5]
+
+
+def test_empty_file():
+    with CliRunner().isolated_filesystem():
+        open("wandb-history.jsonl", "w").close()
+        with HistoryReader("wandb-history.jsonl") as reader:
+            assert len(reader) == 0
+            assert reader.scan() == []
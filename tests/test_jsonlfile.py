@@ -0,0 +1,36 @@
+import io
+import json
+import pytest
+from click.testing import CliRunner
+
+from wandb import jsonlfile
+
+
+def test_reverse_lines_small_blocks():
+    f = io.BytesIO(b'a\nbb\nccc\n')
+    assert list(jsonlfile.reverse_lines(f, block_size=2)) == [
+        b'', b'ccc', b'bb', b'a']
+
+
+def test_read_last_row():
+    with CliRunner().isolated_filesystem():
+        with open("events.jsonl", "w") as f:
+            for i in range(1000):
+                f.write(json.dumps({"_runtime": i}) + "\n")
+        assert jsonlfile.read_last_row("events.jsonl") == {"_runtime": 999}
+
+
+def test_read_last_row_torn():
+    with CliRunner().isolated_filesystem():
+        with open("events.jsonl", "w") as f:
+            f.write('{"_runtime": 1}\n{"_runtime": 2}\n{"_runt')
+        assert jsonlfile.read_last_row("events.jsonl") == {"_runtime": 2}
+        with jsonlfile.open_for_append("events.jsonl") as f:
+            f.write('{"_runtime": 3}\n')
+        assert jsonlfile.read_last_row("events.jsonl") == {"_runtime": 3}
+
+
+def test_read_last_row_empty():
+    with CliRunner().isolated_filesystem():
+        open("events.jsonl", "w").close()
+        assert jsonlfile.read_last_row("events.jsonl") is None
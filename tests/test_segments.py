@@ -0,0 +1,118 @@
+import gzip
+import os
+import time
+
+from click.testing import CliRunner
+import pytest
+
+from wandb import segments
+from wandb.history import History
+from wandb.history_reader import HistoryReader, index_fname
+from wandb.jsonlfile import JsonlEventsFile, read_last_row
+from wandb import util
+from wandb.run_manager import FileTailer, RunManager, WriteSerializingFile
+
+
+def test_segment_names():
+    assert segments.segment_fname("dir/wandb-history.jsonl", 42) == "dir/wandb-history.00042.jsonl"
+    assert segments.segment_fname("output.log", 1, compress=True) == "output.00001.log.gz"
+    assert segments.parse_segment("dir/wandb-history.00042.jsonl") == ("dir/wandb-history.jsonl", 42)
+    assert segments.parse_segment("output.00001.log.gz") == ("output.log", 1)
+    assert segments.parse_segment("wandb-history.jsonl") is None
+    assert segments.parse_segment(".wandb-history.jsonl.idx") is None
+
+
+def test_policy_from_env():
+    assert segments.SegmentPolicy.from_env({}) is None
+    policy = segments.SegmentPolicy.from_env({"WANDB_SEGMENT_BYTES": "1000",
+                                              "WANDB_SEGMENT_GZIP": "true"})
+    assert (policy.max_bytes, policy.max_seconds, policy.compress) == (1000, 0, True)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_history_segments(compress):
+    with CliRunner().isolated_filesystem():
+        policy = segments.SegmentPolicy(max_bytes=500, compress=compress)
+        history = History("wandb-history.jsonl", segment_policy=policy)
+        for i in range(50):
+            history.add({"loss": i})
+        history.close()
+        sealed = segments.sealed_segments("wandb-history.jsonl")
+        assert len(sealed) > 3
+        assert all(os.path.getsize(path) >= 500 or compress for path in sealed)
+        assert [r["loss"] for r in History("wandb-history.jsonl").rows] == list(range(50))
+        if compress:
+            assert all(path.endswith(".jsonl.gz") for path in sealed)
+            # compressed from the active file, never renamed to a plain segment
+            assert not [name for name in os.listdir(".") if name.endswith(".tmp")]
+            assert not os.path.exists(index_fname(sealed[0][:-3]))
+        else:
+            with HistoryReader(sealed[1]) as reader:
+                assert reader[0]["_step"] > 0
+        # resuming right after a rotation picks up the step from the last segment
+        segments.Rotator("wandb-history.jsonl", policy).seal()
+        resumed = History("wandb-history.jsonl", segment_policy=policy)
+        resumed.add({"loss": 50})
+        assert resumed.rows[-1]["_step"] == 50
+        resumed.close()
+
+
+def test_events_segments():
+    with CliRunner().isolated_filesystem():
+        policy = segments.SegmentPolicy(max_bytes=200)
+        events = JsonlEventsFile("wandb-events.jsonl", segment_policy=policy)
+        for i in range(20):
+            events.track("system", {"cpu": i})
+        events.close()
+        assert len(segments.sealed_segments("wandb-events.jsonl")) > 2
+        assert read_last_row("wandb-events.jsonl")["system.cpu"] == 19
+
+
+def test_output_segments():
+    with CliRunner().isolated_filesystem():
+        rotator = segments.Rotator("output.log", segments.SegmentPolicy(max_bytes=100))
+        out = WriteSerializingFile(open("output.log", "wb"), rotator)
+        for i in range(30):
+            out.write(("line %i\n" % i).encode("utf8"))
+        out.f.close()
+        data = b"".join(open(path, "rb").read()
+                        for path in segments.sealed_segments("output.log") + ["output.log"])
+        assert data.decode("utf8").splitlines() == ["line %i" % i for i in range(30)]
+
+
+def test_tailer_follows_rotation():
+    with CliRunner().isolated_filesystem():
+        read = []
+        with open("wandb-history.jsonl", "w") as f:
+            f.write("a\n")
+        tailer = FileTailer("wandb-history.jsonl", read.append)
+        rotator = segments.Rotator("wandb-history.jsonl", segments.SegmentPolicy(max_bytes=1))
+        with open("wandb-history.jsonl", "a") as f:
+            f.write("b\n")
+        rotator.seal()
+        with open("wandb-history.jsonl", "w") as f:
+            f.write("c\n")
+        for _ in range(30):
+            if "".join(read) == "a\nb\nc\n":
+                break
+            time.sleep(0.1)
+        tailer.running = False
+        assert "".join(read) == "a\nb\nc\n"
+
+
+def test_only_segments_are_verified():
+    with CliRunner().isolated_filesystem():
+        for name in ["wandb-history.00001.jsonl", "output.00001.log", "config.yaml", "model.h5"]:
+            with open(name, "w") as f:
+                f.write(name)
+        manager = object.__new__(RunManager)
+        manager._watch_dir = "."
+        manager._md5s = {}
+        urls = dict((name, {"md5": "stale"}) for name in
+                    ["wandb-history.00001.jsonl", "output.00001.log", "config.yaml",
+                     "model.h5", "wandb-history.00002.jsonl"])
+        urls["output.00001.log"]["md5"] = util.md5_file("output.00001.log")
+        mismatched = manager._mismatched_segments(urls)
+        assert [m[0] for m in mismatched] == [os.path.join(".", "wandb-history.00001.jsonl")]
+        assert sorted(manager._md5s) == [os.path.join(".", "output.00001.log"),
+                                         os.path.join(".", "wandb-history.00001.jsonl")]
@@ -0,0 +1,46 @@
+import json
+import pytest
+import numpy as np
+
+from wandb import serialize
+from wandb import util
+
+
+@pytest.fixture(params=[False, True])
+def backend(request, monkeypatch):
+    if request.param and serialize.orjson is None:
+        pytest.skip("orjson isn't installed")
+    monkeypatch.setattr(serialize, "use_orjson", request.param)
+
+
+def test_plain_row(backend):
+    row = {"loss": 0.5, "_step": 1, "name": u"caf\xe9", "ok": True, "none": None}
+    assert json.loads(serialize.dumps(row)) == row
+
+
+def test_numpy_values(backend):
+    row = {"f32": np.float32(0.5), "i64": np.int64(3), "bool": np.bool_(True),
+           "arr": np.arange(6).reshape(2, 3), "nested": {"arr": np.ones(2)}}
+    assert json.loads(serialize.dumps(row)) == {
+        "f32": 0.5, "i64": 3, "bool": True, "arr": [[0, 1, 2], [3, 4, 5]],
+        "nested": {"arr": [1.0, 1.0]}}
+
+
+def test_non_finite_matches_stdlib(backend):
+    row = {"loss": float("nan"), "arr": np.array([1.0, np.inf])}
+    assert serialize.dumps(row) == util.json_dumps_safer(row)
+
+
+def test_big_int_and_bytes(backend):
+    row = {"big": 2 ** 70, "raw": b"abc"}
+    assert json.loads(serialize.dumps(row)) == {"big": 2 ** 70, "raw": "abc"}
+
+
+def test_indent():
+    assert serialize.dumps({"a": 1}, indent=4) == util.json_dumps_safer(
+        {"a": 1}, indent=4)
+
+
+def test_unserializable():
+    with pytest.raises(TypeError):
+        serialize.dumps({"a": object()})
@@ -0,0 +1,71 @@
+import json
+import os
+
+from click.testing import CliRunner
+import numpy as np
+import pytest
+
+from wandb import spill
+from wandb.history import History
+from wandb.summary import Summary
+
+
+@pytest.fixture
+def spiller():
+    with CliRunner().isolated_filesystem():
+        yield spill.Spiller(max_bytes=1000)
+
+
+def test_small_values_are_kept(spiller):
+    for value in [1, "short", [1, 2, 3], {"a": 1}, np.zeros(10), None]:
+        assert spiller.spill(value) is value
+    assert not os.path.exists("media")
+
+
+def test_large_values_are_spilled(spiller):
+    array = np.arange(1000.0).reshape(10, 100)
+    ref = spiller.spill(array)
+    assert spill.is_reference(ref)
+    assert ref["shape"] == [10, 100] and ref["dtype"] == "float64"
+    assert ref["path"] == "media/blobs/%s.json" % ref["sha256"]
+    assert spill.load(ref) == array.tolist()
+    assert spiller.spill(array) == ref
+    assert spiller.spill(ref) is ref
+    assert len(os.listdir(os.path.join("media", "blobs"))) == 1
+
+    text = "x" * 2000
+    assert spill.load(spiller.spill(text)) == text
+    nested = {"layers": [{"weights": list(range(300))}]}
+    assert spill.load(spiller.spill(nested)) == nested
+
+
+def test_typed_values_are_kept(spiller):
+    histogram = {"_type": "histogram", "values": list(range(500)), "bins": list(range(501))}
+    assert spiller.spill(histogram) is histogram
+    assert not os.path.exists("media")
+
+
+def test_history_and_summary_spill():
+    with CliRunner().isolated_filesystem():
+        history = History("wandb-history.jsonl", spill_bytes=1000)
+        history.add({"loss": 0.5, "weights": np.ones(1000), "tokens": list(range(10))})
+        history.close()
+        with open("wandb-history.jsonl") as f:
+            row = json.loads(f.readline())
+        assert row["loss"] == 0.5 and row["tokens"] == list(range(10))
+        assert spill.load(row["weights"]) == [1.0] * 1000
+
+        history = History("wandb-history.jsonl", spill_bytes=1000)
+        history.add_batch({"weights": np.ones((2, 1000))})
+        history.close()
+        with open("wandb-history.jsonl") as f:
+            rows = [json.loads(line) for line in f][1:]
+        assert [spill.load(r["weights"]) for r in rows] == [[1.0] * 1000] * 2
+
+        summary = Summary(spill_bytes=1000)
+        summary["embedding"] = np.zeros(2000)
+        summary["acc"] = 1
+        saved = json.load(open("wandb-summary.json"))
+        assert saved["acc"] == 1
+        assert saved["embedding"]["_type"] == "blob-file"
+        assert os.path.getsize("wandb-summary.json") < 500
@@ -1,6 +1,12 @@
+import os
+import time
+
 import pytest
-from wandb.summary import Summary
+from wandb.summary import Summary, JOURNAL_FNAME
+from wandb.api import Chunk, SummaryFilePolicy
+from wandb.run_manager import FileEventHandlerSummary
 from click.testing import CliRunner
+import wandb
 from wandb import Histogram
 import json
 
@@ -54,3 +60,156 @@ def test_delete(summary):
     summary.update({"foo": "bar", "bad": True})
     del summary["bad"]
     assert json.load(open("wandb-summary.json")) == {"foo": "bar"}
+
+
+def test_batch_writes_once(summary, mocker):
+    write = mocker.spy(summary, "_write")
+    with summary.batch():
+        for i in range(50):
+            summary["k%i" % i] = i
+        del summary["k3"]
+        assert "k1" not in json.load(open("wandb-summary.json"))
+    assert write.call_count == 1
+    saved = json.load(open("wandb-summary.json"))
+    assert len(saved) == 50 and saved["k49"] == 49 and "k3" not in saved
+
+
+def test_journal_compaction():
+    with CliRunner().isolated_filesystem():
+        s = Summary(journal=True, compact_interval=60)
+        s["foo"] = "init"
+        assert json.load(open("wandb-summary.json")) == {"foo": "init"}
+        s["foo"] = "bar"
+        s.update({"acc": 0.5, "loss": 1})
+        del s["loss"]
+        # debounced, but the journal already has the changes
+        assert json.load(open("wandb-summary.json")) == {"foo": "init"}
+        assert Summary()._summary == {"foo": "bar", "acc": 0.5}
+        s.close()
+        assert json.load(open("wandb-summary.json")) == {"foo": "bar", "acc": 0.5}
+        assert not os.path.exists(JOURNAL_FNAME)
+
+
+def test_journal_timer():
+    with CliRunner().isolated_filesystem():
+        s = Summary(journal=True, compact_interval=0.05)
+        s["a"] = 1
+        s["a"] = 2
+        time.sleep(0.3)
+        assert json.load(open("wandb-summary.json")) == {"a": 2}
+        assert open(JOURNAL_FNAME).read() == ""
+        s.close()
+
+
+class FakeFileStream(object):
+    def __init__(self):
+        self.pushed = []
+
+    def push(self, filename, data):
+        self.pushed.append(data)
+
+
+class FakeApi(object):
+    def __init__(self, **settings):
+        self.dynamic_settings = {"summary_patches": False, "summary_snapshot_seconds": 60}
+        self.dynamic_settings.update(settings)
+        self.fs = FakeFileStream()
+
+    def get_file_stream_api(self):
+        return self.fs
+
+
+def summary_handler(api):
+    pusher = type("Pusher", (), {"file_changed": lambda *args, **kwargs: None})()
+    return FileEventHandlerSummary(
+        os.path.abspath("wandb-summary.json"), "wandb-summary.json", api, pusher, None)
+
+
+def write_summary(summary):
+    with open("wandb-summary.json", "w") as f:
+        json.dump(summary, f)
+    # mtime granularity can be coarse, make every write look new
+    os.utime("wandb-summary.json", (time.time(), time.time() + len(open("wandb-summary.json").read())))
+
+
+def test_handler_pushes_patches():
+    with CliRunner().isolated_filesystem():
+        api = FakeApi(summary_patches=True)
+        handler = summary_handler(api)
+        write_summary({"a": 1, "b": 2})
+        handler.on_created()
+        handler.on_modified()
+        write_summary({"a": 1, "b": 3, "c": 4})
+        handler.on_modified()
+        write_summary({"b": 3, "c": 4})
+        handler.on_modified()
+        handler.finish()
+        assert api.fs.pushed == [
+            {"set": {"a": 1, "b": 2}, "full": True},
+            {"set": {"b": 3, "c": 4}, "del": []},
+            {"set": {}, "del": ["a"]}]
+        chunks = [Chunk("wandb-summary.json", data) for data in api.fs.pushed]
+        policy = SummaryFilePolicy()
+        assert policy.process_chunks(chunks[1:3]) == {
+            "offset": 0, "patch": True, "content": [json.dumps({"set": {"b": 3, "c": 4}, "del": ["a"]})]}
+        assert json.loads(policy.process_chunks(chunks[:3])["content"][0]) == {"b": 3, "c": 4}
+
+
+def test_handler_rate_limits_snapshots():
+    with CliRunner().isolated_filesystem():
+        api = FakeApi(summary_snapshot_seconds=0.2)
+        handler = summary_handler(api)
+        for i in range(5):
+            write_summary({"a": i})
+            handler.on_modified()
+        assert api.fs.pushed == [{"set": {"a": 0}, "full": True}]
+        time.sleep(0.5)
+        assert api.fs.pushed[-1] == {"set": {"a": 4}, "full": True}
+        assert len(api.fs.pushed) == 2
+        handler.finish()
+        assert len(api.fs.pushed) == 2
+
+
+def test_handler_drops_stale_snapshot():
+    with CliRunner().isolated_filesystem():
+        api = FakeApi(summary_snapshot_seconds=0.2)
+        handler = summary_handler(api)
+        write_summary({"a": 0})
+        handler.on_modified()
+        write_summary({"a": 1})
+        handler.on_modified()
+        # changed back before the rate limited snapshot was sent
+        write_summary({"a": 0})
+        handler.on_modified()
+        time.sleep(0.5)
+        handler.finish()
+        assert api.fs.pushed == [{"set": {"a": 0}, "full": True}]
+
+
+def test_summary_updated_while_closing(monkeypatch):
+    monkeypatch.setenv("WANDB_SUMMARY_JOURNAL", "true")
+    monkeypatch.setenv("WANDB_ASYNC_HISTORY", "1")
+    with CliRunner().isolated_filesystem():
+        run = wandb.wandb_run.Run.from_environment_or_defaults()
+        for i in range(5):
+            run.history.add({"loss": i})
+        # the async writer updates the summary as the history is drained
+        run.close_files()
+        saved = json.load(open(os.path.join(run.dir, "wandb-summary.json")))
+        assert saved["loss"] == 4
+        assert not os.path.exists(os.path.join(run.dir, JOURNAL_FNAME))
+
+
+def test_handler_detects_same_size_rewrite():
+    with CliRunner().isolated_filesystem():
+        api = FakeApi(summary_patches=True)
+        handler = summary_handler(api)
+        for value in (1, 2):
+            with open("wandb-summary.json", "w") as f:
+                json.dump({"a": value}, f)
+            # within the mtime resolution, same size
+            os.utime("wandb-summary.json", (1000, 1000))
+            handler.on_modified()
+        assert api.fs.pushed == [{"set": {"a": 1}, "full": True},
+                                 {"set": {"a": 2}, "del": []}]
+        handler.finish()
@@ -1,5 +1,12 @@
+import collections
+import os
+import subprocess
+import sys
+import time
+
 import pytest
-from wandb.stats import SystemStats
+from wandb.stats import (CgroupStats, GPUBackend, IORates, NvmlBackend, ProcessTree,
+                         RingBuffer, SystemStats, run_dir_device)
 from click.testing import CliRunner
 import wandb
 import json
@@ -19,8 +26,12 @@ def stats(api):
 
 def test_defaults(stats):
     stats.shutdown()
-    print(stats.stats().keys())
-    assert sorted(stats.stats().keys()) == sorted(['cpu', 'memory', 'network', 'disk'])
+    stats.stats()
+    keys = set(stats.stats().keys())
+    base = set(['cpu', 'memory', 'network', 'disk', 'disk.run_dir'])
+    assert base <= keys
+    # per device rates and cgroup stats
+    assert all(k.startswith(('network.', 'disk.', 'cgroup.')) for k in keys - base)
     assert stats.sample_rate_seconds == 2
     assert stats.samples_to_average == 15
 
@@ -39,3 +50,308 @@ def test_min_max(stats, api):
     assert stats.samples_to_average == 30
     api.dynamic_settings["system_samples"] = 1
     assert stats.samples_to_average == 2
+
+
+def test_ring_buffer():
+    buf = RingBuffer(4)
+    for value in [5, 1, 2, 3, 4, 10]:
+        buf.add(value)
+    assert len(buf) == 4
+    assert sorted(buf.values()) == [2, 3, 4, 10]
+    mean, low, high, p95 = buf.aggregates()
+    assert (mean, low, high) == (4.75, 2, 10)
+    assert 4 < p95 <= 10
+    buf.clear()
+    assert len(buf) == 0
+
+
+def test_flush_aggregates_samples(stats, mocker):
+    cpu = iter([10, 90, 20, 30, 50])
+    mocker.patch.object(stats, "stats", lambda: {
+        "cpu": next(cpu), "network": {"sent": 1, "recv": 2}})
+    track = mocker.patch.object(stats.run.events, "track")
+    for _ in range(4):
+        stats.sample()
+    stats.flush()
+    name, event = track.call_args[0]
+    assert name == "system"
+    assert event["cpu"] == 37.5
+    assert event["cpu.min"] == 10 and event["cpu.max"] == 90
+    assert 30 < event["cpu.p95"] <= 90
+    assert event["network"] == {"sent": 1, "recv": 2}
+    assert event["sampler"]["samples"] == 4 and event["sampler"]["ms"] >= 0
+    # flushing doesn't take another sample
+    assert next(cpu) == 50
+    assert stats.samples == 0
+
+
+def test_shutdown_wakes_thread(stats, api, mocker):
+    api.dynamic_settings["system_sample_seconds"] = 60
+    track = mocker.patch.object(stats.run.events, "track")
+    stats.start()
+    start = time.time()
+    stats.shutdown()
+    assert time.time() - start < 5
+    assert track.call_args[0][1]["sampler"]["samples"] >= 1
+
+
+def test_process_tree():
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        tree = ProcessTree(os.getpid(), refresh_samples=2)
+        stats = tree.stats()
+        assert stats["proc.count"] >= 2
+        assert stats["proc.threads"] >= 2
+        assert stats["proc.memory.rssMB"] > 0
+        assert stats["proc.cpu_time"]["user"] > 0
+        handle = tree._procs[child.pid]
+        tree.stats()
+        assert tree._procs[child.pid] is handle
+    finally:
+        child.kill()
+        child.wait()
+    cpu_time = tree.stats()["proc.cpu_time"]
+    tree.stats()
+    assert child.pid not in tree._procs
+    assert tree.stats()["proc.cpu_time"]["user"] >= cpu_time["user"]
+
+
+def test_process_tree_child_exits_before_refresh():
+    child = subprocess.Popen(
+        [sys.executable, "-c", "import sys, time\n"
+         "end = time.time() + 0.5\n"
+         "while time.time() < end: pass\n"
+         "print('done'); sys.stdout.flush(); sys.stdin.read()"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    tree = ProcessTree(os.getpid(), refresh_samples=1)
+    child.stdout.readline()
+    cpu_time = tree.stats()["proc.cpu_time"]
+    assert child.pid in tree._procs
+    child.stdin.close()
+    child.wait()
+    child.stdout.close()
+    # the refresh no longer finds the child, its cpu time is kept
+    assert tree.stats()["proc.cpu_time"]["user"] >= cpu_time["user"]
+    assert child.pid not in tree._procs
+
+
+def test_pid_adds_process_stats(stats):
+    stats.pid = os.getpid()
+    assert stats.pid == os.getpid()
+    assert "proc.cpu" in stats.stats()
+    stats.pid = None
+    assert "proc.cpu" not in stats.stats()
+
+
+class FakeIO(object):
+    def __init__(self, **counters):
+        self.__dict__.update(counters)
+
+
+def test_io_rates(mocker):
+    def net(sent):
+        return {"lo": FakeIO(bytes_sent=sent, bytes_recv=0, packets_sent=0, packets_recv=0),
+                "eth0": FakeIO(bytes_sent=sent, bytes_recv=10, packets_sent=sent // 100,
+                               packets_recv=1)}
+
+    def disks(written):
+        return {"sda": FakeIO(read_bytes=0, write_bytes=written, read_count=0,
+                              write_count=written // 4096, busy_time=written // 1000),
+                "loop0": FakeIO(read_bytes=0, write_bytes=0, read_count=0, write_count=0,
+                                busy_time=0)}
+    samples = iter([(net(0), disks(0)), (net(2000), disks(409600)), (net(2000), disks(819200))])
+    sample = [None]
+
+    def next_sample(*args, **kwargs):
+        sample[0] = next(samples)
+        return sample[0][0]
+    mocker.patch("psutil.net_io_counters", next_sample)
+    mocker.patch("psutil.disk_io_counters", lambda *args, **kwargs: sample[0][1])
+    mocker.patch("wandb.stats.run_dir_device", lambda path: ("/", "sda"))
+    rates = IORates(os.getcwd())
+    assert set(rates.stats(now=10)) == set(["disk.run_dir"])
+    stats = rates.stats(now=12)
+    assert stats["network.eth0.sent"] == 1000
+    assert stats["network.eth0.packets_sent"] == 10
+    assert stats["disk.sda.write"] == 204800
+    assert stats["disk.sda.write_ops"] == 50
+    assert stats["disk.sda.busy"] == 20.45
+    assert stats["disk.run_dir.write"] == 204800
+    assert not [k for k in stats if "lo" in k.split(".")]
+    assert "disk.loop0.read" not in stats
+    stats = rates.stats(now=14)
+    # devices stay reported once they've been active
+    assert stats["network.eth0.sent"] == 0
+
+
+def test_run_dir_device():
+    mountpoint, device = run_dir_device(os.getcwd())
+    assert os.getcwd().startswith(mountpoint)
+
+
+def write_files(root, files):
+    for path, content in files.items():
+        path = os.path.join(root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+
+def test_cgroup_v2(tmpdir):
+    root = str(tmpdir.join("cgroup"))
+    job = "system.slice/job.scope/"
+    write_files(root, {
+        "cgroup.controllers": "cpu io memory\n",
+        job + "cpu.stat": "usage_usec 1000000\nuser_usec 800000\nsystem_usec 200000\n"
+                          "nr_periods 100\nnr_throttled 10\nthrottled_usec 50000\n",
+        job + "cpu.max": "200000 100000\n",
+        job + "memory.current": "%i\n" % (512 * 1048576),
+        job + "memory.max": "%i\n" % (1024 * 1048576),
+        job + "cpu.pressure": "some avg10=12.50 avg60=3.00 avg300=1.00 total=100\n"
+                              "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n",
+        job + "memory.pressure": "some avg10=1.25 avg60=0.00 avg300=0.00 total=10\n",
+        "proc_cgroup": "0::/system.slice/job.scope\n",
+    })
+    cgroup = CgroupStats(root, proc_cgroup=os.path.join(root, "proc_cgroup"))
+    assert cgroup.version == 2 and cgroup.available
+    stats = cgroup.stats(now=10)
+    assert stats["cgroup.cpu.limit"] == 2
+    assert stats["cgroup.memory.currentMB"] == 512
+    assert stats["cgroup.memory.maxMB"] == 1024
+    assert stats["cgroup.memory"] == 50
+    assert stats["cgroup.pressure.cpu.some"] == 12.5
+    assert stats["cgroup.pressure.cpu.full"] == 0
+    assert stats["cgroup.pressure.memory.some"] == 1.25
+    assert "cgroup.cpu" not in stats
+    write_files(root, {
+        job + "cpu.stat": "usage_usec 3000000\nnr_periods 120\nnr_throttled 25\n"
+                          "throttled_usec 550000\n",
+        job + "memory.max": "max\n"})
+    stats = cgroup.stats(now=12)
+    assert stats["cgroup.cpu"] == 100
+    assert stats["cgroup.cpu.throttled"] == 25
+    assert stats["cgroup.cpu.throttled_periods"] == 15
+    assert "cgroup.memory.maxMB" not in stats
+
+
+def test_cgroup_v1(tmpdir):
+    root = str(tmpdir.join("cgroup"))
+    write_files(root, {
+        "cpu,cpuacct/docker/abc/cpu.stat": "nr_periods 10\nnr_throttled 4\n"
+                                           "throttled_time 1000000000\n",
+        "cpu,cpuacct/docker/abc/cpuacct.usage": "5000000000\n",
+        "cpu,cpuacct/docker/abc/cpu.cfs_quota_us": "-1\n",
+        "cpu,cpuacct/docker/abc/cpu.cfs_period_us": "100000\n",
+        # not visible from inside the namespace, falls back to the root
+        "memory/memory.usage_in_bytes": "%i\n" % (100 * 1048576),
+        "memory/memory.limit_in_bytes": "9223372036854771712\n",
+        "proc_cgroup": "4:memory:/docker/abc\n3:cpu,cpuacct:/docker/abc\n",
+    })
+    cgroup = CgroupStats(root, proc_cgroup=os.path.join(root, "proc_cgroup"))
+    assert cgroup.version == 1
+    assert cgroup.memory_dir == os.path.join(root, "memory")
+    stats = cgroup.stats(now=0)
+    assert stats == {"cgroup.memory.currentMB": 100}
+    write_files(root, {
+        "cpu,cpuacct/docker/abc/cpu.stat": "nr_periods 20\nnr_throttled 9\n"
+                                           "throttled_time 1500000000\n",
+        "cpu,cpuacct/docker/abc/cpuacct.usage": "6000000000\n"})
+    stats = cgroup.stats(now=1)
+    assert stats["cgroup.cpu"] == 100
+    assert stats["cgroup.cpu.throttled"] == 50
+    assert stats["cgroup.cpu.throttled_periods"] == 5
+
+
+def test_no_cgroup(tmpdir):
+    cgroup = CgroupStats(str(tmpdir.join("missing")), proc_cgroup=str(tmpdir.join("nope")))
+    assert not cgroup.available
+
+
+class FakeNVMLError(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeNVML(object):
+    """Two GPUs, the second doesn't report power"""
+    NVMLError = FakeNVMLError
+    NVML_ERROR_NOT_SUPPORTED = 3
+    NVML_TEMPERATURE_GPU = 0
+    NVML_CLOCK_SM = 1
+    NVML_CLOCK_MEM = 2
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.calls = collections.Counter()
+
+    def __getattribute__(self, name):
+        if name.startswith("nvmlDevice"):
+            object.__getattribute__(self, "calls")[name] += 1
+        return object.__getattribute__(self, name)
+
+    def nvmlInit(self):
+        pass
+
+    def nvmlDeviceGetCount(self):
+        return 2
+
+    def nvmlDeviceGetHandleByIndex(self, i):
+        return i
+
+    def nvmlDeviceGetUtilizationRates(self, handle):
+        return FakeIO(gpu=90 + handle, memory=40)
+
+    def nvmlDeviceGetTemperature(self, handle, sensor):
+        return 70
+
+    def nvmlDeviceGetMemoryInfo(self, handle):
+        return FakeIO(used=4 * 1048576 * 1024, total=16 * 1048576 * 1024)
+
+    def nvmlDeviceGetPowerUsage(self, handle):
+        if handle == 1:
+            raise FakeNVMLError(self.NVML_ERROR_NOT_SUPPORTED)
+        return 150000
+
+    def nvmlDeviceGetEnforcedPowerLimit(self, handle):
+        return 300000
+
+    def nvmlDeviceGetClockInfo(self, handle, clock):
+        return 1500 if clock == self.NVML_CLOCK_SM else 877
+
+    def nvmlDeviceGetComputeRunningProcesses(self, handle):
+        return [FakeIO(pid=self.pid, usedGpuMemory=1048576 * 100),
+                FakeIO(pid=1, usedGpuMemory=1048576 * 900),
+                FakeIO(pid=self.pid + 1, usedGpuMemory=None)]
+
+
+def test_nvml_backend():
+    nvml = FakeNVML(os.getpid())
+    gpu = NvmlBackend(nvml)
+    assert gpu.device_count == 2
+    stats = gpu.stats([os.getpid(), os.getpid() + 1])
+    assert stats["gpu.0.gpu"] == 90 and stats["gpu.1.gpu"] == 91
+    assert stats["gpu.0.memory"] == 40 and stats["gpu.0.temp"] == 70
+    assert stats["gpu.0.memoryUsedMB"] == 4096
+    assert stats["gpu.0.memoryAllocated"] == 25
+    assert stats["gpu.0.powerWatts"] == 150 and stats["gpu.0.powerPercent"] == 50
+    assert "gpu.1.powerWatts" not in stats
+    assert stats["gpu.1.smClock"] == 1500 and stats["gpu.1.memoryClock"] == 877
+    assert stats["gpu.0.process.memoryUsedMB"] == 100
+    gpu.stats()
+    # handles are cached and unsupported calls aren't retried
+    assert nvml.calls["nvmlDeviceGetHandleByIndex"] == 2
+    assert nvml.calls["nvmlDeviceGetPowerUsage"] == 3
+    assert "gpu.0.process.memoryUsedMB" not in gpu.stats()
+
+
+def test_system_stats_gpu_backend(api):
+    with CliRunner().isolated_filesystem():
+        run = wandb.wandb_run.Run.from_environment_or_defaults()
+        stats = SystemStats(run, api, gpu=NvmlBackend(FakeNVML(os.getpid())))
+        stats.pid = os.getpid()
+        sample = stats.stats()
+        assert stats.gpu_count == 2
+        assert sample["gpu.1.temp"] == 70
+        assert sample["gpu.0.process.memoryUsedMB"] == 100
+        assert "gpu.0.gpu" not in SystemStats(run, api, gpu=GPUBackend()).stats()
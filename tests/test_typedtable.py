@@ -0,0 +1,59 @@
+import json
+
+from click.testing import CliRunner
+import pytest
+
+import wandb
+from wandb import jsonlfile
+from wandb.typedtable import TypedTable
+
+
+@pytest.fixture(params=[False, True], ids=["rows", "columnar"])
+def table(request):
+    with CliRunner().isolated_filesystem():
+        table = TypedTable(jsonlfile.JsonlFile(
+            "examples.jsonl", columnar=request.param, flush_rows=10))
+        table.set_columns([("label", str), ("score", float),
+                           ("ratio", wandb.types.Percentage)])
+        yield table
+
+
+def test_add_rows(table):
+    table.add({"label": "first", "score": 1})
+    table.add_rows([{"label": i, "score": i / 2.0, "ratio": 0.5} for i in range(20)])
+    table.add_rows([{"label": "no score"}])
+    assert table.count() == 22
+    table.close()
+    rows = list(jsonlfile.JsonlFile.read_rows("examples.jsonl"))
+    assert rows[0]["columns"] == ["label", "score", "ratio"]
+    assert rows[1] == {"label": "first", "score": 1.0}
+    assert rows[2:22] == [{"label": str(i), "score": i / 2.0, "ratio": 0.5}
+                          for i in range(20)]
+    assert rows[22] == {"label": "no score"}
+    with open("examples.jsonl") as f:
+        lines = f.readlines()
+    assert len(lines) == (4 if table._output.columnar else 23)
+
+
+def test_add_rows_errors(table):
+    with pytest.raises(wandb.Error):
+        table.add_rows([{"label": "a"}, {"unknown": 1}])
+    with pytest.raises(wandb.Error):
+        table.add_rows([{"score": "not a number"}])
+    with pytest.raises(wandb.Error):
+        table.add_rows([{"ratio": 2}])
+    assert table.count() == 0
+
+
+def test_buffered_until_flush_rows():
+    with CliRunner().isolated_filesystem():
+        out = jsonlfile.JsonlFile("examples.jsonl", flush_rows=3)
+        out.add({"a": 1})
+        out.add({"a": 2})
+        assert open("examples.jsonl").read() == ""
+        out.add({"a": 3})
+        assert len(open("examples.jsonl").readlines()) == 3
+        out.add({"a": 4})
+        out.flush()
+        assert json.loads(open("examples.jsonl").readlines()[-1]) == {"a": 4}
+        out.close()
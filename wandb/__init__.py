@@ -356,6 +356,16 @@ def log(row=None, commit=True):
         run.history.row.update(row)
 
 
+def log_batch(batch):
+    """Log arrays of values to the global run's history, one row per element.
+
+    Eg.
+
+    wandb.log_batch({'batch-loss': np.array([0.5, 0.4, 0.3]), 'epoch': 1})
+    """
+    run.history.add_batch(batch)
+
+
 def ensure_configured():
     # We re-initialize here for tests
     api = Api()
@@ -0,0 +1,252 @@
+"""Constant memory statistics over streams of logged values."""
+
+import math
+import numbers
+
+import six
+
+
+def is_number(value):
+    """True for ints and floats (including numpy scalars), but not bools"""
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+AGGREGATES = ("min", "max", "mean", "last", "count", "nan_count")
+
+
+def is_aggregate(name):
+    """True for the names RunningStats.aggregate understands"""
+    return name in AGGREGATES or (name.startswith("p") and name[1:].isdigit()
+                                  and int(name[1:]) <= 100)
+
+
+class QuantileSketch(object):
+    """Mergeable quantile sketch with bounded relative error (DDSketch).
+
+    Values are counted in logarithmically sized buckets, so every quantile is
+    within relative_accuracy of a true value while memory only grows with the
+    log of the range of values. When there are more than max_buckets the
+    buckets closest to zero are collapsed. Infinite values aren't counted.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _key(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def _value(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def _collapse(self, buckets):
+        keys = sorted(buckets)
+        extra = len(keys) - self.max_buckets
+        if extra <= 0:
+            return
+        target = keys[extra]
+        for key in keys[:extra]:
+            buckets[target] += buckets.pop(key)
+
+    def add(self, value):
+        if value != value or value in (float('inf'), float('-inf')):
+            return
+        if value > 0:
+            buckets, key = self.positive, self._key(value)
+        elif value < 0:
+            buckets, key = self.negative, self._key(-value)
+        else:
+            self.zeros += 1
+            self.count += 1
+            return
+        buckets[key] = buckets.get(key, 0) + 1
+        self.count += 1
+        if len(buckets) > self.max_buckets:
+            self._collapse(buckets)
+
+    def quantile(self, q):
+        """The value at quantile q (0 <= q <= 1), or None if nothing was added"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank or not self.positive:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive))
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge sketches with different accuracies")
+        for buckets, other_buckets in ((self.positive, other.positive),
+                                       (self.negative, other.negative)):
+            for key, count in six.iteritems(other_buckets):
+                buckets[key] = buckets.get(key, 0) + count
+            self._collapse(buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def to_dict(self):
+        return {"relative_accuracy": self.relative_accuracy,
+                "zeros": self.zeros,
+                "positive": sorted(self.positive.items()),
+                "negative": sorted(self.negative.items())}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["relative_accuracy"])
+        sketch.positive = {int(k): c for k, c in state["positive"]}
+        sketch.negative = {int(k): c for k, c in state["negative"]}
+        sketch.zeros = state["zeros"]
+        sketch.count = sketch.zeros + \
+            sum(sketch.positive.values()) + sum(sketch.negative.values())
+        return sketch
+
+
+class RunningStats(object):
+    """Running count, min, max, mean and last value of a stream of numbers, plus
+    a quantile sketch unless sketch=False.
+
+    NaNs are recorded as the last value and in nan_count but otherwise ignored.
+    """
+
+    def __init__(self, sketch=True):
+        self.count = 0
+        self.nan_count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.last = None
+        self.sketch = QuantileSketch() if sketch else None
+
+    def add(self, value):
+        self.last = value
+        if value != value:
+            self.nan_count += 1
+            return
+        if self.count == 0:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.count += 1
+        self.sum += value
+        if self.sketch is not None:
+            self.sketch.add(value)
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.sum / self.count
+
+    def quantile(self, q):
+        """Approximate value at quantile q, clamped to the exact min and max"""
+        if self.sketch is None or not self.sketch.count:
+            return None
+        return max(self.min, min(self.max, self.sketch.quantile(q)))
+
+    def aggregate(self, name):
+        """One of min, max, mean, last, count, nan_count or pNN (eg. p95)"""
+        if not is_aggregate(name):
+            raise ValueError("Unknown aggregate: %s" % name)
+        if name in AGGREGATES:
+            return getattr(self, name)
+        return self.quantile(int(name[1:]) / 100.0)
+
+    def merge(self, other):
+        """Combines the stats of other (which covers later values) into these"""
+        if other.count:
+            if self.count == 0:
+                self.min, self.max = other.min, other.max
+            else:
+                self.min = min(self.min, other.min)
+                self.max = max(self.max, other.max)
+        self.count += other.count
+        self.nan_count += other.nan_count
+        self.sum += other.sum
+        if other.last is not None:
+            self.last = other.last
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+
+    def to_dict(self):
+        return {"count": self.count, "nan_count": self.nan_count, "min": self.min,
+                "max": self.max, "mean": self.mean, "last": self.last}
+
+    def state(self):
+        """Everything needed to restore these stats with from_state"""
+        state = self.to_dict()
+        state["sum"] = self.sum
+        if self.sketch is not None:
+            state["sketch"] = self.sketch.to_dict()
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls(sketch=False)
+        for key in ("count", "nan_count", "min", "max", "sum", "last"):
+            setattr(stats, key, state[key])
+        if state.get("sketch"):
+            stats.sketch = QuantileSketch.from_dict(state["sketch"])
+        return stats
+
+
+class Window(object):
+    """Accumulates RunningStats for a set of keys until `steps` rows have been
+    added or `seconds` have passed since the first one.
+    """
+
+    def __init__(self, steps=None, seconds=None):
+        if not steps and not seconds:
+            raise ValueError("Aggregation windows need steps or seconds")
+        self.steps = steps
+        self.seconds = seconds
+        self.stats = {}
+        self.rows = 0
+        self.started = None
+
+    def add(self, key, value, now):
+        if self.started is None:
+            self.started = now
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = RunningStats(sketch=False)
+        stats.add(value)
+
+    def ready(self, now):
+        if self.started is None:
+            return False
+        return bool((self.steps and self.rows >= self.steps) or
+                    (self.seconds and now - self.started >= self.seconds))
+
+    def flush(self):
+        """Returns the aggregated row for this window and starts a new one:
+        key is the mean, key.min, key.max, key.last and key.count the rest.
+        """
+        row = {}
+        for key, stats in six.iteritems(self.stats):
+            row[key] = stats.mean if stats.count else stats.last
+            row[key + ".min"] = stats.min
+            row[key + ".max"] = stats.max
+            row[key + ".last"] = stats.last
+            row[key + ".count"] = stats.count
+        self.stats = {}
+        self.rows = 0
+        self.started = None
+        return row
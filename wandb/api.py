@@ -28,6 +28,7 @@ import time
 import sys
 
 from six import b
+import six
 
 import wandb
 from wandb import __version__, wandb_dir, Error
@@ -156,6 +157,9 @@ class Api(object):
             'system_sample_seconds': 2,
             'system_samples': 15,
             'heartbeat_seconds': 30,
+            # set by the backend once it accepts summary patches
+            'summary_patches': False,
+            'summary_snapshot_seconds': 10,
         }
         client = Client(
             transport=RequestsHTTPTransport(
@@ -1040,6 +1044,35 @@ class OverwriteFilePolicy(object):
             'offset': 0, 'content': [chunks[-1].data]
         }
 
+
+class SummaryFilePolicy(object):
+    """Like OverwriteFilePolicy for summaries pushed as dicts of changes:
+    {"set": {...}, "del": [...]} plus "full": True for complete snapshots.
+    Changes since the last snapshot in a batch are merged into it, otherwise
+    they're sent as a single patch.
+    """
+
+    def process_chunks(self, chunks):
+        full = False
+        changed = {}
+        removed = set()
+        for chunk in chunks:
+            if chunk.data.get('full'):
+                full = True
+                changed = {}
+                removed = set()
+            for key in chunk.data.get('del', []):
+                changed.pop(key, None)
+                removed.add(key)
+            for key, value in six.iteritems(chunk.data.get('set', {})):
+                removed.discard(key)
+                changed[key] = value
+        if full:
+            return {'offset': 0, 'content': [json.dumps(changed)]}
+        return {'offset': 0, 'patch': True,
+                'content': [json.dumps({'set': changed, 'del': sorted(removed)})]}
+
+
 class CRDedupeFilePolicy(object):
     def __init__(self, start_chunk_id=0):
         self._chunk_id = start_chunk_id
@@ -0,0 +1,366 @@
+"""A compact binary encoding for history rows.
+
+The file is a magic header followed by self contained blocks, one per group
+commit, so appending never requires reading back what's already on disk:
+
+    file    := MAGIC block*
+    block   := b'B' varint(len(payload)) payload
+    payload := varint(n_keys) (varint(len) utf8_key)* varint(n_rows) row*
+    row     := varint(n_fields) (varint(key_id) tag value)*
+
+Key names are interned once per block. Within a block each key remembers its
+previous value: ints (eg. _step) are stored as zigzag varint deltas,
+_timestamp and _runtime as deltas of their IEEE 754 bit patterns, and other
+floats are XORed with the previous value (Gorilla style, at byte granularity)
+so that slowly changing metrics only store their differing middle bytes.
+Anything else is stored as a string or as json.
+
+The backend only understands jsonl: StreamDecoder turns the blocks appended
+to a file into rows as they are written so they can be streamed during the
+run, and to_jsonl() converts a whole file.
+"""
+
+import json
+import os
+import struct
+
+import six
+
+from wandb import serialize
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'WBH1'
+BLOCK = b'B'
+
+NULL, FALSE, TRUE, INT, FLOAT_DELTA, FLOAT_XOR, STRING, JSON = range(8)
+
+# floats that grow steadily, their bit patterns delta encode well
+DELTA_KEYS = frozenset(['_timestamp', '_runtime'])
+
+
+def _encode_varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _float_bits(value):
+    return struct.unpack('<Q', struct.pack('<d', value))[0]
+
+
+def _bits_float(bits):
+    return struct.unpack('<d', struct.pack('<Q', bits))[0]
+
+
+def _scalar(value):
+    """Converts numpy scalars into the python type we know how to encode"""
+    if np is not None and isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class BlockEncoder(object):
+    """Encodes a list of rows into one block"""
+
+    def __init__(self):
+        self._key_ids = {}
+        self._keys = []
+        self._previous = {}
+        self._rows = bytearray()
+
+    def _key_id(self, key):
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            key_id = self._key_ids[key] = len(self._keys)
+            self._keys.append(key)
+        return key_id
+
+    def _encode_value(self, key, value, out):
+        value = _scalar(value)
+        previous = self._previous.get(key)
+        if value is None:
+            out.append(NULL)
+        elif isinstance(value, bool):
+            out.append(TRUE if value else FALSE)
+        elif isinstance(value, six.integer_types):
+            base = previous if isinstance(previous, six.integer_types) and not isinstance(previous, bool) else 0
+            out.append(INT)
+            _encode_varint(_zigzag(value - base), out)
+        elif isinstance(value, float):
+            bits = _float_bits(value)
+            base = _float_bits(previous) if isinstance(previous, float) else 0
+            if key in DELTA_KEYS:
+                out.append(FLOAT_DELTA)
+                _encode_varint(_zigzag(bits - base), out)
+            else:
+                xor = bits ^ base
+                raw = struct.pack('>Q', xor)
+                leading = len(raw) - len(raw.lstrip(b'\0'))
+                trailing = len(raw) - len(raw.rstrip(b'\0')) if xor else 0
+                out.append(FLOAT_XOR)
+                out.append(leading << 4 | trailing)
+                out.extend(raw[leading:len(raw) - trailing])
+        elif isinstance(value, six.string_types):
+            encoded = value.encode('utf-8')
+            out.append(STRING)
+            _encode_varint(len(encoded), out)
+            out.extend(encoded)
+        else:
+            encoded = serialize.dumps(value).encode('utf-8')
+            out.append(JSON)
+            _encode_varint(len(encoded), out)
+            out.extend(encoded)
+        self._previous[key] = value
+
+    def add(self, row):
+        out = self._rows
+        _encode_varint(len(row), out)
+        for key, value in six.iteritems(row):
+            _encode_varint(self._key_id(key), out)
+            self._encode_value(key, value, out)
+
+    def encode(self, n_rows):
+        payload = bytearray()
+        _encode_varint(len(self._keys), payload)
+        for key in self._keys:
+            encoded = key.encode('utf-8')
+            _encode_varint(len(encoded), payload)
+            payload.extend(encoded)
+        _encode_varint(n_rows, payload)
+        payload.extend(self._rows)
+        block = bytearray(BLOCK)
+        _encode_varint(len(payload), block)
+        block.extend(payload)
+        return bytes(block)
+
+
+def encode_block(rows):
+    encoder = BlockEncoder()
+    for row in rows:
+        encoder.add(row)
+    return encoder.encode(len(rows))
+
+
+def decode_block(payload):
+    """Decodes the payload of one block into a list of rows"""
+    payload = bytearray(payload)
+    pos = 0
+    n_keys, pos = _decode_varint(payload, pos)
+    keys = []
+    for _ in range(n_keys):
+        length, pos = _decode_varint(payload, pos)
+        keys.append(payload[pos:pos + length].decode('utf-8'))
+        pos += length
+    n_rows, pos = _decode_varint(payload, pos)
+    previous = {}
+    rows = []
+    for _ in range(n_rows):
+        n_fields, pos = _decode_varint(payload, pos)
+        row = {}
+        for _ in range(n_fields):
+            key_id, pos = _decode_varint(payload, pos)
+            key = keys[key_id]
+            tag = payload[pos]
+            pos += 1
+            if tag == NULL:
+                value = None
+            elif tag == FALSE:
+                value = False
+            elif tag == TRUE:
+                value = True
+            elif tag == INT:
+                delta, pos = _decode_varint(payload, pos)
+                base = previous.get(key)
+                if not isinstance(base, six.integer_types) or isinstance(base, bool):
+                    base = 0
+                value = base + _unzigzag(delta)
+            elif tag == FLOAT_DELTA:
+                delta, pos = _decode_varint(payload, pos)
+                base = previous.get(key)
+                base = _float_bits(base) if isinstance(base, float) else 0
+                value = _bits_float(base + _unzigzag(delta))
+            elif tag == FLOAT_XOR:
+                control = payload[pos]
+                pos += 1
+                leading, trailing = control >> 4, control & 0xf
+                length = 8 - leading - trailing
+                raw = b'\0' * leading + bytes(payload[pos:pos + length]) + b'\0' * trailing
+                pos += length
+                base = previous.get(key)
+                base = _float_bits(base) if isinstance(base, float) else 0
+                value = _bits_float(struct.unpack('>Q', raw)[0] ^ base)
+            elif tag in (STRING, JSON):
+                length, pos = _decode_varint(payload, pos)
+                value = payload[pos:pos + length].decode('utf-8')
+                pos += length
+                if tag == JSON:
+                    value = json.loads(value)
+            else:
+                raise ValueError('Unknown binary history tag %i' % tag)
+            previous[key] = value
+            row[key] = value
+        rows.append(row)
+    return rows
+
+
+def _blocks(f):
+    """Yields (offset, payload length) for every complete block in a file, a torn
+    final block is ignored.
+    """
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        return
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('%s is not a binary history file' % f.name)
+    while True:
+        offset = f.tell()
+        header = f.read(11)
+        if len(header) < 2 or header[:1] != BLOCK:
+            return
+        try:
+            length, pos = _decode_varint(bytearray(header), 1)
+        except IndexError:
+            return
+        if offset + pos + length > size:
+            return
+        yield offset + pos, length
+        f.seek(offset + pos + length)
+
+
+class StreamDecoder(object):
+    """Decodes the rows of a binary history file from data read as it grows,
+    a block is decoded once all of it has been fed.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # reading may start at the beginning of the file or at a block boundary
+        self._header = True
+
+    def feed(self, data):
+        self._buffer.extend(data)
+        if self._header:
+            if len(self._buffer) < len(MAGIC) and MAGIC.startswith(bytes(self._buffer)):
+                return []
+            if self._buffer.startswith(MAGIC):
+                del self._buffer[:len(MAGIC)]
+            self._header = False
+        rows = []
+        while self._buffer:
+            if self._buffer[:1] != BLOCK:
+                raise ValueError('Invalid binary history block')
+            try:
+                length, pos = _decode_varint(self._buffer, 1)
+            except IndexError:
+                break
+            if pos + length > len(self._buffer):
+                break
+            rows.extend(decode_block(self._buffer[pos:pos + length]))
+            del self._buffer[:pos + length]
+        return rows
+
+
+def _in_stream(row, stream):
+    return stream is None or row.get('_stream', 'default') == stream
+
+
+def read_rows(fname, stream=None):
+    with open(fname, 'rb') as f:
+        for offset, length in list(_blocks(f)):
+            f.seek(offset)
+            for row in decode_block(f.read(length)):
+                if _in_stream(row, stream):
+                    yield row
+
+
+def read_last_row(fname, stream=None):
+    """Returns the last row of a stream, only decoding blocks from the end of
+    the file until we find one.
+    """
+    with open(fname, 'rb') as f:
+        blocks = list(_blocks(f))
+        for offset, length in reversed(blocks):
+            f.seek(offset)
+            for row in reversed(decode_block(f.read(length))):
+                if _in_stream(row, stream):
+                    return row
+    return None
+
+
+def to_jsonl(fname, jsonl_fname):
+    """Converts a binary history file into the jsonl format the backend expects"""
+    with open(jsonl_fname, 'w') as f:
+        for row in read_rows(fname):
+            f.write(serialize.dumps(row))
+            f.write('\n')
+
+
+class BinaryWriter(object):
+    """History writer producing the binary format"""
+
+    def __init__(self, fname):
+        self.fname = fname
+        # the wandb process builds a History for the same file without writing
+        # to it, so the file is only repaired once rows are written
+        open(fname, 'ab').close()
+        self._file = None
+
+    def _open(self):
+        self._truncate_torn_block()
+        self._file = open(self.fname, 'ab')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.write(MAGIC)
+            self._file.flush()
+
+    read_rows = staticmethod(read_rows)
+    read_last_row = staticmethod(read_last_row)
+
+    def _truncate_torn_block(self):
+        """Drops a partially written final block so new blocks stay readable"""
+        try:
+            with open(self.fname, 'r+b') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
+                end = len(MAGIC)
+                for offset, length in _blocks(f):
+                    end = offset + length
+                f.truncate(end)
+        except (IOError, ValueError):
+            pass
+
+    def write_rows(self, rows):
+        if rows:
+            if self._file is None:
+                self._open()
+            self._file.write(encode_block(rows))
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,229 @@
+"""Column oriented in-memory storage for history rows.
+
+Every key gets its own typed buffer (an `array.array` for ints and floats, a
+plain list for everything else) plus a presence bitmap, so storing a run with
+millions of steps doesn't cost a dict per row. Values come back exactly as
+they were logged: a column that mixes ints and floats falls back to a list.
+"""
+
+import collections
+from array import array
+
+import six
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+
+def _int64_typecode():
+    """A 64 bit signed array typecode, python 2 has no 'q'"""
+    for typecode in ('q', 'l'):
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            pass
+    return None
+
+
+# None where there isn't one (python 2 on windows), ints are kept in lists
+INT64 = _int64_typecode()
+
+
+def _typecode(value):
+    """The array typecode we'd use to store value, or None for a list"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, six.integer_types) or (np is not None and isinstance(value, np.integer)):
+        if INT_MIN <= value <= INT_MAX:
+            return INT64
+        return None
+    if isinstance(value, float) or (np is not None and isinstance(value, np.floating)):
+        return 'd'
+    return None
+
+
+class Column(object):
+    """The values for one key.
+
+    Values are stored for every row from the row the key first appeared in
+    (`start`), absent rows hold a filler value and are cleared in `present`.
+    The bitmap uses numpy's (big endian) bit order so it can be unpacked with
+    np.unpackbits.
+    """
+
+    def __init__(self, start, value):
+        self.start = start
+        self.typecode = _typecode(value)
+        if self.typecode:
+            self.values = array(self.typecode)
+        else:
+            self.values = []
+        self.present = bytearray()
+        self.count = 0
+        self.last = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def dense(self):
+        """True if the key was present in every row since it first appeared"""
+        return self.count == len(self.values)
+
+    def _filler(self):
+        return 0 if self.typecode else None
+
+    def _coerce(self, value):
+        """Returns value in a form we can store, converting our buffer if needed"""
+        if self.typecode is None:
+            return value
+        if _typecode(value) != self.typecode:
+            self.values = list(self.values)
+            self.typecode = None
+        return value
+
+    def append(self, index, value):
+        """Stores value for the row at index, which must be past any stored row"""
+        value = self._coerce(value)
+        pos = index - self.start
+        filler = self._filler()
+        while len(self.values) < pos:
+            self.values.append(filler)
+        self.values.append(value)
+        while len(self.present) <= pos >> 3:
+            self.present.append(0)
+        self.present[pos >> 3] |= 0x80 >> (pos & 7)
+        self.count += 1
+        self.last = value
+
+    def has(self, index):
+        pos = index - self.start
+        if pos < 0 or pos >= len(self.values):
+            return False
+        return bool(self.present[pos >> 3] & (0x80 >> (pos & 7)))
+
+    def get(self, index):
+        return self.values[index - self.start]
+
+
+class ColumnView(collections.Sequence):
+    """Read only view of the values present in a column, in row order"""
+
+    def __init__(self, column=None):
+        self._column = column
+        self._compact = None
+
+    def _values(self):
+        column = self._column
+        if column is None:
+            return []
+        if column.dense:
+            return column.values
+        if self._compact is None or len(self._compact) != column.count:
+            self._compact = [v for i, v in enumerate(column.values)
+                             if column.present[i >> 3] & (0x80 >> (i & 7))]
+        return self._compact
+
+    def __len__(self):
+        return len(self._column) if self._column else 0
+
+    def __iter__(self):
+        column = self._column
+        if column is None:
+            return iter([])
+        if column.dense:
+            return iter(column.values)
+        present = column.present
+        return (v for i, v in enumerate(column.values)
+                if present[i >> 3] & (0x80 >> (i & 7)))
+
+    def __getitem__(self, index):
+        return self._values()[index]
+
+    def numpy(self):
+        """The present values as a numpy array. It's a copy: a view would lock the
+        column's buffer and appending to it would fail.
+        """
+        column = self._column
+        if np is None:
+            raise ValueError("ColumnView.numpy requires numpy: pip install numpy")
+        if column is None:
+            return np.array([])
+        if column.typecode is None:
+            return np.array(self._values())
+        values = np.frombuffer(column.values, dtype=np.dtype(column.typecode)).copy()
+        if column.dense:
+            return values
+        mask = np.unpackbits(np.frombuffer(bytes(column.present), dtype=np.uint8))
+        return values[mask[:len(values)].astype(bool)]
+
+
+class RowsView(collections.Sequence):
+    """Lazily reconstructs row dicts from a ColumnStore for code that expects a list"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._store.row(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('history row index out of range')
+        return self._store.row(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._store.row(i)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class ColumnStore(object):
+    """Rows stored as one Column per key"""
+
+    def __init__(self):
+        self.columns = {}
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, row):
+        index = self._length
+        for key, value in six.iteritems(row):
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = Column(index, value)
+            column.append(index, value)
+        self._length += 1
+
+    def keys(self):
+        return self.columns.keys()
+
+    def column(self, key):
+        return ColumnView(self.columns.get(key))
+
+    def row(self, index):
+        return {key: column.get(index) for key, column in six.iteritems(self.columns)
+                if column.has(index)}
+
+    def rows(self):
+        return RowsView(self)
@@ -0,0 +1,86 @@
+"""Sparse history rows for very wide rows where few keys change between steps.
+
+A delta row only holds the keys whose values changed since the previous row
+of its stream, the keys that were dropped in _removed and a true _delta.
+_step, _runtime, _timestamp and _stream are always written. Every
+keyframe_interval rows (and at the start of every file or segment) a full
+keyframe row is written instead, so readers never have to go far back to
+rebuild a dense row.
+"""
+
+from wandb import serialize
+
+ALWAYS = frozenset(['_step', '_runtime', '_timestamp', '_stream'])
+MARKERS = ('_delta', '_removed')
+
+
+def _stream(row):
+    return row.get("_stream", "default")
+
+
+def _same(a, b):
+    if type(a) is not type(b):
+        return False
+    try:
+        return bool(a == b)
+    except ValueError:
+        # eg. numpy arrays
+        return serialize.dumps(a) == serialize.dumps(b)
+
+
+def is_delta(row):
+    return bool(row.get('_delta'))
+
+
+class DeltaEncoder(object):
+    """Turns dense rows into delta rows"""
+
+    def __init__(self, keyframe_interval=100):
+        self.keyframe_interval = keyframe_interval
+        self._previous = {}
+        self._since_keyframe = {}
+
+    def encode(self, row):
+        stream = _stream(row)
+        previous = self._previous.get(stream)
+        self._previous[stream] = row
+        since = self._since_keyframe.get(stream, 0) + 1
+        if previous is None or since >= self.keyframe_interval:
+            self._since_keyframe[stream] = 0
+            return row
+        self._since_keyframe[stream] = since
+        delta = {'_delta': True}
+        for key, value in row.items():
+            if key in ALWAYS or key not in previous or not _same(previous[key], value):
+                delta[key] = value
+        removed = [key for key in previous if key not in row]
+        if removed:
+            delta['_removed'] = removed
+        return delta
+
+
+class DeltaDecoder(object):
+    """Rebuilds dense rows from a sequence of keyframes and delta rows. A delta
+    without a preceding keyframe is returned as is, minus the markers.
+    """
+
+    def __init__(self):
+        self._previous = {}
+
+    def decode(self, row):
+        stream = _stream(row)
+        if is_delta(row):
+            dense = dict(self._previous.get(stream) or {})
+            for key in row.get('_removed', ()):
+                dense.pop(key, None)
+            dense.update(row)
+            for key in MARKERS:
+                dense.pop(key, None)
+        else:
+            dense = row
+        self._previous[stream] = dense
+        return dense
+
+    def decode_all(self, rows):
+        for row in rows:
+            yield self.decode(row)
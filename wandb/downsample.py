@@ -0,0 +1,94 @@
+"""Constant memory downsampling of streams of numbers, for sparklines and previews."""
+
+
+class Downsampler(object):
+    """Reduces a stream of numbers of unknown length to at most `size` points.
+
+    Values are grouped into buckets of `width` consecutive values, each
+    bucket keeps its min and max so spikes are never dropped. When there are
+    too many buckets adjacent pairs are merged and the width doubles. The
+    first and last values are always kept, streams with no more than `size`
+    values are kept as is.
+
+    sampler = Downsampler(40)
+    for row in rows:
+        sampler.add(row["loss"])
+    sparkline.sparkify(sampler.values())
+    """
+
+    def __init__(self, size=40):
+        if size < 4:
+            raise ValueError("Downsampler needs a size of at least 4")
+        self.size = size
+        self.count = 0
+        self._max_buckets = (size - 2) // 2
+        self._width = 1
+        # [bucket number, (index, min), (index, max)]
+        self._buckets = []
+        self._first = None
+        self._last = None
+        self._raw = []
+
+    def add(self, value):
+        index = self.count
+        self.count += 1
+        if self._raw is not None:
+            self._raw.append(value)
+            if len(self._raw) > self.size:
+                self._raw = None
+        if self._first is None:
+            self._first = (index, value)
+        self._last = (index, value)
+        number = index // self._width
+        buckets = self._buckets
+        if buckets and buckets[-1][0] == number:
+            bucket = buckets[-1]
+            if value < bucket[1][1]:
+                bucket[1] = (index, value)
+            elif value > bucket[2][1]:
+                bucket[2] = (index, value)
+        else:
+            buckets.append([number, (index, value), (index, value)])
+            if len(buckets) > self._max_buckets:
+                self._merge()
+
+    def extend(self, values):
+        for value in values:
+            self.add(value)
+
+    def _merge(self):
+        self._width *= 2
+        merged = []
+        for number, low, high in self._buckets:
+            number //= 2
+            if merged and merged[-1][0] == number:
+                bucket = merged[-1]
+                if low[1] < bucket[1][1]:
+                    bucket[1] = low
+                if high[1] > bucket[2][1]:
+                    bucket[2] = high
+            else:
+                merged.append([number, low, high])
+        self._buckets = merged
+
+    def points(self):
+        """The kept (index, value) pairs in order"""
+        if self._raw is not None:
+            return list(enumerate(self._raw))
+        points = {}
+        for point in [self._first, self._last]:
+            points[point[0]] = point
+        for _, low, high in self._buckets:
+            points[low[0]] = low
+            points[high[0]] = high
+        return [points[index] for index in sorted(points)]
+
+    def values(self):
+        return [value for _, value in self.points()]
+
+
+def downsample(values, size):
+    """Downsamples values (any iterable) to at most size values in a single pass"""
+    sampler = Downsampler(size)
+    sampler.extend(values)
+    return sampler.values()
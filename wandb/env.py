@@ -22,6 +22,19 @@ PROJECT = 'WANDB_PROJECT'
 ENTITY = 'WANDB_ENTITY'
 BASE_URL = 'WANDB_BASE_URL'
 RUN = 'WANDB_RUN'
+ASYNC_HISTORY = 'WANDB_ASYNC_HISTORY'
+HISTORY_FORMAT = 'WANDB_HISTORY_FORMAT'
+HISTORY_RETAIN_ROWS = 'WANDB_HISTORY_RETAIN_ROWS'
+MEDIA_WORKERS = 'WANDB_MEDIA_WORKERS'
+HISTORY_KEYFRAME_INTERVAL = 'WANDB_HISTORY_KEYFRAME_INTERVAL'
+SUMMARY_JOURNAL = 'WANDB_SUMMARY_JOURNAL'
+SUMMARY_COMPACT_SECONDS = 'WANDB_SUMMARY_COMPACT_SECONDS'
+SPILL_BYTES = 'WANDB_SPILL_BYTES'
+EXAMPLES_COLUMNAR = 'WANDB_EXAMPLES_COLUMNAR'
+CGROUP_ROOT = 'WANDB_CGROUP_ROOT'
+SEGMENT_BYTES = 'WANDB_SEGMENT_BYTES'
+SEGMENT_SECONDS = 'WANDB_SEGMENT_SECONDS'
+SEGMENT_GZIP = 'WANDB_SEGMENT_GZIP'
 
 
 def is_debug():
@@ -70,6 +83,97 @@ def get_show_run(default=None, env=None):
     return bool(env.get(SHOW_RUN, default))
 
 
+def get_async_history(default='false', env=None):
+    if env is None:
+        env = os.environ
+
+    return env.get(ASYNC_HISTORY, default).lower() in ('true', '1', 'yes')
+
+
+def get_history_format(default=None, env=None):
+    if env is None:
+        env = os.environ
+
+    return env.get(HISTORY_FORMAT, default)
+
+
+def get_history_retain_rows(default='true', env=None):
+    if env is None:
+        env = os.environ
+
+    return env.get(HISTORY_RETAIN_ROWS, default).lower() not in ('false', '0', 'no')
+
+
+def get_media_workers(default=0, env=None):
+    if env is None:
+        env = os.environ
+
+    return int(env.get(MEDIA_WORKERS, default))
+
+
+def get_history_keyframe_interval(default=0, env=None):
+    if env is None:
+        env = os.environ
+
+    return int(env.get(HISTORY_KEYFRAME_INTERVAL, default))
+
+
+def get_summary_journal(default='false', env=None):
+    if env is None:
+        env = os.environ
+
+    return env.get(SUMMARY_JOURNAL, default).lower() in ('true', '1', 'yes')
+
+
+def get_summary_compact_seconds(default=1.0, env=None):
+    if env is None:
+        env = os.environ
+
+    return float(env.get(SUMMARY_COMPACT_SECONDS, default))
+
+
+def get_spill_bytes(default=0, env=None):
+    if env is None:
+        env = os.environ
+
+    return int(env.get(SPILL_BYTES, default))
+
+
+def get_examples_columnar(default='false', env=None):
+    if env is None:
+        env = os.environ
+
+    return env.get(EXAMPLES_COLUMNAR, default).lower() in ('true', '1', 'yes')
+
+
+def get_cgroup_root(default='/sys/fs/cgroup', env=None):
+    if env is None:
+        env = os.environ
+
+    return env.get(CGROUP_ROOT, default)
+
+
+def get_segment_bytes(default=0, env=None):
+    if env is None:
+        env = os.environ
+
+    return int(env.get(SEGMENT_BYTES, default))
+
+
+def get_segment_seconds(default=0, env=None):
+    if env is None:
+        env = os.environ
+
+    return float(env.get(SEGMENT_SECONDS, default))
+
+
+def get_segment_gzip(default='false', env=None):
+    if env is None:
+        env = os.environ
+
+    return env.get(SEGMENT_GZIP, default).lower() in ('true', '1', 'yes')
+
+
 def get_description(default=None, env=None):
     if env is None:
         env = os.environ
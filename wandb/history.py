@@ -6,74 +6,554 @@ import collections
 import contextlib
 import copy
 import json
+import logging
 import os
+import threading
 import time
 from threading import Lock
 import warnings
 import weakref
 import six
+from six.moves import queue
 import traceback
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from wandb.wandb_torch import TorchHistory
 import wandb
 from wandb import util
+from wandb import aggregates
+from wandb import columnar
+from wandb import jsonlfile
 from wandb import media
+from wandb import segments
+from wandb import spill
+from wandb import serialize
 from wandb import data_types
+from wandb import delta_rows
+from wandb import history_reader
 
+logger = logging.getLogger(__name__)
 
-class History(object):
-    """Used to store data that changes over time during runs. """
 
-    def __init__(self, fname, out_dir='.', add_callback=None, stream_name="default"):
-        self._start_time = wandb.START_TIME
-        self.out_dir = out_dir
-        self.fname = os.path.join(out_dir, fname)
-        self.rows = []
+class AsyncWriter(object):
+    """Hands rows to a background thread that serializes them and group-commits
+    them with write_fn, either every flush_interval seconds or once flush_rows rows
+    are pending, whichever comes first.
+
+    Rows are put with a sequence number (0, 1, 2...) taken when their step was
+    assigned, they can arrive out of order from different threads and are
+    committed in sequence order. Every sequence number must be put, with an
+    empty list of rows if there's nothing to write.
+    """
+    Close = object()
+
+    def __init__(self, write_fn, flush_interval=1.0, flush_rows=1000):
+        self._write_fn = write_fn
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self._queue = queue.Queue()
+        # rows that arrived before an earlier sequence number, by sequence number
+        self._waiting = {}
+        self._next_seq = 0
+        self._thread = threading.Thread(target=self._thread_body)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, seq, rows):
+        self._queue.put((seq, rows))
+
+    def flush(self):
+        """Blocks until every row put before this call has been written"""
+        if not self._thread.is_alive() or threading.current_thread() is self._thread:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(self.Close)
+            self._thread.join()
+
+    def _commit(self, rows):
+        if not rows:
+            return
+        try:
+            self._write_fn(rows)
+        except Exception:
+            logger.exception("Failed to write %i history rows", len(rows))
+
+    def _ready(self, seq, rows):
+        """Returns the rows that can be committed now that seq has arrived"""
+        self._waiting[seq] = rows
+        ready = []
+        while self._next_seq in self._waiting:
+            ready.extend(self._waiting.pop(self._next_seq))
+            self._next_seq += 1
+        return ready
+
+    def _thread_body(self):
+        pending = []
+        # flushes waiting for rows with an earlier sequence number
+        flushes = []
+        deadline = None
+        while True:
+            if deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = max(0, deadline - time.time())
+            items = util.read_many_from_queue(
+                self._queue, self.flush_rows, timeout)
+            for item in items:
+                if item is self.Close:
+                    for seq in sorted(self._waiting):
+                        pending.extend(self._waiting.pop(seq))
+                    self._commit(pending)
+                    for flush in flushes:
+                        flush.set()
+                    return
+                elif isinstance(item, threading.Event):
+                    flushes.append(item)
+                else:
+                    rows = self._ready(*item)
+                    if rows and not pending:
+                        deadline = time.time() + self.flush_interval
+                    pending.extend(rows)
+            if flushes and not self._waiting:
+                self._commit(pending)
+                pending = []
+                deadline = None
+                for flush in flushes:
+                    flush.set()
+                flushes = []
+            if pending and (len(pending) >= self.flush_rows or time.time() >= deadline):
+                self._commit(pending)
+                pending = []
+                deadline = None
+
+
+def stats_fname(fname):
+    """The hidden file the stats of history file fname are saved to on close"""
+    dirname, basename = os.path.split(fname)
+    return os.path.join(dirname, '.%s.stats.json' % os.path.splitext(basename)[0])
+
+
+def load_stats(fname, steps=None):
+    """Loads the per key RunningStats saved when history file fname was closed.
+    Returns None if there are none, or they don't cover `steps` rows.
+    """
+    try:
+        with open(stats_fname(fname)) as f:
+            saved = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if steps is not None and saved.get("_steps") != steps:
+        return None
+    return {key: aggregates.RunningStats.from_state(state)
+            for key, state in six.iteritems(saved["stats"])}
+
+
+def row_stream(row):
+    """The name of the stream a history row was logged to"""
+    return row.get("_stream", "default")
+
+
+class JsonlWriter(object):
+    """History writer producing json lines, the format the backend streams.
+
+    A writer is constructed with the path it should append to and provides
+    write_rows(rows) and close(), plus read_rows(fname, stream) and
+    read_last_row(fname, stream) for loading what it wrote. Rows of every
+    stream are interleaved in one file, tagged with _stream. Readers are
+    given the stream to return rows for, or None for all of them.
+
+    The byte offset of every row is appended to an index file for
+    history_reader.HistoryReader. Given a segments.SegmentPolicy the file is
+    sealed into segments, which read_rows chains in front of it. With a
+    keyframe_interval rows are written as deltas (see delta_rows.py), readers
+    always return dense rows.
+    """
+
+    def __init__(self, fname, segment_policy=None, keyframe_interval=0):
+        self.fname = fname
+        self.keyframe_interval = keyframe_interval
+        self._rotator = segments.Rotator(
+            fname, segment_policy) if segment_policy else None
+        # the wandb process builds a History for the same file without writing
+        # to it, so the file is only repaired and indexed once rows are written
+        open(fname, 'ab').close()
+        self._file = None
+
+    def _open(self):
+        # every file and segment starts with keyframes
+        self._encoder = delta_rows.DeltaEncoder(
+            self.keyframe_interval) if self.keyframe_interval else None
+        self._file = jsonlfile.open_for_append(self.fname, 'ab')
+        self._offset = os.fstat(self._file.fileno()).st_size
+        self._index = history_reader.IndexWriter(self.fname)
+
+    @staticmethod
+    def _lines(fname):
+        for path in segments.sealed_segments(fname):
+            with segments.open_segment(path) as f:
+                for line in f:
+                    yield line.decode('utf-8')
+        with open(fname, 'rb') as f:
+            for line in f:
+                yield line.decode('utf-8')
+
+    @staticmethod
+    def read_rows(fname, stream=None):
+        decoder = delta_rows.DeltaDecoder()
+        for line in JsonlWriter._lines(fname):
+            # rows of named streams always have a _stream key, so we can
+            # skip the default stream's rows without parsing them
+            if stream not in (None, "default") and '"_stream"' not in line:
+                continue
+            try:
+                row = json.loads(line)
+            except (TypeError, ValueError):
+                print('warning: malformed history line: %s...' %
+                      line[:40])
+                continue
+            if stream is None or row_stream(row) == stream:
+                yield decoder.decode(row)
+
+    @staticmethod
+    def read_last_row(fname, stream=None):
+        if stream is None:
+            rows = jsonlfile.reverse_rows(fname)
+        else:
+            rows = jsonlfile.reverse_rows(
+                fname, predicate=lambda row: row_stream(row) == stream,
+                contains=None if stream == "default" else b'"_stream"')
+        # a delta needs the rows back to its stream's last keyframe
+        chain = []
+        for row in rows:
+            if chain and row_stream(row) != row_stream(chain[0]):
+                continue
+            chain.append(row)
+            if not delta_rows.is_delta(row):
+                break
+        if not chain:
+            return None
+        decoder = delta_rows.DeltaDecoder()
+        return list(decoder.decode_all(reversed(chain)))[-1]
+
+    def write_rows(self, rows):
+        """Serializes rows and writes them with a single flush, then indexes them"""
+        if self._file is None:
+            self._open()
+        lines = []
+        entries = []
+        offset = self._offset
+        for row in rows:
+            if self._encoder:
+                row = self._encoder.encode(row)
+            line = (serialize.dumps(row) + '\n').encode('utf-8')
+            lines.append(line)
+            entries.append(history_reader.ENTRY.pack(
+                history_reader.row_step(row), offset))
+            offset += len(line)
+        self._file.write(b''.join(lines))
+        self._file.flush()
+        self._index.write(b''.join(entries))
+        self._offset = offset
+        if self._rotator and self._rotator.due(offset):
+            self._rotate()
+
+    def _rotate(self):
+        """Seals the active file into a segment (taking its index along) and
+        starts a new one.
+        """
+        self._file.close()
+        self._index.close()
+        path = self._rotator.seal()
+        index = history_reader.index_fname(self.fname)
+        if not os.path.exists(index):
+            pass
+        elif path.endswith('.gz'):
+            os.remove(index)
+        else:
+            os.rename(index, history_reader.index_fname(path))
+        self._open()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._index.close()
+            self._file = None
+
+
+class _RowState(object):
+    """The row being built by one of the threads logging to a History"""
+
+    def __init__(self):
         self.row = {}
-        self.stream_name = stream_name
         # during a batched context logging may still be disabled. we do it this way
         # so people don't have to litter their code with conditionals
         self.compute = False
         self.batched = False
-        # not all rows have the same keys. this is the union of them all.
-        self._keys = set()
+
+
+class History(object):
+    """Used to store data that changes over time during runs.
+
+    Named streams (see stream()) are written to the same file as the default
+    stream, but have their own step counter and in memory index.
+
+    Every thread builds its own row, so threads can log concurrently. With
+    async writes the lock they share is only held to assign steps, rows are
+    transformed outside of it and merged in step order by the writer thread,
+    which also indexes them and calls add_callback.
+    """
+
+    def __init__(self, fname, out_dir='.', add_callback=None, stream_name="default",
+                 async_writes=False, flush_interval=1.0, flush_rows=1000, writer=JsonlWriter,
+                 retain_rows=True, media_workers=0, segment_policy=None, keyframe_interval=0,
+                 spill_bytes=0, parent=None):
+        self._start_time = wandb.START_TIME if parent is None else parent._start_time
+        self.out_dir = out_dir
+        self.fname = os.path.join(out_dir, fname)
+        self._store = columnar.ColumnStore()
+        self._local = threading.local()
+        self.stream_name = stream_name
+        # when rows aren't retained we only keep the last value and running stats
+        # of each key, so memory doesn't grow with the number of steps. Reading
+        # rows or columns then streams them back from disk.
+        self.retain_rows = retain_rows
+        self._last_values = {}
+        self._stats = {}
+        # keys aggregated client side, see aggregate()
+        self._windows = {}
+        # stats added to the summary, see summarize()
+        self._summaries = {}
         self._process = "user" if os.getenv("WANDB_INITED") else "wandb"
         self._streams = {}
         self._steps = 0
-        self._lock = Lock()
         self._torch = None
-        self.load()
-        self._file = open(self.fname, 'a')
+        self._async_options = None
+        self._writer = None
+        self._writer_class = writer
         self._add_callback = add_callback
+        self._parent = parent
+        self._media_pool = None
+        self._spiller = None
+        if parent is not None:
+            # streams share their parent's file, writer and media threads and locks
+            self._root = parent
+            self._lock = parent._lock
+            self._index_lock = parent._index_lock
+            self._lock_waits = parent._lock_waits
+            self._writer = parent._writer
+            self._media_pool = parent._media_pool
+            self._spiller = parent._spiller
+            self.load()
+            self._output = parent._output
+            return
+        self._root = self
+        # _lock is taken by threads logging rows, to assign steps and sequence
+        # numbers. _index_lock guards the file and in memory indexes.
+        self._lock = Lock()
+        self._index_lock = Lock()
+        self._lock_waits = aggregates.RunningStats()
+        self._seq = 0
+        self.load()
+        # only passed when set, so writers that don't support them still work
+        options = {}
+        if segment_policy:
+            options["segment_policy"] = segment_policy
+        if keyframe_interval:
+            options["keyframe_interval"] = keyframe_interval
+        self._output = writer(self.fname, **options)
+        # with media workers, images are encoded in the background and rows
+        # only wait for their (cheap) meta information
+        if media_workers:
+            self._media_pool = media.MediaPool(media_workers)
+        # values with json larger than spill_bytes are written to media/blobs
+        if spill_bytes:
+            self._spiller = spill.Spiller(out_dir, spill_bytes)
+        # when writes are async wandb.log only enqueues rows, the writer thread
+        # serializes them and flushes the file once per batch
+        if async_writes:
+            self._async_options = {"flush_interval": flush_interval,
+                                   "flush_rows": flush_rows}
+            self._writer = AsyncWriter(self._commit_rows, **self._async_options)
+
+    def _row_state(self):
+        """The row state of the current thread. Code that runs on other threads
+        on behalf of this one (eg. torch backward hooks) can hold on to it.
+        """
+        state = getattr(self._local, "state", None)
+        if state is None:
+            state = self._local.state = _RowState()
+        return state
+
+    @property
+    def row(self):
+        return self._row_state().row
+
+    @row.setter
+    def row(self, row):
+        self._row_state().row = row
+
+    @property
+    def compute(self):
+        return self._row_state().compute
+
+    @compute.setter
+    def compute(self, compute):
+        self._row_state().compute = compute
+
+    @property
+    def batched(self):
+        return self._row_state().batched
+
+    @batched.setter
+    def batched(self, batched):
+        self._row_state().batched = batched
 
     def load(self):
-        self.rows = []
+        """Recovers the step and runtime of an existing history file from its last row.
+        The full row index is built lazily, the first time rows are accessed.
+        """
+        self._store = columnar.ColumnStore()
+        self._indexed = False
         try:
-            # only preload the default stream, TODO: better stream support
-            if self.stream_name == "default":
-                with open(self.fname) as f:
-                    for line in f:
-                        try:
-                            self._index(json.loads(line))
-                        except TypeError:
-                            print('warning: malformed history line: %s...' %
-                                  line[:40])
-                # initialize steps and run time based on existing data.
-                if '_step' in self.row:
-                    self._steps = self.row['_step'] + 1
-                # fudge the start_time to compensate for previous run length
-                if '_runtime' in self.row:
-                    self._start_time = wandb.START_TIME - self.row['_runtime']
-                self.row = {}
+            last_row = self._writer_class.read_last_row(
+                self.fname, self.stream_name) or {}
+        except IOError:
+            return
+        if last_row and '_step' not in last_row:
+            # old files without steps, we need to count the rows
+            self._steps = sum(1 for _ in self._writer_class.read_rows(
+                self.fname, self.stream_name))
+        # initialize steps and run time based on existing data.
+        if '_step' in last_row:
+            self._steps = last_row['_step'] + 1
+        # fudge the start_time to compensate for previous run length, streams
+        # share the start time of the default stream
+        if '_runtime' in last_row and self._parent is None:
+            self._start_time = wandb.START_TIME - last_row['_runtime']
+        # pick up the stats of a resumed run if they were saved at its last step
+        if self._parent is None:
+            self._stats = load_stats(self.fname, self._steps) or {}
+
+    def _ensure_index(self):
+        """Builds the in memory row index from the history file if we haven't yet"""
+        self._wait_for_writer()
+        if self._indexed:
+            return
+        with self._index_lock:
+            if self._indexed:
+                return
+            store = columnar.ColumnStore()
+            for row in self._read_rows(flush=False):
+                store.append(row)
+            self._store = store
+            self._indexed = True
+
+    def _wait_for_writer(self):
+        if self._writer:
+            self._writer.flush()
+
+    def _read_rows(self, flush=True):
+        """Streams the rows of this stream back from disk"""
+        if flush:
+            self._wait_for_writer()
+        try:
+            for row in self._writer_class.read_rows(self.fname, self.stream_name):
+                yield row
         except IOError:
             pass
 
+    @property
+    def rows(self):
+        """All committed rows as dicts, reconstructed from the column store on access.
+        If rows aren't retained they're read back from disk.
+        """
+        if not self.retain_rows:
+            return list(self._read_rows())
+        self._ensure_index()
+        return self._store.rows()
+
+    def iter_rows(self):
+        """Iterates over committed rows without loading them all, from memory
+        if they're already indexed, otherwise from disk.
+        """
+        self._wait_for_writer()
+        if self.retain_rows and self._indexed:
+            return iter(self._store.rows())
+        return self._read_rows()
+
     def keys(self):
-        media_keys = []
-        if self.rows:
-            media_keys = [k for k, v in six.iteritems(
-                self.rows[-1]) if isinstance(v, dict) and v.get("_type")]
-        return [k for k in self._keys - set(media_keys) if not k.startswith("_")]
+        """Keys of the user logged columns, skipping media whose last value was a media dict"""
+        self._wait_for_writer()
+        if self.retain_rows:
+            self._ensure_index()
+            last_values = ((k, column.last)
+                           for k, column in six.iteritems(self._store.columns))
+        else:
+            last_values = six.iteritems(self._last_values)
+        return [k for k, last in last_values
+                if not k.startswith("_") and not (isinstance(last, dict) and last.get("_type"))]
+
+    def stats(self, key):
+        """Running count/min/max/mean/last of a numeric key logged by this process,
+        or None if it hasn't been logged.
+        """
+        self._wait_for_writer()
+        return self._stats.get(key)
+
+    def summarize(self, key, stats=("best",), goal="minimize"):
+        """Adds stats of a numeric key to the run summary as key.<stat>. Stats
+        are min, max, mean, last, count, nan_count, pNN for a quantile (eg.
+        p95) or best, the min or max depending on goal:
+
+        run.history.summarize("val_loss", ["best", "p95"])
+        """
+        if goal not in ("minimize", "maximize"):
+            raise ValueError("goal must be minimize or maximize")
+        if isinstance(stats, six.string_types):
+            stats = [stats]
+        for name in stats:
+            if name != "best" and not aggregates.is_aggregate(name):
+                raise ValueError("Unknown aggregate: %s" % name)
+        self._summaries[key] = (list(stats), goal)
+
+    def summary_values(self):
+        """The summary entries configured with summarize()"""
+        values = {}
+        for key, (names, goal) in six.iteritems(self._summaries):
+            stats = self._stats.get(key)
+            if stats is None:
+                continue
+            for name in names:
+                if name == "best":
+                    value = stats.min if goal == "minimize" else stats.max
+                else:
+                    value = stats.aggregate(name)
+                values["%s.%s" % (key, name)] = value
+        return values
+
+    def aggregate(self, keys, steps=None, seconds=None):
+        """Aggregates high frequency metrics before they're written. Values of keys
+        are accumulated and one row is committed every `steps` logged rows or
+        `seconds`, with key set to the mean and key.min, key.max, key.last and
+        key.count alongside it:
+
+        run.history.aggregate(["loss"], steps=100)
+        """
+        if isinstance(keys, six.string_types):
+            keys = [keys]
+        window = aggregates.Window(steps=steps, seconds=seconds)
+        with self._lock:
+            for key in keys:
+                self._windows[key] = window
 
     def stream(self, name):
         """stream can be used to record different time series:
@@ -82,17 +562,27 @@ class History(object):
         """
         if self.stream_name != "default":
             raise ValueError("Nested streams aren't supported")
+        if name == "default":
+            return self
         if self._streams.get(name) == None:
             self._streams[name] = History(self.fname, out_dir=self.out_dir,
-                                          add_callback=self._add_callback, stream_name=name)
+                                          add_callback=self._add_callback, stream_name=name,
+                                          writer=self._writer_class, retain_rows=self.retain_rows,
+                                          parent=self)
         return self._streams[name]
 
-    def column(self, key):
-        """Iterator over a given column, skipping rows that don't have a key
+    def column(self, key, stream=None):
+        """Sequence of the values for a given key, skipping rows that don't have it.
+        This is a view onto the column store, call .numpy() on it for an array.
+
+        If stream is given only that stream's rows are considered.
         """
-        for row in self.rows:
-            if key in row:
-                yield row[key]
+        if stream is not None:
+            return self.stream(stream).column(key)
+        if not self.retain_rows:
+            return (row[key] for row in self._read_rows() if key in row)
+        self._ensure_index()
+        return self._store.column(key)
 
     def add(self, row={}):
         """Adds keys to history and writes the row.  If row isn't specified, will write
@@ -109,6 +599,51 @@ class History(object):
         if not self.batched:
             self._write()
 
+    def add_batch(self, batch):
+        """Adds one row per element of the arrays (or lists) in batch, with
+        contiguous steps. Scalars are repeated in every row. Rows are written
+        together and the add callback (which updates the summary) is only
+        called for the last one.
+
+        run.history.add_batch({"loss": losses, "epoch": 3})
+        """
+        if not isinstance(batch, collections.Mapping):
+            raise wandb.Error('history.add_batch expects dict-like object')
+        if self.batched:
+            raise wandb.Error("history.add_batch can't be used in history.step()")
+        columns = {}
+        scalars = {}
+        # media and other objects still need transforming row by row
+        transform = False
+        for key, value in six.iteritems(batch):
+            if np is not None and isinstance(value, np.ndarray) and value.ndim == 0:
+                scalars[key] = value.item()
+            elif np is not None and isinstance(value, np.ndarray):
+                # one vectorized conversion to python scalars
+                columns[key] = value.tolist()
+            elif isinstance(value, collections.Sequence) and not isinstance(value, six.string_types):
+                columns[key] = value
+                transform = True
+            else:
+                scalars[key] = value
+        lengths = set(len(column) for column in columns.values())
+        if len(lengths) > 1:
+            raise wandb.Error(
+                'history.add_batch expects arrays of the same length')
+        length = lengths.pop() if lengths else 0
+        keys = list(columns.keys())
+        rows = [dict(scalars, **dict(zip(keys, values)))
+                for values in zip(*[columns[key] for key in keys])]
+        if self._spiller and not transform:
+            # rows that aren't transformed are spilled here instead
+            for row in rows:
+                self._spiller.spill_row(row)
+        # commit anything logged with commit=False first
+        self._write()
+        if not length:
+            return
+        self._log_rows(rows, transform)
+
     @contextlib.contextmanager
     def step(self, compute=True):
         """Context manager to gradually build a history row, then commit it at the end.
@@ -134,57 +669,190 @@ class History(object):
         return self._torch
 
     def _index(self, row):
-        """Internal row adding method that updates step, and keys"""
-        self.row = row
-        self.rows.append(row)
-        self._keys.update(row.keys())
-        self._steps += 1
+        """Internal row adding method that updates keys and stats"""
+        if not self.retain_rows:
+            self._last_values.update(row)
+        elif self._indexed:
+            self._store.append(row)
+        for key, value in six.iteritems(row):
+            if not key.startswith("_") and aggregates.is_number(value):
+                stats = self._stats.get(key)
+                if stats is None:
+                    stats = self._stats[key] = aggregates.RunningStats()
+                stats.add(value)
 
-    def _transform(self):
+    def _transform(self, row):
         """Transforms media classes into the proper format before writing"""
-        for key, val in six.iteritems(self.row):
+        for key, val in six.iteritems(row):
             if isinstance(val, media.Image):
                 val = [val]
             if isinstance(val, collections.Sequence) and len(val) > 0:
                 is_image = [isinstance(v, media.Image) for v in val]
                 if all(is_image):
-                    self.row[key] = media.Image.transform(val, self.out_dir,
-                                                          "{}_{}.jpg".format(key, self.row["_step"]))
+                    fname = "{}_{}.jpg".format(key, row["_step"])
+                    if self._media_pool:
+                        self._media_pool.submit(
+                            media.Image.save_sprite, val, self.out_dir, fname)
+                        row[key] = media.Image.meta(val)
+                    else:
+                        row[key] = media.Image.transform(
+                            val, self.out_dir, fname)
                 elif any(is_image):
                     raise ValueError(
                         "Mixed media types in the same list aren't supported")
             elif isinstance(val, data_types.Histogram):
-                self.row[key] = data_types.Histogram.transform(val)
+                row[key] = data_types.Histogram.transform(val)
+        if self._spiller:
+            self._spiller.spill_row(row)
 
-    def _write(self):
-        if self.row:
-            self._lock.acquire()
-            try:
-                self.row['_runtime'] = time.time() - self._start_time
-                self.row['_timestamp'] = time.time()
-                self.row['_step'] = self._steps
+    def _aggregate(self, row, flush=False):
+        """Moves aggregated keys from row into their windows, returning the rest of
+        the row plus the results of any windows that are complete.
+        """
+        now = time.time()
+        rest = {}
+        added = set()
+        for key, value in six.iteritems(row):
+            window = self._windows.get(key)
+            if window is not None and aggregates.is_number(value):
+                window.add(key, value, now)
+                added.add(window)
+            else:
+                rest[key] = value
+        for window in added:
+            window.rows += 1
+        for window in set(self._windows.values()):
+            if window.ready(now) or (flush and window.stats):
+                rest.update(window.flush())
+        return rest
+
+    def _write(self, flush_windows=False):
+        row = self.row
+        if not row and not (flush_windows and self._windows):
+            return False
+        self.row = {}
+        try:
+            return self._log_rows([row] if row else [], flush_windows=flush_windows)
+        except Exception:
+            # a bad row shouldn't take down the user's script
+            logger.exception("Failed to write history row")
+            return True
+
+    def _acquire(self):
+        """Takes the lock shared by logging threads, recording how long we waited"""
+        if self._lock.acquire(False):
+            self._lock_waits.add(0.0)
+            return
+        start = time.time()
+        self._lock.acquire()
+        self._lock_waits.add(time.time() - start)
+
+    def lock_wait_stats(self):
+        """How long threads logging to this history (and its streams) waited for
+        each other, in seconds.
+        """
+        waits = self._lock_waits
+        return {"count": waits.count,
+                "contended": waits.count - waits.sketch.zeros,
+                "mean": waits.mean, "max": waits.max, "p99": waits.quantile(0.99)}
+
+    def _log_rows(self, rows, transform=True, flush_windows=False):
+        """Assigns steps to rows and commits them. Synchronous writes hold the
+        lock until rows are on disk. Async writes only hold it while steps and
+        a sequence number are assigned, the writer restores the order.
+        """
+        self._acquire()
+        try:
+            if self._windows:
+                rows = [self._aggregate(row) for row in rows]
+                if flush_windows:
+                    rows.append(self._aggregate({}, flush=True))
+                rows = [row for row in rows if row]
+            if not rows:
+                return False
+            runtime = time.time() - self._start_time
+            timestamp = time.time()
+            for i, row in enumerate(rows):
+                row['_runtime'] = runtime
+                row['_timestamp'] = timestamp
+                row['_step'] = self._steps + i
                 if self.stream_name != "default":
-                    self.row["_stream"] = self.stream_name
-                self._transform()
-                self._file.write(util.json_dumps_safer(self.row))
-                self._file.write('\n')
-                self._file.flush()
-                self._index(self.row)
-                if self._add_callback:
-                    self._add_callback(self.row)
-                self.row = {}
-            finally:
-                self._lock.release()
+                    row["_stream"] = self.stream_name
+            self._steps += len(rows)
+            if self._writer is None:
+                if transform:
+                    for row in rows:
+                        self._transform(row)
+                self._commit_rows(rows)
                 return True
-        else:
-            return False
+            seq = self._root._seq
+            self._root._seq += 1
+        finally:
+            self._lock.release()
+        written = []
+        try:
+            if transform:
+                for row in rows:
+                    self._transform(row)
+            written = rows
+        finally:
+            self._writer.put(seq, written)
+        return True
+
+    def _commit_rows(self, rows):
+        """Writes rows, indexes them in the history of their stream and calls the
+        add callback once per stream with the merged rows.
+        """
+        root = self._root
+        with self._index_lock:
+            self._output.write_rows(rows)
+            merged = collections.OrderedDict()
+            for row in rows:
+                name = row_stream(row)
+                history = root if name == "default" else root._streams[name]
+                history._index(row)
+                merged.setdefault(history, {}).update(row)
+        for history, row in six.iteritems(merged):
+            if history._add_callback:
+                history._add_callback(row)
+
+    def _save_stats(self):
+        """Saves the stats of the default stream so end of run reporting and
+        resumed runs don't have to reread the history file.
+        """
+        saved = {"_steps": self._steps,
+                 "stats": {key: stats.state() for key, stats in six.iteritems(self._stats)}}
+        try:
+            with open(stats_fname(self.fname), 'w') as f:
+                f.write(serialize.dumps(saved))
+        except IOError:
+            logger.exception("Failed to save history stats")
+
+    def flush(self):
+        """Waits until all committed rows have been written to disk, including
+        rows logged to streams and their media.
+        """
+        if self._writer:
+            self._writer.flush()
+        if self._media_pool:
+            self._media_pool.wait()
 
     def close(self):
-        self._write()
+        self._write(flush_windows=True)
+        for stream in self._streams.values():
+            stream.close()
+        if self._parent is not None:
+            return
+        if self._writer:
+            self._writer.close()
+        if self._media_pool:
+            self._media_pool.close()
+        self._save_stats()
+        logger.info("History lock waits: %s", self.lock_wait_stats())
         self._lock.acquire()
         try:
-            if self._file:
-                self._file.close()
-                self._file = None
+            if self._output:
+                self._output.close()
+                self._output = None
         finally:
             self._lock.release()
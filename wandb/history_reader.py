@@ -0,0 +1,425 @@
+"""Random access to jsonl history files through a sidecar byte offset index.
+
+The index lives next to the history file, hidden so the file watcher doesn't
+upload it (.wandb-history.jsonl.idx), and holds a little endian int64 pair of
+(step, byte offset) for every row. Rows of named streams have their own step
+counters and are indexed with step -1.
+
+JsonlWriter appends to the index as it writes rows. Opening a writer only
+looks at the end of the files: rows missing from the end of the index are
+added, but a missing or inconsistent index isn't rebuilt, the writer stops
+indexing and leaves it to HistoryReader. The reader never writes the index,
+it extends or rebuilds it in memory. Finding rows only takes a newline scan,
+their steps are picked out of the lines without parsing them.
+
+Files written with delta rows (see delta_rows.py) are read back as dense
+rows, a row is rebuilt from the closest keyframe before it.
+"""
+
+import bisect
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
+from array import array
+
+import six
+
+from wandb import delta_rows
+from wandb.columnar import INT64
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ENTRY = struct.Struct('<qq')
+NO_STEP = -1
+
+# a top level _step could also appear in a nested value, lines where a key
+# appears more than once are parsed
+STEP_KEY = b'"_step":'
+STEP_RE = re.compile(br'\s*(-?\d+)(?![\d.eE])')
+STREAM_RE = re.compile(br'(?<!\\)"_stream":\s*"((?:[^"\\]|\\.)*)"')
+
+
+def index_fname(fname):
+    dirname, basename = os.path.split(fname)
+    return os.path.join(dirname, '.' + basename + '.idx')
+
+
+def row_step(row, default=NO_STEP):
+    """The step a row is indexed under"""
+    if row.get('_stream', 'default') != 'default':
+        return NO_STEP
+    return row.get('_step', default)
+
+
+def _parse(line):
+    try:
+        row = json.loads(line.decode('utf-8'))
+    except ValueError:
+        return None
+    return row if isinstance(row, dict) else None
+
+
+def _line_step(line, default):
+    """The step a complete line is indexed under without parsing it, or None if
+    it isn't a row.
+    """
+    if line[:1] != b'{' or line[-2:] != b'}\n':
+        stripped = line.strip()
+        if not (stripped.startswith(b'{') and stripped.endswith(b'}')):
+            return None
+    stream = b'"_stream"' in line
+    count = line.count(b'"_step"')
+    if stream:
+        streams = STREAM_RE.findall(line)
+        if len(streams) == 1 and streams[0] != b'default' and count <= 1:
+            return NO_STEP
+    if count == 0 and not stream:
+        return default
+    pos = line.find(STEP_KEY)
+    match = None
+    if count == 1 and pos > 0 and line[pos - 1:pos] != b'\\':
+        match = STEP_RE.match(line, pos + len(STEP_KEY))
+    if match is None or (stream and len(streams) != 1):
+        # unusual formatting or keys in nested values
+        row = _parse(line)
+        return None if row is None else row_step(row, default)
+    return int(match.group(1))
+
+
+def _new_entries():
+    return array(INT64) if INT64 else []
+
+
+def _to_array(data):
+    if not INT64:
+        return list(struct.unpack('<%iq' % (len(data) // 8), data))
+    entries = array(INT64)
+    if hasattr(entries, 'frombytes'):
+        entries.frombytes(data)
+    else:
+        entries.fromstring(data)
+    if sys.byteorder == 'big':
+        entries.byteswap()
+    return entries
+
+
+def _scan(f, offset, end, entries, next_step=0):
+    """Appends the entries for the complete lines of f from offset to end.
+    next_step is used for default stream rows without a _step.
+    """
+    f.seek(offset)
+    append = entries.append
+    for line in f:
+        if offset + len(line) > end or not line.endswith(b'\n'):
+            break
+        step = _line_step(line, next_step)
+        if step is not None:
+            if step != NO_STEP:
+                next_step = step + 1
+            append(step)
+            append(offset)
+        offset += len(line)
+
+
+def _last_step(f, end):
+    """The last step in the index file f before byte end, reading back from it"""
+    while end > 0:
+        start = max(0, end - 4096 * ENTRY.size)
+        f.seek(start)
+        data = f.read(end - start)
+        for pos in range(len(data) - ENTRY.size, -1, -ENTRY.size):
+            step = ENTRY.unpack_from(data, pos)[0]
+            if step != NO_STEP:
+                return step
+        end = start
+    return NO_STEP
+
+
+def _tail(f, size, last):
+    """Where the rows after an index ending with the packed ENTRY last start in
+    f, or None if the entry isn't the start of a line with its step.
+    """
+    step, offset = ENTRY.unpack(last)
+    if not 0 <= offset < size:
+        return None
+    if offset > 0:
+        f.seek(offset - 1)
+        if f.read(1) != b'\n':
+            return None
+    f.seek(offset)
+    line = f.readline(size - offset)
+    if not line.endswith(b'\n') or _line_step(line, step) != step:
+        return None
+    return offset + len(line)
+
+
+def build_index(fname):
+    """Scans a history file returning an array of interleaved steps and offsets.
+    Malformed lines and a torn final line aren't indexed.
+    """
+    entries = _new_entries()
+    with open(fname, 'rb') as f:
+        _scan(f, 0, os.fstat(f.fileno()).st_size, entries)
+    return entries
+
+
+def read_index(fname):
+    with open(index_fname(fname), 'rb') as f:
+        data = f.read()
+    return _to_array(data[:len(data) - len(data) % ENTRY.size])
+
+
+def load_index(fname, size):
+    """The index of the first size bytes of fname, the index on disk extended
+    with the rows it's missing or rebuilt if it doesn't match the file.
+    """
+    try:
+        entries = read_index(fname)
+    except (IOError, OSError):
+        entries = None
+    with open(fname, 'rb') as f:
+        if entries:
+            tail = _tail(f, size, ENTRY.pack(entries[-2], entries[-1]))
+            if tail is not None:
+                last_step = next((step for step in entries[-2::-2] if step != NO_STEP), NO_STEP)
+                _scan(f, tail, size, entries, last_step + 1)
+                return entries
+        entries = _new_entries()
+        _scan(f, 0, size, entries)
+    return entries
+
+
+class IndexWriter(object):
+    """Appends (step, offset) entries for rows JsonlWriter has written. Opening
+    it only reads the end of the files, if the index doesn't match the history
+    file nothing more is indexed and readers index it themselves.
+    """
+
+    def __init__(self, fname):
+        self._file = None
+        size = os.path.getsize(fname)
+        path = index_fname(fname)
+        if size == 0:
+            self._file = open(path, 'wb')
+        elif os.path.exists(path):
+            self._file = self._append(fname, size, path)
+            if self._file is None:
+                os.remove(path)
+
+    @staticmethod
+    def _append(fname, size, path):
+        """Opens the index for appending after adding the rows it's missing, or
+        returns None if it's inconsistent.
+        """
+        index = open(path, 'r+b')
+        index.seek(0, os.SEEK_END)
+        index_size = index.tell()
+        index_size -= index_size % ENTRY.size
+        index.truncate(index_size)
+        if index_size == 0:
+            index.close()
+            return None
+        index.seek(index_size - ENTRY.size)
+        last = index.read(ENTRY.size)
+        with open(fname, 'rb') as f:
+            tail = _tail(f, size, last)
+            if tail is None:
+                index.close()
+                return None
+            entries = _new_entries()
+            _scan(f, tail, size, entries, _last_step(index, index_size) + 1)
+        index.seek(index_size)
+        for i in range(0, len(entries), 2):
+            index.write(ENTRY.pack(entries[i], entries[i + 1]))
+        index.flush()
+        return index
+
+    def write(self, entries):
+        """Appends the packed ENTRYs in entries"""
+        if self._file is not None:
+            self._file.write(entries)
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _parse_range(args):
+    """Parses the default stream rows between two offsets, run in pool workers"""
+    fname, start, end = args
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).split(b'\n')
+    rows = []
+    for line in lines:
+        row = _parse(line) if line else None
+        if row is not None and row.get('_stream', 'default') == 'default':
+            rows.append(row)
+    return rows
+
+
+class HistoryReader(object):
+    """Read only random access to the default stream of a jsonl history file.
+
+    The file is memory mapped and rows are only parsed when they're accessed.
+    It's a snapshot, rows appended after the reader was created aren't seen.
+
+    reader = HistoryReader("wandb/run-20180101_000000-abc/wandb-history.jsonl")
+    reader[10]                  # the 11th row
+    reader.steps(100, 200)      # rows with 100 <= _step < 200
+    reader.column("loss")       # numpy array of every logged loss
+    reader.scan(processes=4)    # all rows, parsed in parallel
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._sparse = False
+        self._file = open(fname, 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+        entries = load_index(fname, self._size)
+        self._all_offsets = entries[1::2]
+        self._steps = _new_entries()
+        self._offsets = _new_entries()
+        for step, offset in six.moves.zip(entries[0::2], self._all_offsets):
+            if step != NO_STEP:
+                self._steps.append(step)
+                self._offsets.append(offset)
+        self._map = None
+        if self._size:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            self._sparse = self._map.find(b'"_delta"') != -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _line(self, offset):
+        return self._map[offset:self._map.find(b'\n', offset)]
+
+    def _row(self, offset):
+        return _parse(self._line(offset))
+
+    def _dense_rows(self, lo, hi):
+        """Dense rows at positions lo to hi, decoding from the keyframe before lo"""
+        if not self._sparse:
+            for offset in self._offsets[lo:hi]:
+                yield self._row(offset)
+            return
+        start = lo
+        while 0 < start < len(self._offsets):
+            row = self._row(self._offsets[start])
+            if row is None or not delta_rows.is_delta(row):
+                break
+            start -= 1
+        decoder = delta_rows.DeltaDecoder()
+        for i in range(start, hi):
+            row = self._row(self._offsets[i])
+            if row is None:
+                continue
+            row = decoder.decode(row)
+            if i >= lo:
+                yield row
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            lo, hi, stride = index.indices(len(self._offsets))
+            if stride != 1:
+                return [self[i] for i in range(lo, hi, stride)]
+            return list(self._dense_rows(lo, hi))
+        if index < 0:
+            index += len(self._offsets)
+        if not 0 <= index < len(self._offsets):
+            raise IndexError(index)
+        return next(self._dense_rows(index, index + 1))
+
+    def __iter__(self):
+        return self._dense_rows(0, len(self._offsets))
+
+    def _range(self, start, stop):
+        """Positions of the rows with start <= _step < stop, steps only increase"""
+        lo = 0 if start is None else bisect.bisect_left(self._steps, start)
+        hi = len(self._steps) if stop is None else bisect.bisect_left(
+            self._steps, stop)
+        return lo, hi
+
+    def steps(self, start=None, stop=None):
+        """Rows with start <= _step < stop"""
+        lo, hi = self._range(start, stop)
+        return self[lo:hi]
+
+    def row(self, step):
+        """The row logged at step"""
+        i = bisect.bisect_left(self._steps, step)
+        if i == len(self._steps) or self._steps[i] != step:
+            raise KeyError(step)
+        return self[i]
+
+    def column(self, key, start=None, stop=None):
+        """Values of key as a numpy array, skipping rows without it. Lines that
+        don't mention the key aren't parsed, unless the file has delta rows.
+        """
+        if np is None:
+            raise ValueError(
+                "HistoryReader.column requires numpy: pip install numpy")
+        # orjson writes keys as utf-8, the json module escapes them
+        needles = set([json.dumps(key).encode('utf-8'),
+                       json.dumps(key, ensure_ascii=False).encode('utf-8')])
+        lo, hi = self._range(start, stop)
+        values = []
+        if self._sparse:
+            for row in self._dense_rows(lo, hi):
+                if key in row:
+                    values.append(row[key])
+            return np.array(values)
+        for offset in self._offsets[lo:hi]:
+            line = self._line(offset)
+            if not any(needle in line for needle in needles):
+                continue
+            row = _parse(line)
+            if row is not None and key in row:
+                values.append(row[key])
+        return np.array(values)
+
+    def scan(self, processes=None, chunk_rows=10000):
+        """Parses every row. Files with more than chunk_rows rows are split into
+        chunks that are parsed in parallel by a pool of processes.
+        """
+        offsets = self._all_offsets
+        processes = processes or multiprocessing.cpu_count()
+        if processes == 1 or len(offsets) <= chunk_rows:
+            return list(self)
+        chunks = []
+        for i in range(0, len(offsets), chunk_rows):
+            end = offsets[i + chunk_rows] if i + \
+                chunk_rows < len(offsets) else self._size
+            chunks.append((self.fname, offsets[i], end))
+        pool = multiprocessing.Pool(processes)
+        try:
+            parsed = pool.map(_parse_range, chunks)
+        finally:
+            pool.close()
+            pool.join()
+        rows = [row for rows in parsed for row in rows]
+        if self._sparse:
+            rows = list(delta_rows.DeltaDecoder().decode_all(rows))
+        return rows
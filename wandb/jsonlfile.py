@@ -6,31 +6,27 @@ import six
 from threading import Lock
 
 import wandb
-from wandb import util
+from wandb import serialize
+from wandb import segments
 from wandb import media
 
 
 class JsonlEventsFile(object):
     """Used to store events during a run. """
 
-    def __init__(self, fname, out_dir='.'):
+    def __init__(self, fname, out_dir='.', segment_policy=None):
         self._start_time = wandb.START_TIME
         self.fname = os.path.join(out_dir, fname)
         self.buffer = []
         self.lock = Lock()
-        self._file = open(self.fname, 'a')
+        self._file = open_for_append(self.fname)
+        self._rotator = segments.Rotator(
+            self.fname, segment_policy) if segment_policy else None
         self.load()
 
     def load(self):
         try:
-            last_row = {}
-            with open(self.fname) as f:
-                for line in f:
-                    try:
-                        last_row = json.loads(line)
-                    except TypeError:
-                        print('warning: malformed history line: %s...' %
-                              line[:40])
+            last_row = read_last_row(self.fname) or {}
             # fudge the start_time to compensate for previous run length
             if '_runtime' in last_row:
                 self._start_time = wandb.START_TIME - last_row['_runtime']
@@ -58,9 +54,13 @@ class JsonlEventsFile(object):
                 row["_wandb"] = _wandb
             row["_timestamp"] = int(timestamp or time.time())
             row['_runtime'] = int(time.time() - self._start_time)
-            self._file.write(util.json_dumps_safer(row))
+            self._file.write(serialize.dumps(row))
             self._file.write('\n')
             self._file.flush()
+            if self._rotator and self._rotator.due(os.fstat(self._file.fileno()).st_size):
+                self._file.close()
+                self._rotator.seal()
+                self._file = open_for_append(self.fname)
         finally:
             self.lock.release()
 
@@ -74,6 +74,178 @@ class JsonlEventsFile(object):
             self.lock.release()
 
 
+class JsonlFile(object):
+    """Appends rows to a jsonl file, eg. run.examples.
+
+    Rows are buffered and written with a single write once flush_rows of them
+    are waiting, and on flush() and close(). With columnar=True batches added
+    with add_columns() are stored as one line each:
+
+        {"_columns": {"label": ["cat", "dog"], "score": [0.9, 0.4]}, "_count": 2}
+
+    where a None marks a row without the key. read_rows() yields rows for
+    either layout.
+    """
+
+    def __init__(self, fname, out_dir='.', columnar=False, flush_rows=1000):
+        self.fname = os.path.join(out_dir, fname)
+        self.columnar = columnar
+        self.flush_rows = flush_rows
+        self._lock = Lock()
+        self._lines = []
+        self._buffered = 0
+        self._file = open_for_append(self.fname)
+
+    def add(self, row):
+        self.add_rows([row])
+
+    def add_rows(self, rows):
+        lines = [serialize.dumps(row) for row in rows]
+        self._append(lines, len(lines))
+
+    def add_columns(self, columns, count):
+        """Adds count rows given as a dict of equally long lists of values"""
+        if not self.columnar:
+            return self.add_rows(column_rows(columns, count))
+        self._append([serialize.dumps({"_columns": columns, "_count": count})], count)
+
+    def _append(self, lines, count):
+        with self._lock:
+            self._lines.extend(lines)
+            self._buffered += count
+            if self._buffered >= self.flush_rows:
+                self._flush()
+
+    def _flush(self):
+        if self._lines and self._file:
+            self._file.write('\n'.join(self._lines))
+            self._file.write('\n')
+            self._file.flush()
+        self._lines = []
+        self._buffered = 0
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def read_rows(fname):
+        with open(fname) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                if "_columns" in row:
+                    for row in column_rows(row["_columns"], row["_count"]):
+                        yield row
+                else:
+                    yield row
+
+
+def column_rows(columns, count):
+    """Turns a dict of columns back into rows, skipping None values"""
+    rows = [{} for _ in range(count)]
+    for key, values in six.iteritems(columns):
+        for row, value in zip(rows, values):
+            if value is not None:
+                row[key] = value
+    return rows
+
+
+def reverse_lines(f, block_size=64 * 1024):
+    """Yields the lines of a binary file from last to first, reading backwards
+    from EOF in blocks so we never load the whole file.
+    """
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    remainder = b''
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        lines = (f.read(read_size) + remainder).split(b'\n')
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            yield line
+    yield remainder
+
+
+def _rows(lines, predicate, contains):
+    """The rows of lines that we accept"""
+    for line in lines:
+        if not line.strip() or (contains is not None and contains not in line):
+            continue
+        try:
+            row = json.loads(line.decode('utf-8'))
+        except ValueError:
+            continue
+        if isinstance(row, dict) and (predicate is None or predicate(row)):
+            yield row
+
+
+def reverse_rows(fname, predicate=None, contains=None):
+    """Yields the complete rows of a jsonl file from last to first, continuing
+    with its sealed segments (newest first) if it's been segmented.
+
+    A torn final line (eg. we crashed mid write) is skipped. If predicate is
+    given only rows it accepts are returned, lines that don't contain the
+    bytes in contains are skipped without being parsed.
+    """
+    sealed = segments.sealed_segments(fname)
+    try:
+        with open(fname, 'rb') as f:
+            for row in _rows(reverse_lines(f), predicate, contains):
+                yield row
+    except IOError:
+        if not sealed:
+            raise
+    for path in reversed(sealed):
+        with segments.open_segment(path) as f:
+            if path.endswith('.gz'):
+                lines = reversed(f.read().split(b'\n'))
+            else:
+                lines = reverse_lines(f)
+            for row in _rows(lines, predicate, contains):
+                yield row
+
+
+def read_last_row(fname, predicate=None, contains=None):
+    """Returns the last complete row of a jsonl file (see reverse_rows), or None
+    if it has none.
+    """
+    for row in reverse_rows(fname, predicate, contains):
+        return row
+    return None
+
+
+def open_for_append(fname, mode='a'):
+    """Opens a jsonl file for appending, terminating a torn final line so new rows
+    start on a line of their own. Pass mode='ab' to write bytes.
+    """
+    torn = False
+    try:
+        with open(fname, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+    except IOError:
+        pass
+    out = open(fname, mode)
+    if torn:
+        out.write(b'\n' if 'b' in mode else '\n')
+        out.flush()
+    return out
+
+
 def write_jsonl_file(fname, data):
     """Writes a jsonl file.
 
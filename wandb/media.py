@@ -1,7 +1,11 @@
 import os
 import logging
+import threading
+from six.moves import queue
 from wandb import util
 
+logger = logging.getLogger(__name__)
+
 
 class Media(object):
     @classmethod
@@ -67,6 +71,27 @@ class Image(object):
         """
         Combines a list of images into a single sprite returning meta information
         """
+        Image.save_sprite(images, out_dir, fname)
+        return Image.meta(images)
+
+    @staticmethod
+    def meta(images):
+        """
+        The meta information transform returns, without building the sprite
+        """
+        width, height = images[0].image.size
+        meta = {"width": width, "height": height,
+                "count": len(images), "_type": "images"}
+        captions = Image.captions(images[:MAX_IMAGES])
+        if captions:
+            meta["captions"] = captions
+        return meta
+
+    @staticmethod
+    def save_sprite(images, out_dir, fname):
+        """
+        Pastes images side by side and saves them as media/images/fname
+        """
         from PIL import Image as PILImage
         base = os.path.join(out_dir, "media", "images")
         width, height = images[0].image.size
@@ -82,12 +107,6 @@ class Image(object):
             sprite.paste(image.image, (location, 0))
         util.mkdir_exists_ok(base)
         sprite.save(os.path.join(base, fname), transparency=0)
-        meta = {"width": width, "height": height,
-                "count": len(images), "_type": "images"}
-        captions = Image.captions(images[:MAX_IMAGES])
-        if captions:
-            meta["captions"] = captions
-        return meta
 
     @staticmethod
     def captions(images):
@@ -95,3 +114,49 @@ class Image(object):
             return [i.caption for i in images]
         else:
             return False
+
+
+class MediaPool(object):
+    """Runs media encoding jobs (eg. Image.save_sprite) on background threads.
+
+    At most max_pending jobs are queued, submit() blocks when the queue is
+    full so a fast training loop can't buffer an unbounded number of images.
+    PIL releases the GIL while encoding so threads are enough.
+    """
+
+    def __init__(self, workers=2, max_pending=16):
+        self._queue = queue.Queue(max_pending)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._thread_body)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, *args):
+        self._queue.put((fn, args))
+
+    def wait(self):
+        """Blocks until every submitted job has finished"""
+        self._queue.join()
+
+    def close(self):
+        self.wait()
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _thread_body(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                fn, args = job
+                fn(*args)
+            except Exception:
+                logger.exception("Failed to write media")
+            finally:
+                self._queue.task_done()
@@ -6,7 +6,7 @@ import socket
 import getpass
 from datetime import datetime
 
-from wandb import util
+from wandb import serialize
 import wandb
 
 METADATA_FNAME = 'wandb-metadata.json'
@@ -60,7 +60,7 @@ class Meta(object):
         try:
             self.data["heartbeatAt"] = datetime.utcnow().isoformat()
             with open(self.fname, 'w') as f:
-                s = util.json_dumps_safer(self.data, indent=4)
+                s = serialize.dumps(self.data, indent=4)
                 f.write(s)
                 f.write('\n')
         finally:
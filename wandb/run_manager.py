@@ -1,4 +1,5 @@
 import errno
+import hashlib
 import json
 import logging
 import os
@@ -27,13 +28,18 @@ import webbrowser
 
 import wandb
 import wandb.api
-from .api import BinaryFilePolicy, CRDedupeFilePolicy, DefaultFilePolicy, OverwriteFilePolicy
+from .api import BinaryFilePolicy, CRDedupeFilePolicy, DefaultFilePolicy, SummaryFilePolicy
+from wandb import binary_history
 from wandb import env
 from wandb import Error
 from wandb import io_wrap
 from wandb import jsonlfile
+from wandb import downsample
 from wandb import file_pusher
+from wandb import history
 from wandb import meta
+from wandb import segments
+from wandb import serialize
 from wandb.core import START_TIME
 import wandb.rwlock
 from wandb import sparkline
@@ -56,11 +62,17 @@ class LaunchError(Error):
 
 
 class FileTailer(object):
+    """Calls on_read_fn with data appended to a file. If the file is sealed into
+    a segment (see segments.py) we finish reading it and continue with the new
+    file at path.
+    """
+
     def __init__(self, path, on_read_fn, binary=False, seek_end=False):
         self._path = path
         mode = 'r'
         if binary:
             mode = 'rb'
+        self._mode = mode
         self._file = open(path, mode)
         if seek_end:
             self._file.seek(0, 2)  # seek to 0 bytes from end (2 means end)
@@ -73,12 +85,26 @@ class FileTailer(object):
         while self.running:
             where = self._file.tell()
             data = self._file.read(1024)
-            if not data:
+            if data:
+                self._on_read_fn(data)
+            elif self._rotated():
+                # nothing is written to a sealed file, so one more read drains it
+                self._file.seek(where)
+                data = self._file.read()
+                if data:
+                    self._on_read_fn(data)
+                self._file.close()
+                self._file = open(self._path, self._mode)
+            else:
                 time.sleep(1)
                 # required for to get python2 working (Issue #50)
                 self._file.seek(where)
-            else:
-                self._on_read_fn(data)
+
+    def _rotated(self):
+        try:
+            return os.stat(self._path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except OSError:
+            return False
 
     def stop(self):
         self._file.seek(0)
@@ -190,24 +216,122 @@ class FileEventHandlerConfig(FileEventHandler):
 
 
 class FileEventHandlerSummary(FileEventHandler):
-    """Read the file and add to the file push api"""
+    """Pushes summary changes to the file stream api.
+
+    The last summary sent is kept so unchanged files aren't pushed. If the
+    backend accepts patches only the changed keys are sent, with a full
+    snapshot at most every summary_snapshot_seconds to resync. Otherwise full
+    snapshots are sent, at most once per interval.
+    """
 
     def __init__(self, file_path, save_name, api, file_pusher, run, *args, **kwargs):
         super(FileEventHandlerSummary, self).__init__(
             file_path, save_name, api, *args, **kwargs)
         self._api = api
         self._file_pusher = file_pusher
+        self._lock = threading.Lock()
+        self._thread = None
+        self._digest = None
+        self._last_sent = None
+        self._pending = None
+        self._last_snapshot = 0
+
+    @property
+    def _snapshot_seconds(self):
+        return self._api.dynamic_settings.get('summary_snapshot_seconds', 10)
 
     def on_created(self):
         self.on_modified()
 
     def on_modified(self):
-        self._api.get_file_stream_api().push(self.save_name, open(self.file_path).read())
+        with self._lock:
+            self._update()
+
+    def _read(self):
+        """The summary on disk, or None if the file hasn't changed. Changes are
+        detected by content, a rewrite can keep both the size and the mtime.
+        """
+        try:
+            with open(self.file_path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        digest = hashlib.md5(data).digest()
+        if digest == self._digest:
+            return None
+        try:
+            summary = json.loads(data.decode('utf-8'))
+        except ValueError:
+            return None
+        self._digest = digest
+        return summary
+
+    def _update(self, force=False):
+        summary = self._read()
+        if summary is None:
+            summary = self._pending
+        if summary is None:
+            return
+        # a pending snapshot is stale if the file changed back since
+        self._pending = None
+        if summary == self._last_sent:
+            return
+        fs_api = self._api.get_file_stream_api()
+        since_snapshot = time.time() - self._last_snapshot
+        if since_snapshot >= self._snapshot_seconds or force:
+            fs_api.push(self.save_name, {'set': summary, 'full': True})
+            self._last_snapshot = time.time()
+        elif self._last_sent is not None and self._api.dynamic_settings.get('summary_patches'):
+            fs_api.push(self.save_name, self._diff(summary))
+        else:
+            # rate limited, send the latest snapshot once the interval is up
+            self._pending = summary
+            if self._thread is None:
+                self._thread = threading.Timer(
+                    self._snapshot_seconds - since_snapshot, self._thread_update)
+                self._thread.daemon = True
+                self._thread.start()
+            return
+        self._last_sent = summary
+
+    def _diff(self, summary):
+        changed = dict((k, v) for k, v in six.iteritems(summary)
+                       if k not in self._last_sent or self._last_sent[k] != v)
+        removed = [k for k in self._last_sent if k not in summary]
+        return {'set': changed, 'del': removed}
+
+    def _thread_update(self):
+        with self._lock:
+            self._thread = None
+            self._update()
 
     def finish(self):
+        with self._lock:
+            if self._thread is not None:
+                self._thread.cancel()
+                self._thread = None
+            self._digest = None
+            self._update(force=True)
         self._file_pusher.file_changed(self.save_name, self.file_path)
 
 
+class FileEventHandlerSealedSegment(FileEventHandler):
+    """Uploads a sealed segment of a history, events or output file. Segments
+    never change once they appear, so they're only uploaded once.
+    """
+
+    def __init__(self, file_path, save_name, api, file_pusher, *args, **kwargs):
+        super(FileEventHandlerSealedSegment, self).__init__(
+            file_path, save_name, api, *args, **kwargs)
+        self._file_pusher = file_pusher
+        self._pushed = False
+
+    def on_created(self):
+        if not self._pushed:
+            self._pushed = True
+            self._file_pusher.file_changed(self.save_name, self.file_path)
+
+
 class FileEventHandlerTextStream(FileEventHandler):
     def __init__(self, *args, **kwargs):
         self._seek_end = kwargs.pop('seek_end', None)
@@ -216,8 +340,10 @@ class FileEventHandlerTextStream(FileEventHandler):
 
     def on_created(self):
         if self._tailer:
-            logger.error(
-                'Streaming file created twice in same run: %s', self.file_path)
+            # a new active file after sealing a segment, the tailer follows it
+            if not segments.sealed_segments(self.file_path):
+                logger.error(
+                    'Streaming file created twice in same run: %s', self.file_path)
             return
         self._setup()
 
@@ -242,6 +368,24 @@ class FileEventHandlerTextStream(FileEventHandler):
             self._tailer = None
 
 
+class FileEventHandlerBinaryHistory(FileEventHandlerTextStream):
+    """Streams a binary history file to the backend as jsonl rows, the binary
+    file itself is never uploaded.
+    """
+
+    def _setup(self):
+        fsapi = self._api.get_file_stream_api()
+        pusher = streaming_log.TextStreamPusher(fsapi, wandb_run.HISTORY_FNAME)
+        decoder = binary_history.StreamDecoder()
+
+        def on_read(data):
+            for row in decoder.feed(data):
+                pusher.write_string(serialize.dumps(row) + '\n')
+
+        self._tailer = FileTailer(
+            self.file_path, on_read, binary=True, seek_end=self._seek_end)
+
+
 class FileEventHandlerBinaryStream(FileEventHandler):
     def __init__(self, *args, **kwargs):
         super(FileEventHandlerBinaryStream, self).__init__(*args, **kwargs)
@@ -269,18 +413,24 @@ class FileEventHandlerBinaryStream(FileEventHandler):
 
 
 class WriteSerializingFile(object):
-    """Wrapper for a file object that serializes writes.
+    """Wrapper for a file object that serializes writes. Given a segments.Rotator
+    the file is sealed into segments as it grows.
     """
 
-    def __init__(self, f):
+    def __init__(self, f, rotator=None):
         self.lock = threading.Lock()
         self.f = f
+        self._rotator = rotator
 
     def write(self, *args, **kargs):
         self.lock.acquire()
         try:
             self.f.write(*args, **kargs)
             self.f.flush()
+            if self._rotator and self._rotator.due(self.f.tell()):
+                self.f.close()
+                self._rotator.seal()
+                self.f = open(self._rotator.fname, self.f.mode)
         finally:
             self.lock.release()
 
@@ -363,10 +513,13 @@ class RunManager(object):
         self._file_event_lock.writer_enters()
 
         self._event_handlers = {}
+        self._md5s = {}
 
         self._handler = PatternMatchingEventHandler()
         self._handler.on_created = self._on_file_created
         self._handler.on_modified = self._on_file_modified
+        # sealed segments appear with a rename
+        self._handler.on_moved = self._on_file_moved
         self._handler._patterns = [
             os.path.join(self._watch_dir, os.path.normpath('*'))]
         # Ignore hidden files/folders and output.log because we stream it specially
@@ -416,6 +569,14 @@ class RunManager(object):
         self._file_event_lock.await_readable()
         self._get_handler(event.src_path, save_name).on_created()
 
+    def _on_file_moved(self, event):
+        logger.info('file/dir moved: %s -> %s', event.src_path, event.dest_path)
+        if os.path.isdir(event.dest_path):
+            return None
+        save_name = os.path.relpath(event.dest_path, self._watch_dir)
+        self._file_event_lock.await_readable()
+        self._get_handler(event.dest_path, save_name).on_created()
+
     def _on_file_modified(self, event):
         logger.info('file/dir modified: %s', event.src_path)
         if os.path.isdir(event.src_path):
@@ -426,11 +587,21 @@ class RunManager(object):
 
     def _get_handler(self, file_path, save_name):
         if not os.path.split(save_name)[0] == "media" and save_name not in [
-                'wandb-history.jsonl', 'wandb-events.jsonl', 'wandb-summary.json']:
+                'wandb-history.jsonl', 'wandb-history.bin', 'wandb-events.jsonl',
+                'wandb-summary.json']:
             # Don't show stats on media files
             self._stats.update_file(file_path)
         if save_name not in self._event_handlers:
-            if save_name == 'wandb-history.jsonl':
+            if save_name == 'wandb-history.bin':
+                self._event_handlers['wandb-history.bin'] = FileEventHandlerBinaryHistory(
+                    file_path, 'wandb-history.bin', self._api)
+            elif save_name == 'wandb-history.jsonl' and os.path.exists(
+                    os.path.join(self._watch_dir, 'wandb-history.bin')):
+                # converted from the binary history at the end of the run, its
+                # rows have already been streamed
+                self._event_handlers['wandb-history.jsonl'] = FileEventHandler(
+                    file_path, 'wandb-history.jsonl', self._api)
+            elif save_name == 'wandb-history.jsonl':
                 self._event_handlers['wandb-history.jsonl'] = FileEventHandlerTextStream(
                     file_path, 'wandb-history.jsonl', self._api)
             elif save_name == 'wandb-events.jsonl':
@@ -455,9 +626,12 @@ class RunManager(object):
             elif save_name == 'wandb-summary.json':
                 # Load the summary into the syncer process for meta etc to work
                 self._run.summary.load()
-                self._api.get_file_stream_api().set_file_policy(save_name, OverwriteFilePolicy())
+                self._api.get_file_stream_api().set_file_policy(save_name, SummaryFilePolicy())
                 self._event_handlers[save_name] = FileEventHandlerSummary(
                     file_path, save_name, self._api, self._file_pusher, self._run)
+            elif segments.parse_segment(save_name):
+                self._event_handlers[save_name] = FileEventHandlerSealedSegment(
+                    file_path, save_name, self._api, self._file_pusher)
             elif save_name.startswith('media/'):
                 # Save media files immediately
                 self._event_handlers[save_name] = FileEventHandlerOverwrite(
@@ -472,6 +646,33 @@ class RunManager(object):
         for handler in list(self._event_handlers.values()):
             handler.finish()
 
+    def _md5(self, path):
+        """md5 of a local file, cached until its size or mtime changes so sealed
+        segments are only hashed once.
+        """
+        file_stat = os.stat(path)
+        key = (file_stat.st_size, file_stat.st_mtime)
+        cached = self._md5s.get(path)
+        if cached is None or cached[0] != key:
+            cached = self._md5s[path] = (key, util.md5_file(path))
+        return cached[1]
+
+    def _mismatched_segments(self, download_urls):
+        """(local path, local md5, remote md5) of the sealed segments whose upload
+        doesn't match. Segments never change, so each is only hashed once.
+        """
+        mismatched = []
+        for fname, info in download_urls.items():
+            if not segments.parse_segment(fname):
+                continue
+            local_path = os.path.join(self._watch_dir, fname)
+            if not os.path.exists(local_path):
+                continue
+            local_md5 = self._md5(local_path)
+            if local_md5 != info['md5']:
+                mismatched.append((local_path, local_md5, info['md5']))
+        return mismatched
+
     def _push_function(self, save_name, path):
         with open(path, 'rb') as f:
             self._api.push(self._project, {save_name: f}, run=self._run.id,
@@ -504,7 +705,10 @@ class RunManager(object):
                 stderr = sys.stderr.buffer
 
         output_log_path = os.path.join(self._run.dir, OUTPUT_FNAME)
-        self._output_log = WriteSerializingFile(open(output_log_path, 'wb'))
+        policy = segments.SegmentPolicy.from_env()
+        self._output_log = WriteSerializingFile(
+            open(output_log_path, 'wb'),
+            segments.Rotator(output_log_path, policy) if policy else None)
 
         stdout_streams = [stdout, self._output_log]
         stderr_streams = [stderr, self._output_log]
@@ -578,8 +782,14 @@ class RunManager(object):
         self._api.get_file_stream_api().set_file_policy(
             wandb_run.HISTORY_FNAME, DefaultFilePolicy(
                 start_chunk_id=resume_status['historyLineCount']))
-        self._event_handlers[wandb_run.HISTORY_FNAME] = FileEventHandlerTextStream(
-            self._run.history.fname, wandb_run.HISTORY_FNAME, self._api, seek_end=True)
+        if self._run._binary_history:
+            self._event_handlers[wandb_run.BINARY_HISTORY_FNAME] = FileEventHandlerBinaryHistory(
+                self._run.history.fname, wandb_run.BINARY_HISTORY_FNAME, self._api, seek_end=True)
+            self._event_handlers[wandb_run.HISTORY_FNAME] = FileEventHandler(
+                self._run.history.fname, wandb_run.HISTORY_FNAME, self._api)
+        else:
+            self._event_handlers[wandb_run.HISTORY_FNAME] = FileEventHandlerTextStream(
+                self._run.history.fname, wandb_run.HISTORY_FNAME, self._api, seek_end=True)
 
         # events
         self._api.get_file_stream_api().set_file_policy(
@@ -617,6 +827,9 @@ class RunManager(object):
         """Stops system stats, streaming handlers, and uploads files without output, used by wandb.monitor"""
         self._system_stats.shutdown()
         self._meta.shutdown()
+        # make sure buffered history rows are on disk before we stop tailing the file
+        if self._run._history is not None:
+            self._run._history.flush()
         self._finish_handlers()
         self._file_pusher.shutdown()
         self._api.get_file_stream_api().finish(exitcode)
@@ -706,6 +919,7 @@ class RunManager(object):
             )
         except (OSError, IOError):
             raise Exception('Could not find program: %s' % command)
+        self._system_stats.pid = self.proc.pid
 
         self._sync_etc()
 
@@ -722,6 +936,7 @@ class RunManager(object):
         self._stderr_tee = io_wrap.Tee(stderr_read_file, *stderr_streams)
 
         self.proc = Process(pid)
+        self._system_stats.pid = pid
 
         try:
             self.init_run()
@@ -853,16 +1068,34 @@ class RunManager(object):
                 elif isinstance(v, numbers.Number):
                     wandb.termlog(format_str.format(k, v))
 
-        self._run.history.load()
-        history_keys = self._run.history.keys()
+        # the user process saves per key stats when it closes history, if they're
+        # there we don't need to index the whole file to find the keys
+        history_stats = history.load_stats(self._run.history.fname)
+        if history_stats is not None:
+            history_keys = sorted(k for k in history_stats if not k.startswith("_"))
+        else:
+            self._run.history.load()
+            history_keys = self._run.history.keys()
         if len(history_keys):
             wandb.termlog('Run history:')
             max_len = max([len(k) for k in history_keys])
+            # downsample every key in one pass over the rows, skipping keys with
+            # values we can't draw
+            samplers = dict((key, downsample.Downsampler(40))
+                            for key in history_keys)
+            for row in self._run.history.iter_rows():
+                for key, value in six.iteritems(row):
+                    sampler = samplers.get(key)
+                    if sampler is None:
+                        continue
+                    if isinstance(value, numbers.Number):
+                        sampler.add(value)
+                    else:
+                        samplers[key] = None
             for key in history_keys:
-                vals = util.downsample(self._run.history.column(key), 40)
-                if any((not isinstance(v, numbers.Number) for v in vals)):
+                if not samplers[key] or not samplers[key].count:
                     continue
-                line = sparkline.sparkify(vals)
+                line = sparkline.sparkify(samplers[key].values())
                 format_str = u'  {:>%s} {}' % max_len
                 wandb.termlog(format_str.format(key, line))
 
@@ -925,16 +1158,8 @@ class RunManager(object):
         error = False
         mismatched = None
         for delay_base in range(4):
-            mismatched = []
-            download_urls = self._api.download_urls(
-                self._project, run=self._run.id)
-            for fname, info in download_urls.items():
-                if fname == 'wandb-history.h5' or OUTPUT_FNAME:
-                    continue
-                local_path = os.path.join(self._watch_dir, fname)
-                local_md5 = util.md5_file(local_path)
-                if local_md5 != info['md5']:
-                    mismatched.append((local_path, local_md5, info['md5']))
+            mismatched = self._mismatched_segments(self._api.download_urls(
+                self._project, run=self._run.id))
             if not mismatched:
                 break
             wandb.termlog('  Retrying after %ss' % (delay_base**2))
@@ -0,0 +1,119 @@
+"""Rotation of ever growing run files (history, events, output.log) into segments.
+
+Writers always append to the active file under its usual name, eg.
+wandb-history.jsonl. Once it grows past max_bytes or has been open for
+max_seconds it's sealed: renamed to wandb-history.00042.jsonl (optionally
+gzipped to wandb-history.00042.jsonl.gz) and a new active file is started.
+Sealed segments never change again, so they're uploaded once and readers
+chain them in front of the active file.
+"""
+
+import gzip
+import os
+import re
+import shutil
+import time
+
+from wandb import env
+
+SEGMENT_RE = re.compile(r'^(?P<base>.+)\.(?P<index>\d{5})(?P<ext>\.[^.]+)(?P<gz>\.gz)?$')
+
+
+def segment_fname(fname, index, compress=False):
+    """wandb-history.jsonl -> wandb-history.00042.jsonl"""
+    base, ext = os.path.splitext(fname)
+    return '%s.%05i%s%s' % (base, index, ext, '.gz' if compress else '')
+
+
+def parse_segment(fname):
+    """Returns (active fname, index) for a segment name, otherwise None"""
+    dirname, basename = os.path.split(fname)
+    match = SEGMENT_RE.match(basename)
+    if match is None:
+        return None
+    return (os.path.join(dirname, match.group('base') + match.group('ext')),
+            int(match.group('index')))
+
+
+def sealed_segments(fname):
+    """Paths of the sealed segments of fname, oldest first"""
+    dirname = os.path.dirname(fname) or '.'
+    try:
+        names = os.listdir(dirname)
+    except OSError:
+        return []
+    segments = []
+    for name in names:
+        path = os.path.join(os.path.dirname(fname), name)
+        parsed = parse_segment(path)
+        if parsed is not None and parsed[0] == fname:
+            segments.append((parsed[1], path))
+    return [path for _, path in sorted(segments)]
+
+
+def open_segment(path):
+    """Opens a sealed segment for reading bytes"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+class SegmentPolicy(object):
+    """When to seal active files, max_bytes and max_seconds of 0 mean never"""
+
+    def __init__(self, max_bytes=0, max_seconds=0, compress=False):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compress = compress
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """The policy configured with WANDB_SEGMENT_*, or None if segmentation is off"""
+        policy = cls(env.get_segment_bytes(env=environ),
+                     env.get_segment_seconds(env=environ),
+                     env.get_segment_gzip(env=environ))
+        if not policy.max_bytes and not policy.max_seconds:
+            return None
+        return policy
+
+
+class Rotator(object):
+    """Tracks the active file of a segmented file and seals it when it's due"""
+
+    def __init__(self, fname, policy):
+        self.fname = fname
+        self.policy = policy
+        self._opened = time.time()
+        existing = [parse_segment(path)[1]
+                    for path in sealed_segments(fname)]
+        self.next_index = max(existing) + 1 if existing else 1
+
+    def due(self, size):
+        """True if an active file of size bytes should be sealed"""
+        if size == 0:
+            return False
+        if self.policy.max_bytes and size >= self.policy.max_bytes:
+            return True
+        return bool(self.policy.max_seconds and
+                    time.time() - self._opened >= self.policy.max_seconds)
+
+    def seal(self):
+        """Renames the (closed) active file to the next segment, compressing it if
+        the policy says so, and returns the segment path. Segments only ever
+        appear with a rename so watchers never see partial files, a compressed
+        segment is written to a hidden file first.
+        """
+        path = segment_fname(self.fname, self.next_index, self.policy.compress)
+        self.next_index += 1
+        self._opened = time.time()
+        if not self.policy.compress:
+            os.rename(self.fname, path)
+            return path
+        dirname, basename = os.path.split(path)
+        tmp_path = os.path.join(dirname, '.' + basename + '.tmp')
+        with open(self.fname, 'rb') as src:
+            with gzip.open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        os.rename(tmp_path, path)
+        os.remove(self.fname)
+        return path
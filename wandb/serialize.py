@@ -0,0 +1,73 @@
+"""Fast JSON serialization for history, summary, events and metadata rows.
+
+util.json_dumps_safer builds a new encoder for every call and goes through
+WandBJSONEncoder.default for every numpy value. Here encoders are built once
+and reused, numpy scalars are converted with .item() and arrays with a single
+vectorized tolist(). If orjson is installed it's used for rows it can encode
+exactly like the standard library would, everything else falls back to json.
+See benchmarks/serialize_benchmark.py.
+"""
+
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Set to False to always use the standard library encoder
+use_orjson = orjson is not None
+
+
+def _default(obj):
+    """Converts the extra types we support into ones json understands"""
+    if np is not None:
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    raise TypeError('%r is not JSON serializable' % (obj,))
+
+
+_encoders = {}
+
+
+def _encoder(indent):
+    encoder = _encoders.get(indent)
+    if encoder is None:
+        encoder = _encoders[indent] = json.JSONEncoder(
+            default=_default, indent=indent)
+    return encoder
+
+
+def _orjson_dumps(obj):
+    """Returns json from orjson, or None if we need the standard library.
+
+    orjson writes null for NaN and infinity where json writes NaN and Infinity.
+    Rather than walking obj up front we look for null in the (rare) output
+    that has one and let json handle those.
+    """
+    try:
+        encoded = orjson.dumps(obj, default=_default,
+                               option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        return None
+    if b'null' in encoded:
+        return None
+    return encoded.decode('utf-8')
+
+
+def dumps(obj, indent=None):
+    """Convert obj to json, handling numpy values like util.json_dumps_safer"""
+    if use_orjson and indent is None:
+        encoded = _orjson_dumps(obj)
+        if encoded is not None:
+            return encoded
+    return _encoder(indent).encode(obj)
@@ -0,0 +1,111 @@
+"""Moves large values out of history rows and the summary into sidecar files.
+
+Big arrays, strings and nested lists or dicts would otherwise be inlined
+into a history line or wandb-summary.json, which is streamed to the backend
+again on every change. Values whose json is larger than max_bytes are
+written to media/blobs/<sha256>.json, named by their content so a value
+logged many times is only stored (and uploaded) once, and replaced with a
+small reference:
+
+    {"_type": "blob-file", "path": "media/blobs/3a7b...json",
+     "sha256": "3a7b...", "size": 4000012, "shape": [1000, 1000]}
+
+load() turns a reference back into its value.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import six
+
+from wandb import serialize
+from wandb import util
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BLOB_TYPE = 'blob-file'
+BLOB_DIR = os.path.join('media', 'blobs')
+
+
+def is_reference(value):
+    return isinstance(value, dict) and value.get('_type') == BLOB_TYPE
+
+
+def load(value, out_dir='.'):
+    """The value a reference points to, other values are returned as is"""
+    if not is_reference(value):
+        return value
+    with open(os.path.join(out_dir, value['path'])) as f:
+        return json.load(f)
+
+
+class Spiller(object):
+    """Replaces values larger than max_bytes with references to sidecar files"""
+
+    def __init__(self, out_dir='.', max_bytes=100000):
+        self.out_dir = out_dir
+        self.max_bytes = max_bytes
+
+    def _encoded(self, value):
+        """The json of value if it's too big to inline, otherwise None"""
+        if np is not None and isinstance(value, np.ndarray):
+            # numbers take at least a couple of bytes in json
+            if value.size * 2 <= self.max_bytes:
+                return None
+        elif isinstance(value, six.string_types):
+            # utf-8 takes at least one byte a character, no need to encode small ones
+            if len(value) <= self.max_bytes // 6:
+                return None
+        elif not isinstance(value, (list, tuple, dict)) or len(value) == 0:
+            return None
+        encoded = serialize.dumps(value).encode('utf-8')
+        if len(encoded) <= self.max_bytes:
+            return None
+        return encoded
+
+    def spill(self, value):
+        """Returns value, or a reference to the sidecar file it was written to.
+        Typed values (histograms, media metadata, references) are kept as is.
+        """
+        if isinstance(value, dict) and '_type' in value:
+            return value
+        encoded = self._encoded(value)
+        if encoded is None:
+            return value
+        digest = hashlib.sha256(encoded).hexdigest()
+        path = os.path.join(BLOB_DIR, digest + '.json')
+        self._write(path, encoded)
+        ref = {'_type': BLOB_TYPE, 'path': path.replace(os.sep, '/'),
+               'sha256': digest, 'size': len(encoded)}
+        if np is not None and isinstance(value, np.ndarray):
+            ref['shape'] = list(value.shape)
+            ref['dtype'] = str(value.dtype)
+        return ref
+
+    def _write(self, path, encoded):
+        full_path = os.path.join(self.out_dir, path)
+        if os.path.exists(full_path):
+            return
+        base = os.path.dirname(full_path)
+        util.mkdir_exists_ok(base)
+        # the file only appears complete, the watcher ignores .tmp files
+        fd, tmp_path = tempfile.mkstemp(dir=base, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(encoded)
+        try:
+            os.rename(tmp_path, full_path)
+        except OSError:
+            # another thread wrote the same value first (windows)
+            os.remove(tmp_path)
+
+    def spill_row(self, row):
+        """Spills the large values of a row in place, skipping internal keys"""
+        for key, value in list(six.iteritems(row)):
+            if not key.startswith('_'):
+                row[key] = self.spill(value)
+        return row
@@ -1,11 +1,24 @@
 import collections
 import os
 import psutil
-from pynvml import *
+import pynvml
 import time
+from array import array
 from numbers import Number
 import threading
 
+import six
+
+from wandb import env
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# upper bound of samples_to_average, ring buffers hold this many samples
+MAX_SAMPLES = 30
+
 
 class FileStats(object):
     def __init__(self, file_path):
@@ -49,18 +62,516 @@ class Stats(object):
         }
 
 
-class SystemStats(object):
-    def __init__(self, run, api):
+class RingBuffer(object):
+    """A fixed size buffer of floats that overwrites its oldest values, backed by
+    a numpy array (or an array.array without numpy) that's reused between flushes.
+    """
+
+    def __init__(self, size=MAX_SAMPLES):
+        self.size = size
+        if np is not None:
+            self._data = np.zeros(size)
+        else:
+            self._data = array('d', [0.0] * size)
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+    def add(self, value):
+        self._data[self._count % self.size] = value
+        self._count += 1
+
+    def values(self):
+        return self._data[:len(self)]
+
+    def clear(self):
+        self._count = 0
+
+    def aggregates(self):
+        """mean, min, max and 95th percentile (nearest rank without numpy)"""
+        values = self.values()
+        if np is not None:
+            return (float(values.mean()), float(values.min()), float(values.max()),
+                    float(np.percentile(values, 95)))
+        ordered = sorted(values)
+        rank = max(0, int(round(0.95 * len(ordered) + 0.5)) - 1)
+        return (sum(ordered) / len(ordered), ordered[0], ordered[-1],
+                ordered[min(rank, len(ordered) - 1)])
+
+
+class ProcessTree(object):
+    """Resource usage of a process and all of its children (eg. data loader
+    workers), summed.
+
+    psutil.Process handles are kept between samples, cpu_percent needs the
+    same handle to measure usage since the last call, and the tree is only
+    rediscovered every refresh_samples samples. CPU time and io of children
+    that exit are carried over so the totals never go backwards.
+    """
+
+    def __init__(self, pid, refresh_samples=5):
+        self.pid = pid
+        self.refresh_samples = refresh_samples
+        self._procs = {}
+        self._last = {}
+        self._exited = collections.Counter()
+        self._samples = 0
+
+    def _refresh(self):
+        root = self._procs.get(self.pid)
+        if root is None:
+            root = psutil.Process(self.pid)
+        procs = {self.pid: root}
+        for child in root.children(recursive=True):
+            # keep the old handle unless the pid was reused
+            cached = self._procs.get(child.pid)
+            procs[child.pid] = cached if cached == child else child
+        # carry over the counters of children that exited since the last refresh
+        for pid, proc in list(self._procs.items()):
+            if procs.get(pid) is not proc:
+                self._exit(pid)
+        self._procs = procs
+
+    def _exit(self, pid):
+        self._procs.pop(pid, None)
+        self._exited.update(self._last.pop(pid, {}))
+
+    def stats(self):
+        if self._samples % self.refresh_samples == 0 or self.pid not in self._procs:
+            try:
+                self._refresh()
+            except psutil.NoSuchProcess:
+                for pid in list(self._procs):
+                    self._exit(pid)
+        self._samples += 1
+        totals = collections.Counter()
+        gauges = collections.Counter()
+        for pid, proc in list(self._procs.items()):
+            try:
+                with proc.oneshot():
+                    cpu_times = proc.cpu_times()
+                    counters = {"user": cpu_times.user, "system": cpu_times.system}
+                    try:
+                        io = proc.io_counters()
+                        counters["read"] = io.read_bytes
+                        counters["write"] = io.write_bytes
+                    except (AttributeError, psutil.AccessDenied):
+                        # not available on macOS
+                        pass
+                    gauges["cpu"] += proc.cpu_percent()
+                    try:
+                        memory = proc.memory_full_info()
+                        gauges["uss"] += memory.uss
+                    except psutil.AccessDenied:
+                        memory = proc.memory_info()
+                    gauges["rss"] += memory.rss
+                    gauges["memory"] += proc.memory_percent()
+                    gauges["threads"] += proc.num_threads()
+                    if hasattr(proc, "num_fds"):
+                        gauges["fds"] += proc.num_fds()
+                    else:
+                        gauges["fds"] += proc.num_handles()
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                self._exit(pid)
+                continue
+            except psutil.AccessDenied:
+                continue
+            self._last[pid] = counters
+            totals.update(counters)
+        totals.update(self._exited)
+        stats = {
+            "proc.count": len(self._procs),
+            "proc.cpu": round(gauges["cpu"], 2),
+            "proc.memory": round(gauges["memory"], 2),
+            "proc.memory.rssMB": round(gauges["rss"] / 1048576.0, 2),
+            "proc.threads": gauges["threads"],
+            "proc.fds": gauges["fds"],
+            "proc.cpu_time": {"user": round(totals["user"], 2),
+                              "system": round(totals["system"], 2)},
+        }
+        if gauges["uss"]:
+            stats["proc.memory.ussMB"] = round(gauges["uss"] / 1048576.0, 2)
+        if "read" in totals or "write" in totals:
+            stats["proc.io"] = {"read": totals["read"], "write": totals["write"]}
+        return stats
+
+    def pids(self):
+        """The pids found by the last refresh that are still running"""
+        return list(self._procs)
+
+
+def run_dir_device(path):
+    """The mountpoint and device name (as in disk_io_counters) of the
+    filesystem holding path, device is None for eg. overlay or network mounts.
+    """
+    path = os.path.realpath(path)
+    best = None
+    for part in psutil.disk_partitions(all=True):
+        mountpoint = part.mountpoint
+        inside = path == mountpoint or path.startswith(
+            mountpoint.rstrip(os.sep) + os.sep)
+        if inside and (best is None or len(mountpoint) > len(best.mountpoint)):
+            best = part
+    if best is None:
+        return None, None
+    device = os.path.basename(best.device) if best.device.startswith('/dev/') else None
+    return best.mountpoint, device
+
+
+class IORates(object):
+    """Per second network and disk rates from successive psutil counters.
+
+    network.<nic>.sent/recv are bytes/s and .packets_sent/recv packets/s,
+    disk.<device>.read/write are bytes/s, .read_ops/write_ops ops/s and .busy
+    the percent of time the device was busy. Loopback and devices that have
+    been idle since we started aren't reported. disk.run_dir.* are the usage
+    percent and rates of the filesystem holding path (the run directory).
+    """
+    NIC_FIELDS = [("sent", "bytes_sent"), ("recv", "bytes_recv"),
+                  ("packets_sent", "packets_sent"), ("packets_recv", "packets_recv")]
+    DISK_FIELDS = [("read", "read_bytes"), ("write", "write_bytes"),
+                   ("read_ops", "read_count"), ("write_ops", "write_count")]
+
+    def __init__(self, path=None):
+        self.path = path
+        self._device = None
+        if path:
+            try:
+                self._device = run_dir_device(path)[1]
+            except OSError:
+                pass
+        self._previous = None
+        self._active = set()
+
+    @staticmethod
+    def _counters():
+        counters = {}
+        for nic, io in (psutil.net_io_counters(pernic=True) or {}).items():
+            if nic != "lo":
+                counters["network." + nic] = io
+        for disk, io in (psutil.disk_io_counters(perdisk=True) or {}).items():
+            counters["disk." + disk] = io
+        return counters
+
+    def _rates(self, name, io, previous, seconds):
+        fields = self.NIC_FIELDS if name.startswith("network.") else self.DISK_FIELDS
+        rates = {}
+        for key, attr in fields:
+            rates[key] = max(0, getattr(io, attr) - getattr(previous, attr)) / seconds
+        if hasattr(io, "busy_time"):
+            busy = max(0, io.busy_time - previous.busy_time)
+            rates["busy"] = min(100.0, busy / 10.0 / seconds)
+        return rates
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        counters = self._counters()
+        stats = {}
+        if self.path:
+            try:
+                stats["disk.run_dir"] = psutil.disk_usage(self.path).percent
+            except OSError:
+                pass
+        previous = self._previous
+        self._previous = (now, counters)
+        if previous is None or now <= previous[0]:
+            return stats
+        seconds = now - previous[0]
+        for name, io in counters.items():
+            if name not in previous[1]:
+                continue
+            rates = self._rates(name, io, previous[1][name], seconds)
+            if name not in self._active:
+                if not any(rates.values()):
+                    continue
+                self._active.add(name)
+            for key, rate in rates.items():
+                stats["%s.%s" % (name, key)] = round(rate, 2)
+            if name == "disk.%s" % self._device:
+                for key, rate in rates.items():
+                    stats["disk.run_dir.%s" % key] = round(rate, 2)
+        return stats
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _read_keyed(path):
+    """Parses "key value" lines, eg. cpu.stat"""
+    text = _read(path)
+    if text is None:
+        return None
+    values = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            try:
+                values[parts[0]] = int(parts[1])
+            except ValueError:
+                pass
+    return values
+
+
+def _read_int(path):
+    text = _read(path)
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        # "max" or missing
+        return None
+
+
+def _read_pressure(path):
+    """The avg10 of the some and full lines of a PSI file"""
+    text = _read(path)
+    if text is None:
+        return None
+    pressure = {}
+    for line in text.splitlines():
+        parts = line.split()
+        for part in parts[1:]:
+            if part.startswith("avg10="):
+                pressure[parts[0]] = float(part[len("avg10="):])
+    return pressure
+
+
+# v1 reports "unlimited" as a huge page aligned number
+UNLIMITED = 2 ** 60
+
+
+class CgroupStats(object):
+    """CPU throttling, memory and pressure (PSI) of the cgroup we're in, from
+    cgroup v2 or the cpu and memory controllers of v1.
+
+    cgroup.cpu is usage as a percent of one cpu, cgroup.cpu.limit the quota in
+    cpus, cgroup.cpu.throttled the percent of time throttled and
+    cgroup.cpu.throttled_periods the periods throttled since the last sample.
+    cgroup.pressure.<cpu|memory|io>.<some|full> are the avg10 PSI values.
+    """
+
+    def __init__(self, root=None, proc_cgroup='/proc/self/cgroup'):
+        self.root = root or env.get_cgroup_root()
+        self.version = 2 if os.path.exists(
+            os.path.join(self.root, "cgroup.controllers")) else 1
+        paths = self._own_paths(proc_cgroup)
+        if self.version == 2:
+            self.cpu_dir = self.memory_dir = self._dir("", paths.get(""))
+            self.cpuacct_dir = None
+        else:
+            self.cpu_dir = self._dir("cpu", paths.get("cpu")) or self._dir(
+                "cpu,cpuacct", paths.get("cpu"))
+            self.cpuacct_dir = self._dir("cpuacct", paths.get("cpuacct")) or self.cpu_dir
+            self.memory_dir = self._dir("memory", paths.get("memory"))
+        self._previous = None
+
+    @staticmethod
+    def _own_paths(proc_cgroup):
+        """Controller -> our cgroup path, "" for the v2 hierarchy"""
+        paths = {}
+        for line in (_read(proc_cgroup) or "").splitlines():
+            parts = line.split(":", 2)
+            if len(parts) == 3:
+                for controller in parts[1].split(","):
+                    paths[controller] = parts[2]
+        return paths
+
+    def _dir(self, controller, path):
+        """Our cgroup's directory, or the controller's root if it isn't visible
+        (eg. we're in a cgroup namespace)
+        """
+        base = os.path.join(self.root, controller)
+        candidates = [base]
+        if path and path != "/":
+            candidates.insert(0, os.path.join(base, path.lstrip("/")))
+        for candidate in candidates:
+            if os.path.isdir(candidate):
+                return candidate
+        return None
+
+    @property
+    def available(self):
+        return bool(self.cpu_dir or self.memory_dir)
+
+    def _cpu(self):
+        """usage and throttled time in usec, periods and throttled periods"""
+        if self.version == 2:
+            stat = _read_keyed(os.path.join(self.cpu_dir, "cpu.stat")) or {}
+            return (stat.get("usage_usec"), stat.get("throttled_usec"),
+                    stat.get("nr_periods"), stat.get("nr_throttled"))
+        stat = _read_keyed(os.path.join(self.cpu_dir, "cpu.stat")) or {}
+        usage = _read_int(os.path.join(self.cpuacct_dir, "cpuacct.usage"))
+        throttled = stat.get("throttled_time")
+        return (usage // 1000 if usage is not None else None,
+                throttled // 1000 if throttled is not None else None,
+                stat.get("nr_periods"), stat.get("nr_throttled"))
+
+    def _cpu_limit(self):
+        if self.version == 2:
+            parts = (_read(os.path.join(self.cpu_dir, "cpu.max")) or "").split()
+            if len(parts) == 2 and parts[0] != "max":
+                return float(parts[0]) / float(parts[1])
+            return None
+        quota = _read_int(os.path.join(self.cpu_dir, "cpu.cfs_quota_us"))
+        period = _read_int(os.path.join(self.cpu_dir, "cpu.cfs_period_us"))
+        if quota and quota > 0 and period:
+            return float(quota) / period
+        return None
+
+    def _memory(self):
+        if self.version == 2:
+            return (_read_int(os.path.join(self.memory_dir, "memory.current")),
+                    _read_int(os.path.join(self.memory_dir, "memory.max")))
+        limit = _read_int(os.path.join(self.memory_dir, "memory.limit_in_bytes"))
+        return (_read_int(os.path.join(self.memory_dir, "memory.usage_in_bytes")),
+                limit if limit is not None and limit < UNLIMITED else None)
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        stats = {}
+        if self.cpu_dir:
+            cpu = self._cpu()
+            limit = self._cpu_limit()
+            if limit:
+                stats["cgroup.cpu.limit"] = round(limit, 2)
+            previous, self._previous = self._previous, (now, cpu)
+            if previous is not None and now > previous[0]:
+                usec = (now - previous[0]) * 1e6
+                deltas = [None if c is None or p is None else max(0, c - p)
+                          for c, p in zip(cpu, previous[1])]
+                if deltas[0] is not None:
+                    stats["cgroup.cpu"] = round(deltas[0] / usec * 100, 2)
+                if deltas[1] is not None:
+                    stats["cgroup.cpu.throttled"] = round(min(100.0, deltas[1] / usec * 100), 2)
+                if deltas[3] is not None:
+                    stats["cgroup.cpu.throttled_periods"] = deltas[3]
+        if self.memory_dir:
+            current, limit = self._memory()
+            if current is not None:
+                stats["cgroup.memory.currentMB"] = round(current / 1048576.0, 2)
+                if limit:
+                    stats["cgroup.memory.maxMB"] = round(limit / 1048576.0, 2)
+                    stats["cgroup.memory"] = round(current * 100.0 / limit, 2)
+        if self.version == 2 and self.cpu_dir:
+            for resource in ("cpu", "memory", "io"):
+                pressure = _read_pressure(os.path.join(self.cpu_dir, resource + ".pressure"))
+                for kind, value in six.iteritems(pressure or {}):
+                    stats["cgroup.pressure.%s.%s" % (resource, kind)] = value
+        return stats
+
+
+class GPUBackend(object):
+    """Where SystemStats gets GPU stats from. This one has no GPUs, see
+    NvmlBackend. stats(pids) returns the gpu.<index>.* stats of every device,
+    pids are the processes whose GPU memory is reported as
+    gpu.<index>.process.memoryUsedMB.
+    """
+    device_count = 0
+
+    def stats(self, pids=()):
+        return {}
+
+
+class NvmlBackend(GPUBackend):
+    """GPU stats from NVML. Device handles are looked up once and calls a
+    device doesn't support (eg. power on consumer cards) aren't retried.
+
+    gpu.<i>.gpu and gpu.<i>.memory are the percent of time the GPU and its
+    memory bus were busy, gpu.<i>.memoryAllocated the percent of memory
+    used, and powerPercent the power draw as a percent of the enforced limit.
+    """
+
+    def __init__(self, nvml=pynvml):
+        self.nvml = nvml
+        self._handles = []
+        self._unsupported = set()
         try:
-            nvmlInit()
-            self.gpu_count = nvmlDeviceGetCount()
-        except NVMLError as err:
-            self.gpu_count = 0
+            nvml.nvmlInit()
+            self._handles = [nvml.nvmlDeviceGetHandleByIndex(i)
+                             for i in range(nvml.nvmlDeviceGetCount())]
+        except nvml.NVMLError:
+            self._handles = []
+
+    @property
+    def device_count(self):
+        return len(self._handles)
+
+    def _call(self, index, name, *args):
+        """Calls nvml.<name>(handle, *args), None if it isn't supported"""
+        if (index, name) in self._unsupported:
+            return None
+        try:
+            return getattr(self.nvml, name)(self._handles[index], *args)
+        except self.nvml.NVMLError as err:
+            if getattr(err, "value", None) == getattr(self.nvml, "NVML_ERROR_NOT_SUPPORTED", None):
+                self._unsupported.add((index, name))
+            return None
+
+    def stats(self, pids=()):
+        nvml = self.nvml
+        pids = set(pids)
+        stats = {}
+        for i in range(len(self._handles)):
+            prefix = "gpu.%i." % i
+            util = self._call(i, "nvmlDeviceGetUtilizationRates")
+            if util is not None:
+                stats[prefix + "gpu"] = util.gpu
+                stats[prefix + "memory"] = util.memory
+            temp = self._call(i, "nvmlDeviceGetTemperature", nvml.NVML_TEMPERATURE_GPU)
+            if temp is not None:
+                stats[prefix + "temp"] = temp
+            memory = self._call(i, "nvmlDeviceGetMemoryInfo")
+            if memory is not None:
+                stats[prefix + "memoryUsedMB"] = round(memory.used / 1048576.0, 2)
+                if memory.total:
+                    stats[prefix + "memoryAllocated"] = round(memory.used * 100.0 / memory.total, 2)
+            power = self._call(i, "nvmlDeviceGetPowerUsage")
+            if power is not None:
+                # milliwatts
+                stats[prefix + "powerWatts"] = round(power / 1000.0, 2)
+                limit = self._call(i, "nvmlDeviceGetEnforcedPowerLimit")
+                if limit:
+                    stats[prefix + "powerPercent"] = round(power * 100.0 / limit, 2)
+            for key, clock in (("smClock", nvml.NVML_CLOCK_SM), ("memoryClock", nvml.NVML_CLOCK_MEM)):
+                mhz = self._call(i, "nvmlDeviceGetClockInfo", clock)
+                if mhz is not None:
+                    stats[prefix + key] = mhz
+            if pids:
+                processes = self._call(i, "nvmlDeviceGetComputeRunningProcesses")
+                if processes is not None:
+                    used = sum(p.usedGpuMemory or 0 for p in processes if p.pid in pids)
+                    stats[prefix + "process.memoryUsedMB"] = round(used / 1048576.0, 2)
+        return stats
+
+
+class SystemStats(object):
+    """Samples system stats every sample_rate_seconds, and every
+    samples_to_average samples tracks a "system" event with the mean of each
+    numeric stat plus its .min, .max and .p95, and the time spent sampling.
+    Once pid is set the process tree of the user process is included too.
+    GPU stats come from gpu, a GPUBackend that defaults to NVML.
+    """
+
+    def __init__(self, run, api, gpu=None):
+        self.gpu = gpu if gpu is not None else NvmlBackend()
+        self.gpu_count = self.gpu.device_count
         self.run = run
         self._api = api
         self.sampler = {}
         self.samples = 0
-        self._shutdown = False
+        self._last_sample = None
+        self._sample_seconds = 0.0
+        self._stop = threading.Event()
+        self._process_tree = None
+        self._io = IORates(getattr(run, "dir", None))
+        self._cgroup = CgroupStats()
+        if not self._cgroup.available:
+            self._cgroup = None
         net = psutil.net_io_counters()
         self.network_init = {
             "sent": net.bytes_sent,
@@ -72,6 +583,15 @@ class SystemStats(object):
     def start(self):
         self._thread.start()
 
+    @property
+    def pid(self):
+        return self._process_tree and self._process_tree.pid
+
+    @pid.setter
+    def pid(self, pid):
+        """The user process, set once it's running"""
+        self._process_tree = ProcessTree(pid) if pid else None
+
     @property
     def sample_rate_seconds(self):
         """Sample system stats every this many seconds, defaults to 2, min is 0.5"""
@@ -84,55 +604,59 @@ class SystemStats(object):
 
     def _thread_body(self):
         while True:
-            stats = self.stats()
-            for stat, value in stats.items():
-                if isinstance(value, Number):
-                    self.sampler[stat] = self.sampler.get(stat, [])
-                    self.sampler[stat].append(value)
-            self.samples += 1
-            if self._shutdown or self.samples >= self.samples_to_average:
+            self.sample()
+            if self._stop.is_set():
+                self.flush()
+                break
+            if self.samples >= self.samples_to_average:
                 self.flush()
-                if self._shutdown:
-                    break
-            seconds = 0
-            while seconds < self.sample_rate_seconds:
-                time.sleep(0.1)
-                seconds += 0.1
-                if self._shutdown:
-                    break
+            self._stop.wait(self.sample_rate_seconds)
 
     def shutdown(self):
-        self._shutdown = True
+        self._stop.set()
         try:
             self._thread.join()
         # Incase we never start it
         except RuntimeError:
             pass
 
-    def flush(self):
+    def sample(self):
+        start = time.time()
         stats = self.stats()
         for stat, value in stats.items():
+            if isinstance(value, Number):
+                buf = self.sampler.get(stat)
+                if buf is None:
+                    buf = self.sampler[stat] = RingBuffer()
+                buf.add(value)
+        self._last_sample = stats
+        self.samples += 1
+        self._sample_seconds += time.time() - start
+
+    def flush(self):
+        if not self.samples:
+            self.sample()
+        stats = dict(self._last_sample)
+        for stat, buf in self.sampler.items():
             # TODO: a bit hacky, we assume all numbers should be averaged.  If you want
             # max for a stat, you must put it in a sub key, like ["network"]["sent"]
-            if isinstance(value, Number):
-                samples = list(self.sampler.get(stat, [stats[stat]]))
-                stats[stat] = round(sum(samples) / len(samples), 2)
+            if len(buf):
+                mean, low, high, p95 = buf.aggregates()
+                stats[stat] = round(mean, 2)
+                stats[stat + ".min"] = round(low, 2)
+                stats[stat + ".max"] = round(high, 2)
+                stats[stat + ".p95"] = round(p95, 2)
+            buf.clear()
+        stats["sampler"] = {
+            "samples": self.samples,
+            "ms": round(self._sample_seconds / self.samples * 1000, 3)
+        }
         self.run.events.track("system", stats, _wandb=True)
         self.samples = 0
-        self.sampler = {}
+        self._sample_seconds = 0.0
 
     def stats(self):
         stats = {}
-        for i in range(0, self.gpu_count):
-            handle = nvmlDeviceGetHandleByIndex(i)
-            try:
-                util = nvmlDeviceGetUtilizationRates(handle)
-                temp = nvmlDeviceGetTemperature(handle, NVML_TEMPERATURE_GPU)
-                stats["gpu.{0}.{1}".format(i, "gpu")] = util.gpu
-                stats["gpu.{0}.{1}".format(i, "memory")] = util.memory
-                stats["gpu.{0}.{1}".format(i, "temp")] = temp
-            except NVMLError as err:
-                pass
         net = psutil.net_io_counters()
         stats["cpu"] = psutil.cpu_percent()
         stats["memory"] = psutil.virtual_memory().percent
@@ -142,4 +666,14 @@ class SystemStats(object):
         }
         # TODO: maybe show other partitions, will likely need user to configure
         stats["disk"] = psutil.disk_usage('/').percent
+        stats.update(self._io.stats())
+        if self._cgroup is not None:
+            stats.update(self._cgroup.stats())
+        process_tree = self._process_tree
+        pids = ()
+        if process_tree is not None:
+            stats.update(process_tree.stats())
+            pids = process_tree.pids()
+        if self.gpu_count:
+            stats.update(self.gpu.stats(pids))
         return stats
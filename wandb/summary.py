@@ -1,36 +1,172 @@
+import contextlib
 import json
 import os
+import threading
+import time
 
 import wandb
-from wandb import util
+from wandb import serialize
+from wandb import spill
 from wandb.meta import Meta
 import six
 
 SUMMARY_FNAME = 'wandb-summary.json'
+# hidden so the file watcher doesn't upload it
+JOURNAL_FNAME = '.wandb-summary.journal.jsonl'
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        # python 2, rename only overwrites on posix
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
 
 
 class Summary(object):
-    """Used to store summary metrics during and after a run."""
+    """Used to store summary metrics during and after a run.
+
+    By default every change rewrites wandb-summary.json. In journal mode
+    changes are appended to a small journal instead and the json snapshot is
+    rewritten at most every compact_interval seconds and on close(). Values
+    with json larger than spill_bytes are written to media/blobs, see spill.py.
+    """
 
-    def __init__(self, out_dir='.'):
+    def __init__(self, out_dir='.', journal=False, compact_interval=1.0, spill_bytes=0):
         self._fname = os.path.join(out_dir, SUMMARY_FNAME)
+        self._journal_fname = os.path.join(out_dir, JOURNAL_FNAME)
+        self._journal = journal
+        self._compact_interval = compact_interval
+        self._journal_file = None
+        self._spiller = spill.Spiller(out_dir, spill_bytes) if spill_bytes else None
+        self._lock = threading.RLock()
+        self._timer = None
+        self._last_compaction = 0
+        self._dirty = False
+        self._batch_depth = 0
+        self._pending = {}
+        self._removed = set()
         self.load()
 
     def load(self):
+        with self._lock:
+            try:
+                self._summary = json.load(open(self._fname))
+            except (IOError, ValueError):
+                self._summary = {}
+            self._replay()
+
+    def _replay(self):
+        """Applies changes journaled since the last compaction"""
         try:
-            self._summary = json.load(open(self._fname))
-        except (IOError, ValueError):
-            self._summary = {}
+            f = open(self._journal_fname)
+        except IOError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn final line
+                    continue
+                for k in record.get("del", []):
+                    self._summary.pop(k, None)
+                self._summary.update(record.get("set", {}))
 
     def _write(self):
-        with open(self._fname, 'w') as f:
-            s = util.json_dumps_safer(self._summary, indent=4)
+        tmp_fname = self._fname + '.tmp'
+        with open(tmp_fname, 'w') as f:
+            s = serialize.dumps(self._summary, indent=4)
             f.write(s)
             f.write('\n')
+        _replace(tmp_fname, self._fname)
+
+    def _commit(self, changed=None, removed=()):
+        """Records changed and removed keys, once per batch"""
+        with self._lock:
+            if self._batch_depth:
+                for k in removed:
+                    self._pending.pop(k, None)
+                    self._removed.add(k)
+                for k, v in six.iteritems(changed or {}):
+                    self._removed.discard(k)
+                    self._pending[k] = v
+                return
+            if not self._journal:
+                self._write()
+                return
+            if self._journal_file is None:
+                self._journal_file = open(self._journal_fname, 'a')
+            record = {}
+            if changed:
+                record["set"] = changed
+            if removed:
+                record["del"] = list(removed)
+            self._journal_file.write(serialize.dumps(record) + '\n')
+            self._journal_file.flush()
+            self._dirty = True
+            self._schedule_compaction()
+
+    def _schedule_compaction(self):
+        wait = self._last_compaction + self._compact_interval - time.time()
+        if wait <= 0:
+            self._compact()
+        elif self._timer is None:
+            self._timer = threading.Timer(wait, self._compact)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _compact(self):
+        """Rewrites the snapshot and empties the journal"""
+        with self._lock:
+            self._timer = None
+            if not self._dirty:
+                return
+            self._write()
+            if self._journal_file is not None:
+                self._journal_file.close()
+            self._journal_file = open(self._journal_fname, 'w')
+            self._last_compaction = time.time()
+            self._dirty = False
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Commits all changes made inside the block at once
+
+        with run.summary.batch():
+            for k, v in metrics.items():
+                run.summary[k] = v
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth and (self._pending or self._removed):
+                    changed, removed = self._pending, self._removed
+                    self._pending, self._removed = {}, set()
+                    self._commit(changed, removed)
+
+    def close(self):
+        """Writes out journaled changes"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._compact()
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
+                os.remove(self._journal_fname)
 
     def _transform(self, v):
         if isinstance(v, wandb.Histogram):
             return wandb.Histogram.transform(v)
+        elif self._spiller:
+            return self._spiller.spill(v)
         else:
             return v
 
@@ -38,15 +174,15 @@ class Summary(object):
         return self._summary[k]
 
     def __setitem__(self, k, v):
-        self._summary[k] = self._transform(v)
-        self._write()
+        with self._lock:
+            v = self._summary[k] = self._transform(v)
+            self._commit({k: v})
 
     def __setattr__(self, k, v):
         if k.startswith("_"):
             super(Summary, self).__setattr__(k, v)
         else:
-            self._summary[k] = self._transform(v)
-            self._write()
+            self[k] = v
 
     def __getattr__(self, k):
         if k.startswith("_"):
@@ -55,8 +191,9 @@ class Summary(object):
             return self._summary[k]
 
     def __delitem__(self, k):
-        del self._summary[k]
-        self._write()
+        with self._lock:
+            del self._summary[k]
+            self._commit(removed=[k])
 
     def __repr__(self):
         return json.dumps(self._summary, indent=4)
@@ -72,5 +209,6 @@ class Summary(object):
             if isinstance(v, dict) and v.get("_type") == "image":
                 continue
             summary[k] = self._transform(v)
-        self._summary.update(summary)
-        self._write()
+        with self._lock:
+            self._summary.update(summary)
+            self._commit(summary)
@@ -1,6 +1,8 @@
 import collections
 import sys
 
+import six
+
 import wandb
 
 TYPE_TO_TYPESTRING = {
@@ -19,6 +21,16 @@ VALID_TYPE_NAMES = [
         t.__module__, t.__name__)
     for t in TYPE_TO_TYPESTRING.keys()]
 
+# json encodes these as is, so they don't need encoding
+PLAIN_TYPES = (str, int, float)
+
+
+def _converter(type_):
+    """The function turning values into what's stored for a column of type_"""
+    if type_ in PLAIN_TYPES:
+        return type_
+    return lambda val: type_(val).encode()
+
 
 class TypedTable(object):
     """A table of typed data.
@@ -81,5 +93,50 @@ class TypedTable(object):
         self._output.add(mapped_row)
         self._count += 1
 
+    def add_rows(self, rows):
+        """Add many rows to the table at once. Each column is converted in one
+        pass and, if the output supports it, the batch is handed over as columns.
+
+        Args:
+            rows: A list of dicts, as passed to add.
+        """
+        if not self._types:
+            raise wandb.Error(
+                'TypedTable.set_columns must be called before add_rows.')
+        rows = list(rows)
+        keys = set()
+        for row in rows:
+            keys.update(row)
+        for key in keys:
+            if key not in self._types:
+                raise wandb.Error(
+                    'TypedTable.add_rows received key ("%s") which wasn\'t provided to set_columns' % key)
+        columns = {}
+        for key in keys:
+            convert = _converter(self._types[key])
+            values = columns[key] = []
+            for row in rows:
+                if key not in row:
+                    values.append(None)
+                    continue
+                val = row[key]
+                try:
+                    values.append(convert(val))
+                except Exception:
+                    raise wandb.Error('TypedTable.add_rows couldn\'t convert and encode ("%s") provided for key ("%s") to type (%s)' % (
+                        val, key, self._types[key]))
+        if hasattr(self._output, 'add_columns'):
+            self._output.add_columns(columns, len(rows))
+        else:
+            for i in range(len(rows)):
+                self._output.add(dict((key, values[i]) for key, values in six.iteritems(columns)
+                                      if values[i] is not None))
+        self._count += len(rows)
+
     def count(self):
         return self._count
+
+    def close(self):
+        """Writes out rows the output is buffering"""
+        if hasattr(self._output, 'close'):
+            self._output.close()
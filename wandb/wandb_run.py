@@ -4,10 +4,13 @@ import shortuuid
 import socket
 
 import wandb
+from wandb import binary_history
+from wandb import env
 from wandb import history
 from wandb import jsonlfile
 from wandb import summary
 from wandb import meta
+from wandb import segments
 from wandb import typedtable
 from wandb import util
 from wandb.api import Api
@@ -17,8 +20,10 @@ import atexit
 import sys
 
 HISTORY_FNAME = 'wandb-history.jsonl'
+BINARY_HISTORY_FNAME = 'wandb-history.bin'
 EVENTS_FNAME = 'wandb-events.jsonl'
 EXAMPLES_FNAME = 'wandb-examples.jsonl'
+EXAMPLES_COLUMNAR_FNAME = 'wandb-examples.columns.jsonl'
 DESCRIPTION_FNAME = 'description.md'
 
 
@@ -180,34 +185,59 @@ class Run(object):
         # We use this to track whether user has accessed summary
         self._user_accessed_summary = True
         if self._summary is None:
-            self._summary = summary.Summary(self._dir)
+            self._summary = self._new_summary()
         return self._summary
 
+    def _new_summary(self):
+        return summary.Summary(self._dir, journal=env.get_summary_journal(),
+                               compact_interval=env.get_summary_compact_seconds(),
+                               spill_bytes=env.get_spill_bytes())
+
     @property
     def has_summary(self):
         return self._summary or os.path.exists(os.path.join(self._dir, summary.SUMMARY_FNAME))
 
     def _history_added(self, row):
         if self._summary is None:
-            self._summary = summary.Summary(self._dir)
+            self._summary = self._new_summary()
         if not self._user_accessed_summary:
+            values = self._history.summary_values() if self._history else None
+            if values:
+                row = dict(row)
+                row.update(values)
             self._summary.update(row)
 
     @property
     def history(self):
         if self._history is None:
+            if self._binary_history:
+                fname, writer = BINARY_HISTORY_FNAME, binary_history.BinaryWriter
+            else:
+                fname, writer = HISTORY_FNAME, history.JsonlWriter
             self._history = history.History(
-                HISTORY_FNAME, self._dir, add_callback=self._history_added)
+                fname, self._dir, add_callback=self._history_added,
+                async_writes=env.get_async_history(), writer=writer,
+                retain_rows=env.get_history_retain_rows(),
+                media_workers=env.get_media_workers(),
+                segment_policy=None if self._binary_history else segments.SegmentPolicy.from_env(),
+                keyframe_interval=0 if self._binary_history else env.get_history_keyframe_interval(),
+                spill_bytes=env.get_spill_bytes())
         return self._history
 
+    @property
+    def _binary_history(self):
+        return env.get_history_format() == 'binary'
+
     @property
     def has_history(self):
-        return self._history or os.path.exists(os.path.join(self._dir, HISTORY_FNAME))
+        return self._history or os.path.exists(os.path.join(self._dir, HISTORY_FNAME)) or \
+            os.path.exists(os.path.join(self._dir, BINARY_HISTORY_FNAME))
 
     @property
     def events(self):
         if self._events is None:
-            self._events = jsonlfile.JsonlEventsFile(EVENTS_FNAME, self._dir)
+            self._events = jsonlfile.JsonlEventsFile(
+                EVENTS_FNAME, self._dir, segment_policy=segments.SegmentPolicy.from_env())
         return self._events
 
     @property
@@ -217,13 +247,16 @@ class Run(object):
     @property
     def examples(self):
         if self._examples is None:
-            self._examples = typedtable.TypedTable(
-                jsonlfile.JsonlFile(EXAMPLES_FNAME, self._dir))
+            columnar = env.get_examples_columnar()
+            self._examples = typedtable.TypedTable(jsonlfile.JsonlFile(
+                EXAMPLES_COLUMNAR_FNAME if columnar else EXAMPLES_FNAME,
+                self._dir, columnar=columnar))
         return self._examples
 
     @property
     def has_examples(self):
-        return self._examples or os.path.exists(os.path.join(self._dir, EXAMPLES_FNAME))
+        return self._examples or any(os.path.exists(os.path.join(self._dir, fname))
+                                     for fname in (EXAMPLES_FNAME, EXAMPLES_COLUMNAR_FNAME))
 
     @property
     def description_path(self):
@@ -253,9 +286,19 @@ class Run(object):
         if self._events is not None:
             self._events.close()
             self._events = None
+        if self._examples is not None:
+            self._examples.close()
+            self._examples = None
         if self._history is not None:
             self._history.close()
+            if self._binary_history:
+                # the backend only understands jsonl history
+                binary_history.to_jsonl(self._history.fname,
+                                        os.path.join(self._dir, HISTORY_FNAME))
             self._history = None
+        # closing the history may still update the summary
+        if self._summary is not None:
+            self._summary.close()
 
 
 def generate_id():
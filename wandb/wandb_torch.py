@@ -72,14 +72,20 @@ class TorchHistory(object):
             raise TypeError('Expected Tensor, not {}.{}'.format(
                 cls.__module__, cls.__name__))
         history = self._history()
-        if history is None or not history.compute:
+        if history is None:
+            return
+        self._log_tensor_stats(tensor, name, history._row_state())
+
+    def _log_tensor_stats(self, tensor, name, state):
+        """Adds the stats to the row of the thread state belongs to"""
+        if not state.compute:
             return
         flat = tensor.view(-1)
         l = len(flat)
         # kthvalue uses 1-based indexing for some reason
         i0_05 = max(1, min(int(round(0.05 * l)), l))
         i0_95 = max(1, min(int(round(0.95 * l)), l))
-        history.row.update({
+        state.row.update({
             name + '-0.00': tensor.min(),
             name + '-0.05': flat.kthvalue(i0_05)[0][0],
             name + '-0.50': tensor.median(),
@@ -103,8 +109,14 @@ class TorchHistory(object):
             raise ValueError(
                 'A hook has already been set under name "{}"'.format(name))
 
+        # backward hooks can run on autograd threads, log to the row of the
+        # thread that set them
+        history = self._history()
+        state = history._row_state() if history is not None else None
+
         def callback(grad):
-            self.log_tensor_stats(grad.data, name)
+            if state is not None:
+                self._log_tensor_stats(grad.data, name, state)
             self.unhook(name)
 
         handle = var.register_hook(callback)